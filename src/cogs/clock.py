@@ -1,3 +1,5 @@
+import asyncio
+import time
 from datetime import datetime, timedelta, timezone
 
 import disnake
@@ -5,9 +7,19 @@ from disnake.ext import commands, tasks
 from PIL import Image
 
 from main import tracked_templates
-from utils.discord_utils import get_image_url, image_to_file
+from utils.discord_utils import get_image_url, png_to_file
 from utils.log import get_logger
-from utils.setup import db_servers, db_stats, db_templates, db_users, stats, ws_client
+from utils.setup import (
+    board_renders,
+    db_conn,
+    db_retention,
+    db_servers,
+    db_stats,
+    db_templates,
+    db_users,
+    stats,
+    ws_client,
+)
 from utils.time_converter import local_to_utc
 
 logger = get_logger("clock")
@@ -22,10 +34,14 @@ class Clock(commands.Cog):
         self.bot: commands.Bot = bot
         self.update_stats.start()
         self.update_online_count.start()
+        self.check_db_health.start()
+        self.apply_retention.start()
 
     def cog_unload(self):
         self.update_stats.cancel()
         self.update_online_count.cancel()
+        self.check_db_health.cancel()
+        self.apply_retention.cancel()
 
     @tasks.loop(seconds=60)
     async def update_stats(self):
@@ -90,6 +106,7 @@ class Clock(commands.Cog):
             record_id = await self.create_record()
             if record_id is None:
                 # there is already a record saved for the current time
+                ws_client.pause()
                 try:
                     await self.update_boards()
                     logger.debug("Board updated.")
@@ -97,6 +114,7 @@ class Clock(commands.Cog):
                     logger.error(f"Couldn't update boards: {e}")
                 except Exception:
                     logger.exception("Couldn't update boards:")
+                ws_client.resume()
                 return
 
             # save the new stats data in the database
@@ -198,6 +216,31 @@ class Clock(commands.Cog):
         ) + timedelta(minutes=time_interval)
         await disnake.utils.sleep_until(next_run)
 
+    @tasks.loop(minutes=5)
+    async def check_db_health(self):
+        """Replace the database connections that stopped working."""
+        try:
+            if not await db_conn.check_health():
+                logger.warning("Database connections pool repaired.")
+        except Exception:
+            logger.exception("Unexpected exception in task 'check_db_health'")
+
+    @check_db_health.before_loop
+    async def before_check_db_health(self):
+        await self.bot.wait_until_ready()
+
+    @tasks.loop(hours=1)
+    async def apply_retention(self):
+        """Downsample the stats of the old canvases and optimize the database."""
+        try:
+            await db_retention.run()
+        except Exception:
+            logger.exception("Unexpected exception in task 'apply_retention'")
+
+    @apply_retention.before_loop
+    async def before_apply_retention(self):
+        await self.bot.wait_until_ready()
+
     async def check_milestones(self):
         """Send alerts in all the servers following a user if they hit a milestone."""
 
@@ -232,8 +275,7 @@ class Clock(commands.Cog):
         if not channels:
             return
         snapshot_saved = False
-        array = stats.palettize_array(stats.board_array)
-        board_img = Image.fromarray(array)
+        board_png = await board_renders.get_png("current")
         snapshot_time = datetime.now(timezone.utc)
         filename = f"snapshot_{snapshot_time.strftime('%FT%H%M')}.png"
 
@@ -242,7 +284,7 @@ class Clock(commands.Cog):
                 channel = self.bot.get_channel(int(channel_id))
                 embed = disnake.Embed(title="Canvas Snapshot", color=0x66C5CC)
                 embed.timestamp = snapshot_time
-                file = await image_to_file(board_img, filename, embed)
+                file = png_to_file(board_png, filename, embed)
                 m = await channel.send(file=file, embed=embed)
             except Exception:
                 continue
@@ -276,6 +318,8 @@ class Clock(commands.Cog):
         canvas_stats = stats.get_all_canvas_stats()
 
         await db_stats.update_all_pxls_stats(alltime_stats, canvas_stats, record_id)
+        await db_stats.rollups.update_user_stats()
+        await db_stats.update_latest_leaderboard()
 
     async def save_color_stats(self, record_id):
         # get the board with the placeable pixels only
@@ -319,12 +363,21 @@ class Clock(commands.Cog):
         """save the current 'online count' in the database"""
         online = stats.online_count
         await stats.update_online_count(online)
+        await db_stats.rollups.update_general_stats()
 
     async def update_boards(self):
-        # update the canvas boards
-        await stats.fetch_board()
-        await stats.fetch_virginmap()
-        await stats.fetch_placemap()
+        # update the canvas boards at the same time
+        start = time.perf_counter()
+        results = await asyncio.gather(
+            stats.fetch_board(),
+            stats.fetch_virginmap(),
+            stats.fetch_placemap(),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        logger.debug(f"Boards fetched in {time.perf_counter() - start:.2f}s.")
 
     async def update_template_stats(self):
         """Update all the tracked templates"""
@@ -1,6 +1,7 @@
 from datetime import datetime, timedelta, timezone
 
 import disnake
+import numpy as np
 import plotly.graph_objects as go
 from disnake.ext import commands
 
@@ -117,8 +118,6 @@ class ColorsGraph(commands.Cog):
             placed_opt = True
 
         canvas_code = await stats.get_canvas_code()
-        data = await db_stats.get_canvas_color_stats(canvas_code, dt1, dt2)
-
         palette = await db_stats.get_palette(canvas_code)
 
         # initialise a data dictionary for each color
@@ -136,17 +135,18 @@ class ColorsGraph(commands.Cog):
             )
             data_list.append(color_dict)
 
-        # add the data to the dict
-        for value in data:
-            color_id = value["color_id"]
-            dt = value["datetime"]
-            if placed_opt:
-                pixels = value["amount_placed"]
-            else:
-                pixels = value["amount"]
-
-            data_list[color_id]["values"].append(pixels)
-            data_list[color_id]["datetimes"].append(dt)
+        # add the data to the dict, one batch of rows at a time
+        value_column = "amount_placed" if placed_opt else "amount"
+        async with db_stats.iter_canvas_color_stats(
+            canvas_code, dt1, dt2, as_arrays=True
+        ) as batches:
+            async for batch in batches:
+                color_ids = batch["color_id"]
+                for color_id in np.unique(color_ids):
+                    mask = color_ids == color_id
+                    color_dict = data_list[color_id]
+                    color_dict["values"].extend(batch[value_column][mask].tolist())
+                    color_dict["datetimes"].extend(batch["datetime"][mask].tolist())
 
         if parsed_args.last:
             for d in data_list:
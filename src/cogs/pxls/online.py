@@ -144,17 +144,12 @@ class Online(commands.Cog):
             if canvas != current_canvas:
                 last_bar_darker = False
 
-        data = await db_stats.get_general_stat(
-            "online_count",
-            dt1,
-            dt2,
-            canvas,
-        )
-        if not data:
-            return await ctx.send(":x: No data found for this canvas.")
-        t0 = data[0]["datetime"]
-        t1 = data[-1]["datetime"]
-
+        # the averages per period are already computed in the rollups
+        rollup = None
+        if groupby:
+            rollup = await db_stats.rollups.get_grouped_general_stat(
+                "online_count", dt1, dt2, groupby, canvas
+            )
         if groupby:
             if groupby == "month":
                 format = "%Y-%m"
@@ -165,25 +160,61 @@ class Online(commands.Cog):
             elif groupby == "hour":
                 format = "%Y-%m-%d %H"
 
-            # group by the format
+        if rollup is not None:
+            if not rollup:
+                return await ctx.send(":x: No data found for this canvas.")
+            t1 = datetime.strptime(rollup[-1]["last_datetime"], "%Y-%m-%d %H:%M:%S")
+        elif groupby:
+            # group by the format while reading the values (key: date or canvas,
+            # value: [sum, count])
             data_dict = {}
-            for d in data:
-                if d[0] is not None:
+            t1 = None
+            async with db_stats.iter_general_stat(
+                "online_count", dt1, dt2, canvas
+            ) as batches:
+                async for batch in batches:
+                    t1 = batch[-1]["datetime"]
+                    for d in batch:
+                        if d[0] is not None:
+                            if groupby == "canvas":
+                                key = "C" + d["canvas_code"]
+                            else:
+                                date_str = d["datetime"].strftime(format)
+                                key = datetime.strptime(date_str, format)
+                            if key in data_dict:
+                                data_dict[key][0] += int(d["value"])
+                                data_dict[key][1] += 1
+                            else:
+                                data_dict[key] = [int(d["value"]), 1]
+            if t1 is None:
+                return await ctx.send(":x: No data found for this canvas.")
+        else:
+            data = await db_stats.get_general_stat(
+                "online_count",
+                dt1,
+                dt2,
+                canvas,
+            )
+            if not data:
+                return await ctx.send(":x: No data found for this canvas.")
+            t0 = data[0]["datetime"]
+            t1 = data[-1]["datetime"]
+
+        if groupby:
+            if rollup is not None:
+                data_dict = {}
+                for r in rollup:
                     if groupby == "canvas":
-                        key = "C" + d["canvas_code"]
-                    else:
-                        date_str = d["datetime"].strftime(format)
-                        key = datetime.strptime(date_str, format)
-                    if key in data_dict:
-                        data_dict[key].append(int(d["value"]))
+                        key = "C" + r["canvas_code"]
                     else:
-                        data_dict[key] = [int(d["value"])]
+                        key = datetime.strptime(r["period"], format)
+                    data_dict[key] = [r["average"], 1]
 
             # get the average for each date
             dates = []
             online_counts = []
-            for key, counts in data_dict.items():
-                average = sum(counts) / len(counts)
+            for key, (total, count) in data_dict.items():
+                average = total / count
                 average = round(average, 2)
                 dates.append(key)
                 online_counts.append(average)
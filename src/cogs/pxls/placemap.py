@@ -5,7 +5,6 @@ import time
 import disnake
 import numpy as np
 from disnake.ext import commands
-from PIL import Image
 
 from utils.discord_utils import (
     AuthorView,
@@ -13,6 +12,7 @@ from utils.discord_utils import (
     autocomplete_log_canvases,
     format_number,
     image_to_file,
+    png_to_file,
 )
 from utils.image.image_utils import highlight_image
 from utils.log import get_logger
@@ -22,7 +22,7 @@ from utils.pxls.archives import (
     get_canvas_image,
     get_user_placemap,
 )
-from utils.setup import PXLS_URL, db_canvas, db_users, stats
+from utils.setup import PXLS_URL, board_renders, db_canvas, db_users, stats
 
 logger = get_logger(__name__)
 
@@ -276,23 +276,19 @@ class Placemap(commands.Cog):
                     f":x: The given canvas code `{canvas_code_input}` is invalid."
                 )
 
+        filename = f"Pxls_Canvas_{canvas_code}.png"
         if canvas_code == current_canvas:
-            canvas_array = stats.board_array
-            canvas_array = stats.palettize_array(canvas_array)
-            canvas_image = Image.fromarray(canvas_array)
-            title = f"Canvas {canvas_code} (current)"
+            embed = disnake.Embed(title=f"Canvas {canvas_code} (current)", color=0x66C5CC)
+            canvas_png = await board_renders.get_png("current")
+            canvas_file = png_to_file(canvas_png, filename, embed)
         else:
             canvas_image = get_canvas_image(canvas_code)
             if canvas_image is None:
                 return await ctx.send(
                     ":x: This canvas code is invalid or doesn't have a final image."
                 )
-            title = f"Canvas {canvas_code} final"
-
-        embed = disnake.Embed(title=title, color=0x66C5CC)
-        canvas_file = await image_to_file(
-            canvas_image, f"Pxls_Canvas_{canvas_code}.png", embed
-        )
+            embed = disnake.Embed(title=f"Canvas {canvas_code} final", color=0x66C5CC)
+            canvas_file = await image_to_file(canvas_image, filename, embed)
         return await ctx.send(embed=embed, file=canvas_file)
 
 
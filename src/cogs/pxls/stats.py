@@ -7,6 +7,7 @@ from PIL import Image, ImageEnhance
 
 from cogs.pixel_art.color_breakdown import _colors
 from cogs.pixel_art.highlight import _highlight
+from database.db_stats_manager import user_stat_at_sql
 from utils.arguments_parser import MyParser
 from utils.discord_utils import (
     STATUS_EMOJIS,
@@ -14,10 +15,20 @@ from utils.discord_utils import (
     autocomplete_pxls_name,
     format_number,
     image_to_file,
+    png_to_file,
 )
 from utils.plot_utils import matplotlib_to_plotly
 from utils.pxls.cooldown import get_best_possible
-from utils.setup import PXLS_URL, db_conn, db_stats, db_users, stats
+from utils.pxls.live_heatmap import DEFAULT_HEATMAP_WINDOW, HEATMAP_WINDOWS
+from utils.setup import (
+    PXLS_URL,
+    board_renders,
+    db_conn,
+    db_stats,
+    db_users,
+    live_heatmap,
+    stats,
+)
 from utils.time_converter import format_datetime, round_minutes_down, td_format
 from utils.utils import make_progress_bar
 
@@ -191,9 +202,7 @@ class PxlsStats(commands.Cog):
         )
 
         # set the board image as thumbnail
-        board_array = stats.palettize_array(board)
-        board_img = Image.fromarray(board_array)
-        f = await image_to_file(board_img, "board.png")
+        f = png_to_file(await board_renders.get_png("current"), "board.png")
         emb.set_thumbnail(url="attachment://board.png")
 
         await ctx.send(embed=emb, file=f)
@@ -254,12 +263,7 @@ class PxlsStats(commands.Cog):
                 return await ctx.send("❌ User not found.")
 
         # get current pixels and leaderboard place
-        last_leaderboard = await db_stats.get_last_leaderboard()
-        user_row = None
-        for row in last_leaderboard:
-            if row["name"] == name:
-                user_row = row
-                break
+        user_row = await db_stats.get_last_user_stats(name)
 
         if user_row is None:
             # if the user isn't on the last leaderboard
@@ -305,14 +309,16 @@ class PxlsStats(commands.Cog):
             record_list.append(record)
 
         sql = """
-            SELECT canvas_count, alltime_count, record_id
-            FROM pxls_user_stat
-            JOIN pxls_name ON pxls_name.pxls_name_id = pxls_user_stat.pxls_name_id
-            WHERE pxls_user_id = ?
-            AND record_id IN ({})
-            ORDER BY record_id
+            SELECT canvas_count, alltime_count, record.record_id
+            FROM record
+            JOIN pxls_name ON pxls_user_id = ?
+            JOIN pxls_user_stat ON pxls_user_stat.pxls_name_id = pxls_name.pxls_name_id
+                AND pxls_user_stat.record_id = {}
+            WHERE record.record_id IN ({})
+            ORDER BY record.record_id
         """.format(
-            ", ".join(["?"] * len(record_id_list))
+            user_stat_at_sql("pxls_name.pxls_name_id", "record.record_id"),
+            ", ".join(["?"] * len(record_id_list)),
         )
         rows = await db_conn.sql_select(sql, (user_id,) + tuple(record_id_list))
 
@@ -438,19 +444,23 @@ class PxlsStats(commands.Cog):
         inter: disnake.AppCmdInter,
         display: str = commands.param(default=None, choices=choices),
         opacity: int = commands.Param(default=None, ge=0, le=100),
+        window: str = commands.Param(default=None, choices=list(HEATMAP_WINDOWS)),
     ):
         """Get the current pxls board.
 
         Parameters
         ----------
         display: How to display the canvas.
-        opacity: The opacity of the background behind the heatmap between 0 and 100. (default: 20)"""
+        opacity: The opacity of the background behind the heatmap between 0 and 100. (default: 20)
+        window: The time window of the heatmap activity. (default: 1h)"""
         await inter.response.defer()
         args = ()
         if display == "heatmap":
             args += ("-heatmap",)
             if opacity is not None:
                 args += (str(opacity),)
+            if window is not None:
+                args += ("-window", window)
         elif display:
             args += ("-" + display,)
         await self.board(inter, *args)
@@ -458,12 +468,13 @@ class PxlsStats(commands.Cog):
     @commands.command(
         name="board",
         description="Get the current pxls board.",
-        usage="[-virginmap] [-nonvirgin] [-heatmap [opacity]]",
+        usage="[-virginmap] [-nonvirgin] [-heatmap [opacity] [-window 15m|1h|1d]]",
         help="""
         - `[-virginmap]`: show a map of the virgin pixels (white = virgin)
         - `[-nonvirgin]`: show the board without the virgin pixels
         - `[-heatmap [opacity]]`: show the heatmap on top of the canvas\
             (the opacity value should be between 0 and 100, the default value is 20)
+        - `[-window 15m|1h|1d]`: the time window of the heatmap activity (default: 1h)
         - `[-initial]`: show the initial state of the canvas""",
     )
     async def p_board(self, ctx, *options):
@@ -485,6 +496,9 @@ class PxlsStats(commands.Cog):
         parser.add_argument(
             "-initial", action="store_true", default=False, required=False
         )
+        parser.add_argument(
+            "-window", action="store", default=DEFAULT_HEATMAP_WINDOW, required=False
+        )
 
         try:
             parsed_args = parser.parse_args(args)
@@ -507,33 +521,27 @@ class PxlsStats(commands.Cog):
                         "❌ The opacity value must be between 0 and 100."
                     )
 
+        # views of the current boards (rendered by the cache)
+        view = None
         # virginmap
         if parsed_args.virginmap:
-            array = stats.virginmap_array.copy()
-            array[array == 255] = 1
-            array[stats.placemap_array != 0] = 255
-            array = stats.palettize_array(array, palette=["#000000", "#00DD00"])
+            view = "virginmap"
             title = "Canvas Virginmap"
         # heatmap
         elif heatmap_opacity is not None:
-            # get the heatmap
-            array = await stats.fetch_heatmap()
-            # invert the values to have the inactive pixels at 255 (which is the default transparent value)
-            array = 255 - array
+            # get the heatmap (inactive pixels at 255, the transparent value)
+            try:
+                array = await live_heatmap.get_heatmap(parsed_args.window)
+            except ValueError as e:
+                return await ctx.send(f"❌ {e}")
             heatmap_palette = matplotlib_to_plotly("plasma_r", 255)
             array = stats.palettize_array(array, heatmap_palette)
             # get the canvas board
-            canvas_array = stats.board_array
-            canvas_array = stats.palettize_array(canvas_array)
-            title = "Canvas Heatmap"
+            canvas_array = await board_renders.get_array("current")
+            title = f"Canvas Heatmap (last {parsed_args.window})"
         # non-virgin board
         elif parsed_args.nonvirgin:
-            placeable_board = await stats.get_placable_board()
-            virgin_array = stats.virginmap_array
-            array = placeable_board.copy()
-            array[virgin_array != 0] = 255
-            array[virgin_array == 0] = placeable_board[virgin_array == 0]
-            array = stats.palettize_array(array)
+            view = "nonvirgin"
             title = "Current Board (non-virgin pixels)"
         # initial board
         elif parsed_args.initial:
@@ -542,22 +550,24 @@ class PxlsStats(commands.Cog):
             title = "Initial Board"
         # current board
         else:
-            array = stats.board_array
-            array = stats.palettize_array(array)
+            view = "current"
             title = "Current Board"
 
-        if heatmap_opacity is not None:
-            # paste the heatmap image on top of the darken board
-            heatmap_img = Image.fromarray(array)
-            board_img = Image.fromarray(canvas_array)
-            enhancer = ImageEnhance.Brightness(board_img)
-            board_img = enhancer.enhance(heatmap_opacity / 100)
-            board_img.paste(heatmap_img, (0, 0), heatmap_img)
-        else:
-            board_img = Image.fromarray(array)
         embed = disnake.Embed(title=title, color=0x66C5CC)
         embed.timestamp = datetime.now(timezone.utc)
-        file = await image_to_file(board_img, "board.png", embed)
+        if view is not None:
+            file = png_to_file(await board_renders.get_png(view), "board.png", embed)
+        else:
+            if heatmap_opacity is not None:
+                # paste the heatmap image on top of the darken board
+                heatmap_img = Image.fromarray(array)
+                board_img = Image.fromarray(canvas_array)
+                enhancer = ImageEnhance.Brightness(board_img)
+                board_img = enhancer.enhance(heatmap_opacity / 100)
+                board_img.paste(heatmap_img, (0, 0), heatmap_img)
+            else:
+                board_img = Image.fromarray(array)
+            file = await image_to_file(board_img, "board.png", embed)
         await ctx.send(file=file, embed=embed)
 
     @commands.slash_command(name="canvascolors")
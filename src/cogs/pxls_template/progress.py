@@ -5,7 +5,6 @@ from copy import deepcopy
 from datetime import datetime, timedelta, timezone
 from io import BytesIO
 
-import aiohttp
 import disnake
 import numpy as np
 import pandas as pd
@@ -28,7 +27,9 @@ from utils.discord_utils import (
     get_image_url,
     image_to_file,
 )
+from utils.http_client import IMAGE_SIZE_LIMIT, http_client
 from utils.image.image_utils import find_upscale, v_concatenate
+from utils.log import get_logger
 from utils.plot_utils import (
     fig2img,
     get_gradient_palette,
@@ -42,7 +43,15 @@ from utils.pxls.template_manager import (
     make_before_after_gif,
     parse_template,
 )
-from utils.setup import PXLS_URL, db_stats, db_templates, db_users, imgur_app, stats
+from utils.setup import (
+    PXLS_URL,
+    db_stats,
+    db_templates,
+    db_users,
+    imgur_app,
+    live_heatmap,
+    stats,
+)
 from utils.table_to_image import table_to_image
 from utils.time_converter import (
     format_datetime,
@@ -54,6 +63,8 @@ from utils.time_converter import (
 from utils.timezoneslib import get_timezone
 from utils.utils import BadResponseError, make_progress_bar, shorten_list
 
+logger = get_logger(__name__)
+
 
 class Progress(commands.Cog):
     def __init__(self, bot: commands.Bot) -> None:
@@ -234,8 +245,7 @@ class Progress(commands.Cog):
                 stats.palettize_array(cropped_board, palette)
             )
         elif display == "heatmap":
-            heatmap = await stats.fetch_heatmap()
-            heatmap = 255 - heatmap
+            heatmap = await live_heatmap.get_heatmap()
             palette = matplotlib_to_plotly("plasma_r", 255)
             cropped_heatmap = template.crop_array_to_template(heatmap)
             cropped_heatmap[~template.placeable_mask] = 255
@@ -356,10 +366,12 @@ class Progress(commands.Cog):
             ]
             timeframe_names = ["5 minutes", "hour", "6 hours", "day", "week"]
             now = round_minutes_down(datetime.utcnow(), 5)
-            last_progress_dt, last_progress = await template.get_progress_at(now)
+            progresses = await template.get_progresses_at(
+                [now] + [now - timedelta(**tf) for tf in timeframes]
+            )
+            last_progress_dt, last_progress = progresses[0]
             for i, tf in enumerate(timeframes):
-                td = timedelta(**tf)
-                tf_datetime, tf_progress = await template.get_progress_at(now - td)
+                tf_datetime, tf_progress = progresses[i + 1]
                 if tf_progress is None or last_progress is None:
                     delta_progress = "`N/A`"
                 else:
@@ -733,13 +745,23 @@ class Progress(commands.Cog):
             ctx.author.id
         )
 
-        for template in public_tracked_templates:
+        # get the progress of all the templates (and combo) now and at the
+        # start of each timeframe
+        timeframes = [{"hours": 1}, {"hours": 6}, {"days": 1}, {"days": 7}]
+        templates_progress = await db_templates.get_templates_progress(
+            public_tracked_templates,
+            [now] + [now - timedelta(**tf) for tf in timeframes],
+        )
+
+        for template, template_progress in zip(
+            public_tracked_templates, templates_progress
+        ):
             line_colors = [None, None, None, None]
             # template info
             name = template.name
             total = template.total_placeable
             # last progress
-            last_progress = await db_templates.get_template_progress(template, now)
+            last_progress = template_progress[0]
             if not last_progress:
                 current_progress = togo = percentage = "N/A"
                 line_colors.append(None)
@@ -776,11 +798,8 @@ class Progress(commands.Cog):
                     continue
 
             # timeframes speeds
-            timeframes = [{"hours": 1}, {"hours": 6}, {"days": 1}, {"days": 7}]
             values = []
-            for tf in timeframes:
-                td = timedelta(**tf)
-                tf_progress = await db_templates.get_template_progress(template, now - td)
+            for tf_progress in template_progress[1:]:
                 if not tf_progress or not last_progress:
                     values.append("N/A")
                     line_colors.append(None)
@@ -1693,33 +1712,42 @@ class Progress(commands.Cog):
         MAX_TIME = 120  # timeout before error
         start = time.time()
 
-        async def download_frame(url, sess, sem):
+        async def download_frame(url, sem):
             async with sem:
-                async with sess.get(url) as res:
-                    content = await res.read()
-                if res.status != 200:
+                try:
+                    content = await http_client.get(
+                        url, "bytes", max_size=IMAGE_SIZE_LIMIT
+                    )
+                except (BadResponseError, ValueError) as e:
+                    # skip the frame (unreachable or too big)
+                    logger.warning(f"Timelapse frame skipped ({url}): {e}")
                     return None
-                else:
-                    return Image.open(BytesIO(content))
+                return Image.open(BytesIO(content))
 
         tasks = []
         sem = asyncio.Semaphore(MAX_TASKS)
         try:
-            async with aiohttp.client.ClientSession() as sess:
-                for url in snapshot_urls:
-                    tasks.append(
-                        asyncio.wait_for(
-                            download_frame(url[2], sess, sem),
-                            timeout=MAX_TIME,
-                        )
+            for url in snapshot_urls:
+                tasks.append(
+                    asyncio.wait_for(
+                        download_frame(url[2], sem),
+                        timeout=MAX_TIME,
                     )
-                snapshot_images = await asyncio.gather(*tasks)
+                )
+            snapshot_images = await asyncio.gather(*tasks)
         except Exception:
             embed.description = "**:x: Downloading snapshots**... error\n"
             embed.description += "An error occurred while downloading the snapshots."
             embed.color = disnake.Color.red()
             await m.edit(embed=embed)
             return
+        snapshot_images = [image for image in snapshot_images if image is not None]
+        if len(snapshot_images) < 2:
+            embed.description = "**:x: Downloading snapshots**... error\n"
+            embed.description += "Not enough snapshots could be downloaded."
+            embed.color = disnake.Color.red()
+            await m.edit(embed=embed)
+            return
 
         # crop the template area
         embed.description = "✅ **Downloading the snapshots**... done!\n\n<a:typing:675416675591651329> **Cropping the snapshots**..."
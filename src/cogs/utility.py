@@ -20,7 +20,17 @@ from utils.discord_utils import (
     image_to_file,
 )
 from utils.plot_utils import get_theme
-from utils.setup import BOT_INVITE, SERVER_INVITE, VERSION, db_servers, db_users, stats
+from utils.setup import (
+    BOT_INVITE,
+    SERVER_INVITE,
+    VERSION,
+    board_renders,
+    db_migrations,
+    db_servers,
+    db_users,
+    stats,
+    ws_client,
+)
 from utils.table_to_image import table_to_image
 from utils.time_converter import format_datetime, format_timezone, str_to_td, td_format
 from utils.timezoneslib import get_timezone
@@ -45,9 +55,7 @@ class Utility(commands.Cog):
         await ctx.send(f"pong! (bot latency: `{round(self.bot.latency*1000,2)}` ms)")
 
     @commands.command(usage="[prefix]", description="Change or display the bot prefix.")
-    @commands.check_any(
-        commands.is_owner(), commands.has_permissions(administrator=True)
-    )
+    @commands.check_any(commands.is_owner(), commands.has_permissions(administrator=True))
     async def prefix(self, ctx, prefix=None):
         if prefix is None:
             prefix = ctx.prefix
@@ -248,8 +256,227 @@ class Utility(commands.Cog):
                 nb_lines = await db_servers.db.sql_update(sql_expression)
             except Exception as e:
                 return await ctx.send(f"❌ SQL error: ```{e}```")
+            # the query may have changed cached rows
+            db_users.invalidate_discord_user()
+            db_users.names.clear()
+            await db_servers.load_servers()
         return await ctx.send(f"Done! ({nb_lines} lines affected)")
 
+    @commands.command(
+        name="cachestats",
+        description="Show the hit rate of the database caches. (owner only)",
+        hidden=True,
+    )
+    @commands.is_owner()
+    async def cachestats(self, ctx):
+        caches = [
+            (
+                "discord users",
+                len(db_users.users_cache),
+                db_users.users_cache_hits,
+                db_users.users_cache_misses,
+            ),
+            (
+                "board renders",
+                len(board_renders._renders),
+                board_renders.hits,
+                board_renders.misses,
+            ),
+        ]
+        # the servers settings are all in memory
+        servers = db_servers.servers or {}
+        caches.append(("server settings", len(servers), None, None))
+        table = []
+        for name, size, hits, misses in caches:
+            if hits is None:
+                table.append([name, size, "-", "-", "-"])
+                continue
+            total = hits + misses
+            hit_rate = f"{hits / total * 100:.1f}%" if total else "-"
+            table.append([name, size, hits, misses, hit_rate])
+        text = format_table(table, ["cache", "size", "hits", "misses", "hit rate"])
+        return await ctx.send(f"```\n{text}```")
+
+    @commands.command(
+        name="writestats",
+        description="Show the metrics of the database write queue. (owner only)",
+        hidden=True,
+    )
+    @commands.is_owner()
+    async def writestats(self, ctx):
+        metrics = db_servers.db.write_queue.get_metrics()
+        table = [
+            ["queue depth", metrics["depth"]],
+            ["writes", metrics["writes"]],
+            ["transactions", metrics["transactions"]],
+            ["avg wait", f"{metrics['avg_wait_ms']:.2f} ms"],
+            ["max wait", f"{metrics['max_wait_ms']:.2f} ms"],
+        ]
+        text = format_table(table, ["metric", "value"])
+        return await ctx.send(f"```\n{text}```")
+
+    @commands.command(
+        name="apistats",
+        description="Show the latency and size of the pxls API requests. (owner only)",
+        hidden=True,
+    )
+    @commands.is_owner()
+    async def apistats(self, ctx):
+        metrics = stats.api.get_metrics()
+        if not metrics:
+            return await ctx.send("❌ No request sent yet.")
+        table = [
+            [
+                endpoint,
+                m["requests"],
+                m["not_modified"],
+                m["errors"],
+                f"{m['bytes'] / 1e6:.1f}",
+                f"{m['avg_ms']:.0f}",
+                f"{m['last_ms']:.0f}",
+            ]
+            for endpoint, m in sorted(metrics.items())
+        ]
+        titles = ["endpoint", "requests", "304", "errors", "MB", "avg ms", "last ms"]
+        text = format_table(table, titles)
+        return await ctx.send(f"```\n{text}```")
+
+    @commands.command(
+        name="wsstats",
+        description="Show the metrics of the websocket pixels. (owner only)",
+        hidden=True,
+    )
+    @commands.is_owner()
+    async def wsstats(self, ctx):
+        metrics = ws_client.get_metrics()
+        table = [
+            ["connected", metrics["connected"]],
+            ["paused", metrics["paused"]],
+            ["events received", metrics["events_received"]],
+            ["events applied", metrics["events_applied"]],
+            ["events dropped", metrics["events_dropped"]],
+            ["buffered", metrics["buffered"]],
+            ["events/sec", f"{metrics['events_per_sec']:.1f}"],
+            ["batches", metrics["batches"]],
+            ["last batch size", metrics["last_batch_size"]],
+            ["avg latency", f"{metrics['avg_latency_ms']:.1f} ms"],
+            ["max latency", f"{metrics['max_latency_ms']:.1f} ms"],
+            ["avg apply time", f"{metrics['avg_apply_ms']:.2f} ms"],
+            ["max apply time", f"{metrics['max_apply_ms']:.2f} ms"],
+            ["journal records", metrics["journal_records"]],
+        ]
+        text = format_table(table, ["metric", "value"])
+        return await ctx.send(f"```\n{text}```")
+
+    @commands.command(
+        name="tilestats",
+        description="Show the changes of the board tiles. (owner only)",
+        usage="[board version]",
+        hidden=True,
+    )
+    @commands.is_owner()
+    async def tilestats(self, ctx, since: int = None):
+        tiles = stats.dirty_tiles
+        if tiles.versions is None:
+            return await ctx.send("❌ The boards aren't loaded yet.")
+        nb_rows, nb_cols = tiles.versions.shape
+        table = [
+            ["board version", stats.board_version],
+            ["tile size", f"{tiles.tile_size}x{tiles.tile_size}"],
+            ["tiles", f"{nb_rows * nb_cols} ({nb_cols}x{nb_rows})"],
+        ]
+        for name, count in tiles.refresh_tiles.items():
+            table.append([f"{name} (last refresh)", f"{count} tiles changed"])
+        if since is not None:
+            changed = tiles.count_changed(since)
+            table.append([f"since version {since}", f"{changed} tiles changed"])
+        text = format_table(table, ["metric", "value"])
+
+        most_changed = tiles.get_most_changed()
+        if most_changed:
+            table = [[f"({x}, {y})", count] for (x, y), count in most_changed]
+            text += "\n\n" + format_table(table, ["tile", "pixels changed"])
+        return await ctx.send(f"```\n{text}```")
+
+    @commands.command(
+        name="slowqueries",
+        description="Show the slowest SQL statements and the full scans. (owner only)",
+        usage="[number] [avg|max|total]",
+        hidden=True,
+    )
+    @commands.is_owner()
+    async def slowqueries(self, ctx, limit: int = 5, sort: str = "avg"):
+        query_stats = db_servers.db.query_stats
+        if sort not in ("avg", "max", "total"):
+            return await ctx.send("❌ The sort must be `avg`, `max` or `total`.")
+        statements = query_stats.get_slowest(limit, sort)
+        if not statements:
+            return await ctx.send("❌ No statement executed yet.")
+
+        def ms(duration):
+            return f"{duration * 1000:.1f}"
+
+        def truncate(sql, length=300):
+            return sql if len(sql) <= length else sql[:length] + "..."
+
+        table = [
+            [i + 1, s.count, ms(s.avg_time), ms(s.percentile(95)), ms(s.max_time)]
+            for i, s in enumerate(statements)
+        ]
+        titles = ["#", "count", "avg (ms)", "p95 (ms)", "max (ms)"]
+        description = f"```\n{format_table(table, titles)}```"
+        for i, s in enumerate(statements):
+            description += f"**#{i + 1}** ```sql\n{truncate(s.sql)}```"
+            if s.plan:
+                description += "```\n{}```".format("\n".join(s.plan))
+
+        full_scans = query_stats.get_full_scans()
+        if full_scans:
+            description += "\n**Full scans:**\n"
+            for s in full_scans:
+                description += f"```sql\n{truncate(s.sql, 150)}```"
+                description += "```\n{}```".format("\n".join(s.full_scans))
+        if len(description) > 4096:
+            description = description[:4090] + "...```"
+
+        embed = disnake.Embed(
+            color=0x66C5CC,
+            title=f"Slowest statements (by {sort})",
+            description=description,
+        )
+        embed.set_footer(
+            text=f"{len(query_stats.statements)} statements recorded | "
+            f"slow threshold: {query_stats.slow_threshold * 1000:.0f} ms"
+        )
+        return await ctx.send(embed=embed)
+
+    @commands.command(
+        name="migrations",
+        description="Show the progress of the database migrations. (owner only)",
+        hidden=True,
+    )
+    @commands.is_owner()
+    async def migrations(self, ctx):
+        version = await db_migrations.get_version()
+        table = []
+        for migration in await db_migrations.get_progress():
+            if migration["applied_at"]:
+                progress = "done"
+            elif migration["total"]:
+                progress = f"{migration['done'] / migration['total'] * 100:.1f}%"
+            else:
+                progress = "pending"
+            table.append(
+                [
+                    migration["version"],
+                    migration["name"],
+                    "yes" if migration["background"] else "no",
+                    progress,
+                ]
+            )
+        text = format_table(table, ["version", "name", "background", "progress"])
+        return await ctx.send(f"Schema version: `{version}`\n```\n{text}```")
+
     @commands.command(hidden=True)
     @commands.is_owner()
     async def restart(self, ctx):
@@ -717,18 +944,11 @@ class Utility(commands.Cog):
                 )
             )
             sql = "INSERT or IGNORE INTO snapshot (datetime, canvas_code, url) VALUES (?, ?, ?)"
-            await db_users.db.create_connection()
             try:
-                async with db_users.db.conn.cursor() as cur:
-                    await cur.execute("BEGIN TRANSACTION;")
-                    await cur.executemany(sql, values)
-                    await cur.execute("COMMIT;")
+                await db_users.db.sql_update_many(sql, values)
             except Exception as e:
-                await db_users.db.close_connection()
                 return await ctx.send(f":x: {e}")
 
-            await db_users.db.conn.commit()
-            await db_users.db.close_connection()
             await ctx.send(":white_check_mark: saved in the database.")
 
 
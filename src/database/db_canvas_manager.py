@@ -1,10 +1,10 @@
+import logging
 import os
 import re
 
 from database.db_connection import DbConnection
-from utils.log import get_logger
 
-logger = get_logger(__name__)
+logger = logging.getLogger(__name__)
 
 basepath = os.path.dirname(__file__)
 CANVASES_FOLDER = os.path.abspath(
@@ -1,50 +1,342 @@
+import asyncio
+import logging
 import os
+import time
+from contextlib import asynccontextmanager
 
 import asqlite
+import numpy as np
+
+from database.db_query_stats import DbQueryStats, normalize_sql
+from database.db_timed_connection import TimedConnection
+from database.db_write_queue import DbWriteQueue
+
+logger = logging.getLogger(__name__)
 
 DB_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), "database.db")
 
+# number of read-only connections kept open in the pool
+NB_READERS = 4
+# number of rows fetched at a time by `sql_iter()`
+ITER_BATCH_SIZE = 5000
+# time (in seconds) to wait for a lock on the database before raising
+BUSY_TIMEOUT = 30.0
+PRAGMAS = [
+    # WAL mode (set by asqlite) only needs a sync at checkpoints
+    "PRAGMA synchronous = NORMAL",
+    # 64 MB of page cache per connection (negative values are in KiB)
+    "PRAGMA cache_size = -65536",
+    # map up to 256 MB of the database file in memory
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA temp_store = MEMORY",
+]
+
+
+def _setup_connection(conn):
+    """Apply the pragmas on a new sqlite3 connection."""
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+
 
 class DbConnection:
-    def __init__(self) -> None:
-        self.db_file: str = DB_FILE
-        self.conn = None
+    """A pool of long-lived connections to the database.
+
+    All the writes go through a single writer connection owned by a write queue
+    (see `DbWriteQueue`) and the reads are spread across `nb_readers` connections.
+    The pool is opened lazily on the first query or explicitly with
+    `create_connection()`.
+
+    The duration of the statements executed with the `sql_*` methods or on the
+    connections of `reader()` and `writer()` is saved in `query_stats` and the
+    query plan of the slow ones is captured."""
+
+    def __init__(self, db_file: str = DB_FILE, nb_readers: int = NB_READERS) -> None:
+        self.db_file: str = db_file
+        self.nb_readers = nb_readers
+
+        self.writer_conn = None
+        self.write_queue = DbWriteQueue()
+        self.write_queue.on_executed = self._record_query
+        self.query_stats = DbQueryStats()
+        self._plan_tasks = set()
+        self.readers = []
+        self._readers_queue: asyncio.Queue = None
+        self._open_lock: asyncio.Lock = None
+
+    @property
+    def is_open(self) -> bool:
+        return self.writer_conn is not None
+
+    async def _connect(self):
+        return await asqlite.connect(
+            self.db_file,
+            init=_setup_connection,
+            timeout=BUSY_TIMEOUT,
+            detect_types=asqlite.PARSE_DECLTYPES,
+        )
 
     async def create_connection(self):
-        self.conn = await asqlite.connect(DB_FILE, detect_types=asqlite.PARSE_DECLTYPES)
+        """Open the writer and reader connections if they aren't already opened."""
+        if self._open_lock is None:
+            self._open_lock = asyncio.Lock()
+        async with self._open_lock:
+            if self.is_open:
+                return
+            self._readers_queue = asyncio.Queue()
+            self.writer_conn = await self._connect()
+            await self._init_new_database(self.writer_conn)
+            self.write_queue.start(self.writer_conn)
+            self.readers = []
+            for _ in range(self.nb_readers):
+                reader = await self._connect()
+                self.readers.append(reader)
+                self._readers_queue.put_nowait(reader)
+            logger.debug(
+                f"Database pool opened with 1 writer and {self.nb_readers} readers."
+            )
+
+    @staticmethod
+    async def _init_new_database(conn):
+        """Enable the incremental auto-vacuum if the database has no table yet.
+
+        The mode of an existing database can only be changed with a full VACUUM
+        (see `scripts/vacuum_database.py`)."""
+        async with conn.execute("SELECT count(*) FROM sqlite_master") as cursor:
+            if (await cursor.fetchone())[0]:
+                return
+        await conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        # the header was already written when asqlite enabled WAL, the new mode is
+        # applied by a VACUUM (instant on an empty database)
+        await conn.execute("VACUUM")
 
     async def close_connection(self):
-        await self.conn.close()
+        """Wait for the running queries to finish and close all the connections."""
+        if not self.is_open:
+            return
+        # execute the writes left in the queue
+        await self.write_queue.stop()
+        await asyncio.gather(*self._plan_tasks, return_exceptions=True)
+        # acquire all the readers so no query is running on them
+        for _ in range(len(self.readers)):
+            await self._readers_queue.get()
+        for reader in self.readers:
+            await reader.close()
+        # merge the WAL file back in the database before closing
+        try:
+            await self.writer_conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except Exception:
+            logger.exception("Failed to checkpoint the database:")
+        await self.writer_conn.close()
+        self.writer_conn = None
+        self.readers = []
+        logger.debug("Database pool closed.")
+
+    async def check_health(self) -> bool:
+        """Check that every connection of the pool can still run a query and
+        replace the ones that can't. Return False if a connection was replaced."""
+        if not self.is_open:
+            return True
+
+        async def is_alive(conn) -> bool:
+            try:
+                async with conn.execute("SELECT 1") as cursor:
+                    await cursor.fetchone()
+                return True
+            except Exception:
+                return False
+
+        healthy = True
+        async with self.write_queue.exclusive() as writer_conn:
+            if not await is_alive(writer_conn):
+                logger.warning("Database writer connection unhealthy, reconnecting.")
+                healthy = False
+                await self._close_quietly(writer_conn)
+                self.writer_conn = await self._connect()
+                self.write_queue.conn = self.writer_conn
+
+        checked = []
+        for _ in range(len(self.readers)):
+            checked.append(await self._readers_queue.get())
+        try:
+            for i, reader in enumerate(checked):
+                if not await is_alive(reader):
+                    logger.warning("Database reader connection unhealthy, reconnecting.")
+                    healthy = False
+                    await self._close_quietly(reader)
+                    checked[i] = await self._connect()
+        finally:
+            self.readers = checked
+            for reader in checked:
+                self._readers_queue.put_nowait(reader)
+        return healthy
+
+    @staticmethod
+    async def _close_quietly(conn):
+        try:
+            await conn.close()
+        except Exception:
+            pass
+
+    def _record_query(self, query, param, duration):
+        """Save the duration of a statement and capture its query plan in the
+        background if it's slow."""
+        if not self.query_stats.record(query, duration):
+            return
+        logger.info(f"Slow query ({duration * 1000:.0f} ms): {normalize_sql(query)}")
+        task = asyncio.create_task(self._capture_plan(query, param))
+        self._plan_tasks.add(task)
+        task.add_done_callback(self._plan_tasks.discard)
+
+    async def _capture_plan(self, query, param):
+        plan = []
+        try:
+            async with self._reader() as conn:
+                async with conn.cursor() as cursor:
+                    if param:
+                        await cursor.execute("EXPLAIN QUERY PLAN " + query, param)
+                    else:
+                        await cursor.execute("EXPLAIN QUERY PLAN " + query)
+                    plan = [row["detail"] for row in await cursor.fetchall()]
+        except Exception as e:
+            # some statements can't be explained (e.g. using a temp table)
+            logger.debug(f"Failed to get the query plan: {e}")
+        self.query_stats.set_plan(query, plan)
+
+    @asynccontextmanager
+    async def _reader(self):
+        if not self.is_open:
+            await self.create_connection()
+        conn = await self._readers_queue.get()
+        try:
+            yield conn
+        finally:
+            self._readers_queue.put_nowait(conn)
+
+    @asynccontextmanager
+    async def reader(self):
+        """Borrow a reader connection from the pool (see `TimedConnection`)."""
+        async with self._reader() as conn:
+            yield TimedConnection(conn, self._record_query)
+
+    @asynccontextmanager
+    async def writer(self):
+        """Get the writer connection (see `TimedConnection`), no other write can
+        happen while it's held."""
+        if not self.is_open:
+            await self.create_connection()
+        async with self.write_queue.exclusive() as conn:
+            yield TimedConnection(conn, self._record_query)
 
     async def sql_select(self, query, param: tuple = None):
         """Execute the query with the given parameters and return all the rows selected."""
-        async with asqlite.connect(DB_FILE, detect_types=asqlite.PARSE_DECLTYPES) as conn:
+        async with self._reader() as conn:
             async with conn.cursor() as cursor:
+                start = time.perf_counter()
                 if param:
                     await cursor.execute(query, param)
                 else:
                     await cursor.execute(query)
                 res = await cursor.fetchall()
+                self._record_query(query, param, time.perf_counter() - start)
             return res
 
+    @asynccontextmanager
+    async def sql_iter(
+        self,
+        query,
+        param: tuple = None,
+        batch_size: int = ITER_BATCH_SIZE,
+        as_arrays: bool = False,
+    ):
+        """Execute the query and get an async iterator of the rows selected in
+        batches of `batch_size` rows, without loading all of them in memory:
+
+            async with db.sql_iter(query, param) as batches:
+                async for batch in batches:
+                    ...
+
+        With `as_arrays`, each batch is a dictionary with a NumPy array per column
+        (key: column name) instead of a list of rows. A reader connection is used
+        until the context is exited, even if the iteration stopped before."""
+        async with self._reader() as conn:
+            batches = self._iter_batches(conn, query, param, batch_size, as_arrays)
+            try:
+                yield batches
+            finally:
+                await batches.aclose()
+
+    async def _iter_batches(self, conn, query, param, batch_size, as_arrays):
+        async with conn.cursor() as cursor:
+            # only the time spent in the database is counted
+            start = time.perf_counter()
+            if param:
+                await cursor.execute(query, param)
+            else:
+                await cursor.execute(query)
+            duration = time.perf_counter() - start
+            try:
+                while True:
+                    start = time.perf_counter()
+                    rows = await cursor.fetchmany(batch_size)
+                    duration += time.perf_counter() - start
+                    if not rows:
+                        break
+                    if as_arrays:
+                        names = [d[0] for d in cursor.get_cursor().description]
+                        yield {
+                            name: np.array(column)
+                            for name, column in zip(names, zip(*rows))
+                        }
+                    else:
+                        yield rows
+            finally:
+                self._record_query(query, param, duration)
+
+    async def sql_select_nearest(
+        self, table: str, dt, where: str = "1", param: tuple = (), columns: str = "*"
+    ):
+        """Get the row of `table` with the `datetime` closest to `dt`, or None if
+        there is no row matching the `where` condition.
+
+        Instead of computing the time difference with every row, this does two
+        bounded seeks (the last row before `dt` and the first row after it) so the
+        `where` condition should match an index ending with the `datetime` column.
+        The row has an extra `diff_with_time` column (in seconds)."""
+        sql = """
+            SELECT *, abs(JulianDay(datetime) - JulianDay(?))*24*3600 as diff_with_time
+            FROM (
+                SELECT * FROM (
+                    SELECT {0} FROM {1} WHERE {2} AND datetime <= ?
+                    ORDER BY datetime DESC LIMIT 1
+                )
+                UNION ALL
+                SELECT * FROM (
+                    SELECT {0} FROM {1} WHERE {2} AND datetime >= ?
+                    ORDER BY datetime LIMIT 1
+                )
+            )
+            ORDER BY diff_with_time, datetime
+            LIMIT 1""".format(
+            columns, table, where
+        )
+        rows = await self.sql_select(sql, (dt,) + param + (dt,) + param + (dt,))
+        return rows[0] if rows else None
+
     async def sql_update(self, query, param: tuple = None):
         """Execute the query with the given parameter, commit the connection and return the number of lines changed."""
-        async with asqlite.connect(DB_FILE, detect_types=asqlite.PARSE_DECLTYPES) as conn:
-            async with conn.cursor() as cursor:
-                if param:
-                    await cursor.execute(query, param)
-                else:
-                    await cursor.execute(query)
-                await conn.commit()
-                return cursor.get_cursor().rowcount
+        if not self.is_open:
+            await self.create_connection()
+        return await self.write_queue.execute("update", query, param)
 
     async def sql_insert(self, query, param: tuple = None) -> int:
         """Same as `sql_update()` but returns the rowid of the last element inserted"""
-        async with asqlite.connect(DB_FILE, detect_types=asqlite.PARSE_DECLTYPES) as conn:
-            async with conn.cursor() as cursor:
-                if param:
-                    await cursor.execute(query, param)
-                else:
-                    await cursor.execute(query)
-                await conn.commit()
-                return cursor.get_cursor().lastrowid
+        if not self.is_open:
+            await self.create_connection()
+        return await self.write_queue.execute("insert", query, param)
+
+    async def sql_update_many(self, query, params: list) -> int:
+        """Execute the query for each parameter of the list in a single transaction
+        and return the number of lines changed."""
+        if not self.is_open:
+            await self.create_connection()
+        return await self.write_queue.execute("many", query, params)
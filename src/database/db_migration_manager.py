@@ -0,0 +1,165 @@
+import asyncio
+import logging
+from datetime import datetime
+
+from database.db_connection import DbConnection
+from database.migrations import MIGRATIONS, Migration
+from database.pxls_name_index import PxlsNameIndex
+
+logger = logging.getLogger(__name__)
+
+# number of rows/records handled in a step of the background migrations
+MIGRATION_CHUNK_SIZE = 100
+# time (in seconds) between 2 steps of a background migration, to let the other
+# queries run
+MIGRATION_PAUSE = 0.5
+
+
+class DbMigrationManager:
+    """Apply the migrations of `database.migrations` in order and save the
+    version and progress of each one in the `schema_migration` table.
+
+    `migrate()` applies the migrations that must be done before the bot starts
+    and `start_background()` starts a task applying the heavy ones step by step
+    while the bot is running."""
+
+    def __init__(
+        self,
+        db_conn: DbConnection,
+        names: PxlsNameIndex = None,
+        migrations: list = MIGRATIONS,
+        chunk_size: int = MIGRATION_CHUNK_SIZE,
+        pause: float = MIGRATION_PAUSE,
+    ) -> None:
+        self.db = db_conn
+        self.names = names or PxlsNameIndex(db_conn)
+        self.migrations = sorted(migrations, key=lambda m: m.version)
+        self.chunk_size = chunk_size
+        self.pause = pause
+
+        self._task: asyncio.Task = None
+        self._stopping = False
+
+    async def create_tables(self):
+        create_schema_migration_table = """
+            CREATE TABLE IF NOT EXISTS schema_migration(
+                version INTEGER PRIMARY KEY,
+                name TEXT,
+                position INTEGER,
+                done INTEGER,
+                total INTEGER,
+                applied_at TIMESTAMP
+            );"""
+        await self.db.sql_update(create_schema_migration_table)
+
+    async def get_version(self) -> int:
+        """Get the version of the last migration applied (0 if none is)."""
+        rows = await self.db.sql_select(
+            "SELECT MAX(version) FROM schema_migration WHERE applied_at IS NOT NULL"
+        )
+        return rows[0][0] or 0
+
+    async def get_progress(self) -> list:
+        """Get a list of dictionaries with the progress of each migration
+        (keys: version, name, background, done, total, applied_at)."""
+        rows = await self.db.sql_select("SELECT * FROM schema_migration")
+        states = {row["version"]: row for row in rows}
+        res = []
+        for migration in self.migrations:
+            state = states.get(migration.version)
+            res.append(
+                dict(
+                    version=migration.version,
+                    name=migration.name,
+                    background=migration.background,
+                    done=state["done"] if state else None,
+                    total=state["total"] if state else None,
+                    applied_at=state["applied_at"] if state else None,
+                )
+            )
+        return res
+
+    async def _get_state(self, migration: Migration):
+        rows = await self.db.sql_select(
+            "SELECT * FROM schema_migration WHERE version = ?", migration.version
+        )
+        return rows[0] if rows else None
+
+    async def _save_state(self, migration, position, done, total, applied_at=None):
+        sql = """
+            INSERT INTO schema_migration(version, name, position, done, total, applied_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(version) DO UPDATE SET
+                position = excluded.position,
+                done = excluded.done,
+                total = excluded.total,
+                applied_at = excluded.applied_at"""
+        await self.db.sql_update(
+            sql, (migration.version, migration.name, position, done, total, applied_at)
+        )
+
+    async def apply(self, migration: Migration, pause: float = 0, on_progress=None):
+        """Run the steps of a migration until it's done, return False if it
+        was stopped before.
+
+        :param pause: time to wait between 2 steps (in seconds)
+        :param on_progress: function called with (migration, done, total)
+            after each step"""
+        state = await self._get_state(migration)
+        if state and state["applied_at"]:
+            return True
+        position = state["position"] if state else None
+        logger.info(f"Applying migration {migration.version}: {migration.name}")
+        while True:
+            position, done, total = await migration.step(self, position)
+            if on_progress:
+                on_progress(migration, done, total)
+            if done >= total:
+                await self._save_state(
+                    migration, position, done, total, datetime.utcnow()
+                )
+                logger.info(f"Migration {migration.version} applied.")
+                return True
+            await self._save_state(migration, position, done, total)
+            logger.debug(
+                f"Migration {migration.version}: {done}/{total} "
+                f"({done / total * 100:.1f}%)"
+            )
+            if self._stopping:
+                return False
+            if pause:
+                await asyncio.sleep(pause)
+
+    async def migrate(self):
+        """Apply the migrations that aren't done in the background."""
+        await self.create_tables()
+        for migration in self.migrations:
+            if not migration.background:
+                await self.apply(migration)
+
+    async def run_background(self):
+        """Apply all the background migrations, one step at a time."""
+        for migration in self.migrations:
+            if not migration.background:
+                continue
+            try:
+                if not await self.apply(migration, self.pause):
+                    return
+            except Exception:
+                logger.exception(f"Migration {migration.version} failed:")
+                # the next migrations may depend on this one
+                return
+
+    def start_background(self):
+        """Start the task applying the background migrations if it isn't running."""
+        if self._task is None or self._task.done():
+            self._stopping = False
+            self._task = asyncio.create_task(self.run_background())
+
+    async def stop_background(self):
+        """Wait for the current step to finish and stop the background migrations."""
+        if self._task is None:
+            return
+        self._stopping = True
+        await self._task
+        self._task = None
@@ -0,0 +1,155 @@
+import re
+import time
+from collections import deque
+from datetime import datetime
+
+# upper bounds (in ms) of the buckets of the latency histograms, the last
+# bucket has all the durations above the last bound
+HISTOGRAM_BOUNDS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+# duration (in seconds) above which a statement is considered slow and its
+# query plan is captured
+SLOW_QUERY_THRESHOLD = 0.2
+# number of slow statements kept in the slow-query log
+SLOW_QUERY_LOG_SIZE = 50
+
+_comment_regex = re.compile(r"--[^\n]*|/\*.*?\*/", re.DOTALL)
+_string_regex = re.compile(r"'(?:[^']|'')*'")
+_number_regex = re.compile(r"\b\d+(?:\.\d+)?\b")
+_param_list_regex = re.compile(r"\?(?:\s*,\s*\?)+")
+_whitespace_regex = re.compile(r"\s+")
+
+
+def normalize_sql(query: str) -> str:
+    """Get a normalized version of a statement so the same statement with
+    different literals or a different number of parameters is grouped:
+    the comments are removed, the literals are replaced with `?`, the lists of
+    parameters are collapsed and the whitespace is collapsed."""
+    query = _comment_regex.sub(" ", query)
+    query = _string_regex.sub("?", query)
+    query = _number_regex.sub("?", query)
+    query = _param_list_regex.sub("?, ...", query)
+    query = _whitespace_regex.sub(" ", query).strip()
+    return query.rstrip(";").strip()
+
+
+def is_full_scan(detail: str) -> bool:
+    """Check if the detail of a query plan step is a scan of a whole table
+    (as opposed to a search with an index or a scan of a subquery)."""
+    detail = detail.upper()
+    if not detail.startswith("SCAN "):
+        return False
+    return "CONSTANT ROW" not in detail and "SUBQUERY" not in detail
+
+
+class QueryStats:
+    """The latency histogram and query plan of a normalized statement."""
+
+    def __init__(self, sql: str) -> None:
+        self.sql = sql
+        self.count = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.histogram = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+        # list of the details of the steps of the query plan, set once the
+        # statement was slow
+        self.plan: list = None
+        self.plan_pending = False
+
+    def add(self, duration: float):
+        duration_ms = duration * 1000
+        self.count += 1
+        self.total_time += duration
+        self.max_time = max(self.max_time, duration)
+        for i, bound in enumerate(HISTOGRAM_BOUNDS):
+            if duration_ms <= bound:
+                self.histogram[i] += 1
+                return
+        self.histogram[-1] += 1
+
+    @property
+    def avg_time(self) -> float:
+        return self.total_time / self.count if self.count else 0.0
+
+    def percentile(self, percent: float) -> float:
+        """Estimate a percentile of the durations (in seconds) from the
+        histogram: the upper bound of the bucket it's in (or the max duration
+        if it's in the last bucket)."""
+        if self.count == 0:
+            return 0.0
+        rank = self.count * percent / 100
+        cumulated = 0
+        for i, nb in enumerate(self.histogram):
+            cumulated += nb
+            if cumulated >= rank:
+                if i < len(HISTOGRAM_BOUNDS):
+                    return min(HISTOGRAM_BOUNDS[i] / 1000, self.max_time)
+                break
+        return self.max_time
+
+    @property
+    def full_scans(self) -> list:
+        """The steps of the query plan scanning a whole table."""
+        return [detail for detail in self.plan or [] if is_full_scan(detail)]
+
+
+class DbQueryStats:
+    """Time the statements executed on the database, grouped by normalized SQL.
+
+    `record()` tells when the query plan of a slow statement should be
+    captured (once per statement), the plan is then given with `set_plan()`."""
+
+    def __init__(self, slow_threshold: float = SLOW_QUERY_THRESHOLD) -> None:
+        self.slow_threshold = slow_threshold
+        self.statements = {}
+        # (datetime, duration, normalized sql) of the last slow statements
+        self.slow_log = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+        self.started_at = time.time()
+
+    def record(self, query: str, duration: float) -> bool:
+        """Add the duration (in seconds) of a statement, return True if it was
+        slow and its query plan should be captured."""
+        sql = normalize_sql(query)
+        stats = self.statements.get(sql)
+        if stats is None:
+            stats = self.statements[sql] = QueryStats(sql)
+        stats.add(duration)
+        if duration < self.slow_threshold:
+            return False
+        self.slow_log.append((datetime.utcnow(), duration, sql))
+        if stats.plan is not None or stats.plan_pending:
+            return False
+        stats.plan_pending = True
+        return True
+
+    def set_plan(self, query: str, plan: list):
+        """Save the query plan of a statement (list of the step details), None if
+        it couldn't be captured."""
+        stats = self.statements.get(normalize_sql(query))
+        if stats is None:
+            return
+        stats.plan_pending = False
+        stats.plan = plan
+
+    def get_slowest(self, limit: int = 10, key: str = "avg") -> list:
+        """Get the `QueryStats` of the slowest statements.
+
+        :param key: sort by "avg" (average duration), "max" (max duration)
+            or "total" (total time spent on the statement)"""
+        sort_keys = {
+            "avg": lambda s: s.avg_time,
+            "max": lambda s: s.max_time,
+            "total": lambda s: s.total_time,
+        }
+        statements = sorted(self.statements.values(), key=sort_keys[key], reverse=True)
+        return statements[:limit]
+
+    def get_full_scans(self) -> list:
+        """Get the `QueryStats` of the statements with a full scan in their
+        captured query plan, by total time."""
+        statements = [s for s in self.statements.values() if s.full_scans]
+        return sorted(statements, key=lambda s: s.total_time, reverse=True)
+
+    def reset(self):
+        self.statements = {}
+        self.slow_log.clear()
+        self.started_at = time.time()
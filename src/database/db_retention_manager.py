@@ -0,0 +1,213 @@
+import logging
+from datetime import datetime, timedelta
+
+from database.db_connection import DbConnection
+from database.db_rollup_manager import GRANULARITIES
+
+logger = logging.getLogger(__name__)
+
+# granularity of the values kept for a canvas depending on its age (0 is the
+# current canvas, 1 the previous one, ...), the last one is used for all the
+# older canvases and None keeps all the values
+RETENTION_POLICY = (None, "hour", "hour", "day")
+# time frame downsampled in a step
+RETENTION_WINDOW = timedelta(days=7)
+# max number of steps done each time the retention is applied
+RETENTION_MAX_STEPS = 20
+# max number of free pages released by an incremental vacuum
+VACUUM_PAGES = 5000
+# max number of rows read by ANALYZE per index
+ANALYSIS_LIMIT = 1000
+
+
+def _to_datetime(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
+
+
+class DbRetentionManager:
+    """A class to downsample the periodic stats of the old canvases.
+
+    The values of the canvases that ended are merged per hour or day (see
+    `RETENTION_POLICY`): each period keeps the average of the general stats and
+    the last template progress. The tables are downsampled incrementally, a time
+    window at a time, and the progress of each canvas is saved in the
+    `retention_state` table."""
+
+    # for each table: the query to get the datetime range of a canvas, the
+    # query to get its rows (rowid, key, datetime, value) in a time frame and
+    # if the values of a period are averaged (if not, the last one is kept)
+    TABLES = {
+        "pxls_general_stat": (
+            """
+            SELECT MIN(datetime), MAX(datetime) FROM pxls_general_stat
+            WHERE canvas_code = ?""",
+            """
+            SELECT rowid, stat_name AS key, datetime, value FROM pxls_general_stat
+            WHERE canvas_code = ? AND datetime >= ? AND datetime < ?
+            ORDER BY datetime""",
+            True,
+        ),
+        "template_stat": (
+            """
+            SELECT MIN(datetime), MAX(datetime) FROM template_stat
+            JOIN template ON template.id = template_stat.template_id
+            WHERE template.canvas_code = ?""",
+            """
+            SELECT template_stat.rowid, template_id AS key, datetime, progress AS value
+            FROM template_stat
+            JOIN template ON template.id = template_stat.template_id
+            WHERE template.canvas_code = ? AND datetime >= ? AND datetime < ?
+            ORDER BY datetime""",
+            False,
+        ),
+    }
+
+    def __init__(
+        self,
+        db_conn: DbConnection,
+        policy: tuple = RETENTION_POLICY,
+        window: timedelta = RETENTION_WINDOW,
+    ) -> None:
+        self.db = db_conn
+        self.policy = policy
+        self.window = window
+
+    async def create_tables(self):
+        # datetime until which each canvas is downsampled in each table
+        create_retention_state_table = """
+            CREATE TABLE IF NOT EXISTS retention_state(
+                source_table TEXT,
+                canvas_code TEXT,
+                granularity TEXT,
+                done_until TIMESTAMP,
+                PRIMARY KEY (source_table, canvas_code)
+            );"""
+        await self.db.sql_update(create_retention_state_table)
+
+    async def get_canvas_granularities(self) -> dict:
+        """Get the granularity to keep for each canvas with a record
+        (format: {canvas_code: granularity})"""
+        rows = await self.db.sql_select(
+            "SELECT canvas_code FROM canvas_record ORDER BY first_datetime DESC"
+        )
+        res = {}
+        for age, row in enumerate(rows):
+            res[row["canvas_code"]] = self.policy[min(age, len(self.policy) - 1)]
+        return res
+
+    async def _get_state(self, table, canvas_code, granularity):
+        """Get the datetime until which a canvas is downsampled in a table with
+        the granularity (None if it wasn't)."""
+        rows = await self.db.sql_select(
+            """
+            SELECT granularity, done_until FROM retention_state
+            WHERE source_table = ? AND canvas_code = ?""",
+            (table, canvas_code),
+        )
+        if not rows or rows[0]["granularity"] != granularity:
+            # the canvas must be downsampled again if its granularity changed
+            return None
+        return rows[0]["done_until"]
+
+    async def _step(self, table, canvas_code, granularity):
+        """Downsample the next time window of a canvas in a table.
+
+        Return the number of rows deleted or None if the canvas is already
+        downsampled."""
+        range_sql, rows_sql, average = self.TABLES[table]
+        format = GRANULARITIES[granularity]
+        rows = await self.db.sql_select(range_sql, canvas_code)
+        first_dt, last_dt = [_to_datetime(dt) for dt in rows[0]]
+        done_until = await self._get_state(table, canvas_code, granularity)
+        if first_dt is None or (done_until and done_until > last_dt):
+            return None
+        # the windows start on a day so the periods are never split
+        start = (done_until or first_dt).replace(hour=0, minute=0, second=0)
+        end = start + self.window
+
+        async with self.db.writer() as conn, conn.cursor() as cur:
+            await cur.execute(rows_sql, (canvas_code, start, end))
+            periods = {}
+            for row in await cur.fetchall():
+                key = (row["key"], _to_datetime(row["datetime"]).strftime(format))
+                periods.setdefault(key, []).append(row)
+
+            to_update = []
+            to_delete = []
+            for period_rows in periods.values():
+                if len(period_rows) == 1:
+                    continue
+                if average:
+                    kept = period_rows[0]
+                    values = []
+                    for row in period_rows:
+                        try:
+                            values.append(float(row["value"]))
+                        except (TypeError, ValueError):
+                            pass
+                    if values:
+                        to_update.append((round(sum(values) / len(values)), kept[0]))
+                else:
+                    kept = period_rows[-1]
+                to_delete += [(row[0],) for row in period_rows if row is not kept]
+
+            await cur.execute("BEGIN TRANSACTION;")
+            try:
+                if to_update:
+                    await cur.executemany(
+                        f"UPDATE {table} SET value = ? WHERE rowid = ?", to_update
+                    )
+                await cur.executemany(f"DELETE FROM {table} WHERE rowid = ?", to_delete)
+                await cur.execute(
+                    """
+                    INSERT INTO retention_state
+                        (source_table, canvas_code, granularity, done_until)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT (source_table, canvas_code) DO UPDATE SET
+                        granularity = excluded.granularity,
+                        done_until = excluded.done_until""",
+                    (table, canvas_code, granularity, end),
+                )
+            except Exception:
+                await cur.execute("ROLLBACK;")
+                raise
+            await cur.execute("COMMIT;")
+        return len(to_delete)
+
+    async def downsample(self, max_steps: int = RETENTION_MAX_STEPS) -> int:
+        """Downsample at most `max_steps` time windows of the old canvases,
+        return the number of rows deleted."""
+        canvases = await self.get_canvas_granularities()
+        nb_steps = 0
+        nb_deleted = 0
+        for table in self.TABLES:
+            for canvas_code, granularity in canvases.items():
+                if granularity is None:
+                    continue
+                while nb_steps < max_steps:
+                    deleted = await self._step(table, canvas_code, granularity)
+                    if deleted is None:
+                        break
+                    nb_steps += 1
+                    nb_deleted += deleted
+        return nb_deleted
+
+    async def optimize(self, vacuum_pages: int = VACUUM_PAGES):
+        """Release some of the free pages (only if the database uses incremental
+        auto-vacuum) and update the statistics of the query planner."""
+        async with self.db.writer() as conn, conn.cursor() as cur:
+            # a single execute() only releases one page
+            await cur.executescript(f"PRAGMA incremental_vacuum({vacuum_pages});")
+            await cur.execute(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}")
+            await cur.execute("PRAGMA optimize")
+
+    async def run(self, max_steps: int = RETENTION_MAX_STEPS) -> int:
+        """Apply the retention policy incrementally and optimize the database,
+        return the number of rows deleted."""
+        nb_deleted = await self.downsample(max_steps)
+        await self.optimize()
+        if nb_deleted:
+            logger.info(f"Retention policy applied: {nb_deleted} rows downsampled.")
+        return nb_deleted
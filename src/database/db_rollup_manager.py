@@ -0,0 +1,537 @@
+from datetime import datetime, timedelta
+
+from database.db_connection import DbConnection
+
+# strftime format of the period for each rollup granularity
+GRANULARITIES = {
+    "hour": "%Y-%m-%d %H",
+    "day": "%Y-%m-%d",
+    "week": "%Y-%W",
+    "month": "%Y-%m",
+}
+# approximate length of each granularity (used to choose one for a time frame)
+GRANULARITY_LENGTHS = {
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+    "week": timedelta(weeks=1),
+    "month": timedelta(days=30),
+}
+# number of rows processed per transaction when backfilling
+BACKFILL_CHUNK_SIZE = 100
+
+
+class DbRollupManager:
+    """A class to manage the rollup tables: the pxls user stats and general stats
+    aggregated per hour, day, week and month.
+
+    The rollups are updated incrementally after each insert and the existing
+    data is rolled up with `backfill()`. The range of rows already rolled up
+    for each source table is saved in `rollup_state` so a query only reads the
+    rollups if they cover the time frame asked."""
+
+    def __init__(self, db_conn: DbConnection) -> None:
+        self.db = db_conn
+
+    async def create_tables(self):
+        create_user_stat_rollup_table = """
+            CREATE TABLE IF NOT EXISTS pxls_user_stat_rollup(
+                granularity TEXT,
+                pxls_name_id INTEGER,
+                period TEXT,
+                canvas_code TEXT,
+                first_datetime TIMESTAMP,
+                last_datetime TIMESTAMP,
+                counts_datetime TIMESTAMP,
+                alltime_count INTEGER,
+                canvas_count INTEGER,
+                has_left INTEGER,
+                PRIMARY KEY (granularity, pxls_name_id, period, canvas_code)
+            );"""
+        create_general_stat_rollup_table = """
+            CREATE TABLE IF NOT EXISTS pxls_general_stat_rollup(
+                stat_name TEXT,
+                granularity TEXT,
+                period TEXT,
+                canvas_code TEXT,
+                first_datetime TIMESTAMP,
+                last_datetime TIMESTAMP,
+                value_sum REAL,
+                value_count INTEGER,
+                PRIMARY KEY (stat_name, granularity, period, canvas_code)
+            );"""
+        # first and last row id rolled up for each source table
+        create_rollup_state_table = """
+            CREATE TABLE IF NOT EXISTS rollup_state(
+                source_table TEXT PRIMARY KEY,
+                first_id INTEGER,
+                last_id INTEGER
+            );"""
+        await self.db.sql_update(create_user_stat_rollup_table)
+        await self.db.sql_update(create_general_stat_rollup_table)
+        await self.db.sql_update(create_rollup_state_table)
+
+    # rollup updates #
+    @staticmethod
+    async def _roll_up_user_stats(cur, first_id, last_id):
+        """Add the pxls_user_stat rows between 2 record IDs to the rollups.
+
+        A period keeps the counts of its latest row with counts (at
+        `counts_datetime`) and `has_left` is set if its latest row is the one of
+        a user leaving the stats (both counts NULL). The rows of a period can be
+        rolled up in any order."""
+        sql = """
+            INSERT INTO pxls_user_stat_rollup(
+                granularity, pxls_name_id, period, canvas_code, first_datetime,
+                last_datetime, counts_datetime, alltime_count, canvas_count, has_left)
+            SELECT
+                ?,
+                pxls_name_id,
+                strftime(?, datetime),
+                canvas_code,
+                datetime,
+                datetime,
+                CASE WHEN alltime_count IS NULL AND canvas_count IS NULL
+                    THEN NULL ELSE datetime END,
+                alltime_count,
+                canvas_count,
+                alltime_count IS NULL AND canvas_count IS NULL
+            FROM pxls_user_stat
+            JOIN record ON record.record_id = pxls_user_stat.record_id
+            WHERE pxls_user_stat.record_id BETWEEN ? AND ?
+            ORDER BY pxls_user_stat.record_id
+            ON CONFLICT (granularity, pxls_name_id, period, canvas_code) DO UPDATE SET
+                alltime_count = CASE WHEN {0} THEN excluded.alltime_count
+                    ELSE alltime_count END,
+                canvas_count = CASE WHEN {0} THEN excluded.canvas_count
+                    ELSE canvas_count END,
+                counts_datetime = CASE WHEN {0} THEN excluded.counts_datetime
+                    ELSE counts_datetime END,
+                has_left = CASE WHEN excluded.last_datetime >= last_datetime
+                    THEN excluded.has_left ELSE has_left END,
+                first_datetime = MIN(first_datetime, excluded.first_datetime),
+                last_datetime = MAX(last_datetime, excluded.last_datetime)""".format(
+            "excluded.counts_datetime >= IFNULL(counts_datetime, '')"
+        )
+        for granularity, format in GRANULARITIES.items():
+            await cur.execute(sql, (granularity, format, first_id, last_id))
+
+    @staticmethod
+    async def _roll_up_general_stats(cur, first_id, last_id):
+        """Add the pxls_general_stat rows between 2 row IDs to the rollups,
+        a period keeps the sum and the number of values to get their average."""
+        sql = """
+            INSERT INTO pxls_general_stat_rollup(
+                stat_name, granularity, period, canvas_code, first_datetime,
+                last_datetime, value_sum, value_count)
+            SELECT
+                stat_name,
+                ?,
+                {},
+                canvas_code,
+                datetime,
+                datetime,
+                IFNULL(CAST(value AS REAL), 0),
+                value IS NOT NULL
+            FROM pxls_general_stat
+            WHERE rowid BETWEEN ? AND ?
+            ORDER BY rowid
+            ON CONFLICT (stat_name, granularity, period, canvas_code) DO UPDATE SET
+                first_datetime = MIN(first_datetime, excluded.first_datetime),
+                last_datetime = MAX(last_datetime, excluded.last_datetime),
+                value_sum = value_sum + excluded.value_sum,
+                value_count = value_count + excluded.value_count"""
+        for granularity, format in GRANULARITIES.items():
+            await cur.execute(
+                sql.format("strftime(?, datetime)"),
+                (granularity, format, first_id, last_id),
+            )
+        # the general stats can also be grouped by canvas
+        await cur.execute(sql.format("canvas_code"), ("canvas", first_id, last_id))
+
+    # query to get the last ID and method to roll up rows for each source table
+    SOURCES = {
+        "pxls_user_stat": ("SELECT MAX(record_id) FROM record", "_roll_up_user_stats"),
+        "pxls_general_stat": (
+            "SELECT MAX(rowid) FROM pxls_general_stat",
+            "_roll_up_general_stats",
+        ),
+    }
+
+    async def get_state(self, source_table):
+        """Get the (first_id, last_id) range rolled up for a source table
+        or (None, None) if nothing was rolled up yet."""
+        sql = "SELECT first_id, last_id FROM rollup_state WHERE source_table = ?"
+        rows = await self.db.sql_select(sql, source_table)
+        if not rows:
+            return None, None
+        return rows[0]["first_id"], rows[0]["last_id"]
+
+    async def update(self, source_table):
+        """Roll up the rows added to a source table since the last update.
+
+        The first update only rolls up the latest row, the older ones are
+        handled by `backfill()`."""
+        max_sql, roll_up = self.SOURCES[source_table]
+        roll_up = getattr(self, roll_up)
+        async with self.db.writer() as conn, conn.cursor() as cur:
+            await cur.execute(max_sql)
+            max_id = (await cur.fetchone())[0]
+            await cur.execute(
+                "SELECT last_id FROM rollup_state WHERE source_table = ?", source_table
+            )
+            state = await cur.fetchone()
+            if max_id is None or (state and state["last_id"] >= max_id):
+                return
+            first_id = state["last_id"] + 1 if state else max_id
+
+            await cur.execute("BEGIN TRANSACTION;")
+            try:
+                await roll_up(cur, first_id, max_id)
+                await cur.execute(
+                    """
+                    INSERT INTO rollup_state(source_table, first_id, last_id)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT (source_table) DO UPDATE SET last_id = excluded.last_id
+                    """,
+                    (source_table, first_id, max_id),
+                )
+            except Exception:
+                await cur.execute("ROLLBACK;")
+                raise
+            await cur.execute("COMMIT;")
+
+    async def roll_up_record_again(self, cur, record_id):
+        """Roll up the pxls user stats of a record after they were changed, in the
+        transaction of the writer's cursor. A record that wasn't rolled up yet
+        is skipped: it will be with the others."""
+        await cur.execute(
+            """
+            SELECT first_id, last_id FROM rollup_state
+            WHERE source_table = 'pxls_user_stat'"""
+        )
+        state = await cur.fetchone()
+        if state and state["first_id"] <= record_id <= state["last_id"]:
+            await self._roll_up_user_stats(cur, record_id, record_id)
+
+    async def update_user_stats(self):
+        """Roll up the new pxls user stats (called after each record)."""
+        await self.update("pxls_user_stat")
+
+    async def update_general_stats(self):
+        """Roll up the new general stats (called after each insert)."""
+        await self.update("pxls_general_stat")
+
+    async def backfill(self, source_table, chunk_size=BACKFILL_CHUNK_SIZE):
+        """Roll up one chunk of the rows older than the ones already rolled up.
+
+        Return the number of IDs left to backfill (0 once it's done)."""
+        first_id, _ = await self.get_state(source_table)
+        if first_id is None:
+            # start from the latest row
+            await self.update(source_table)
+            first_id, _ = await self.get_state(source_table)
+            if first_id is None:
+                return 0
+        if first_id <= 1:
+            return 0
+
+        roll_up = getattr(self, self.SOURCES[source_table][1])
+        chunk_start = max(1, first_id - chunk_size)
+        async with self.db.writer() as conn, conn.cursor() as cur:
+            await cur.execute("BEGIN TRANSACTION;")
+            try:
+                await roll_up(cur, chunk_start, first_id - 1)
+                await cur.execute(
+                    "UPDATE rollup_state SET first_id = ? WHERE source_table = ?",
+                    (chunk_start, source_table),
+                )
+            except Exception:
+                await cur.execute("ROLLBACK;")
+                raise
+            await cur.execute("COMMIT;")
+        return chunk_start - 1
+
+    # rollup queries #
+    async def _is_last_of_period(self, table, row, format, where, param):
+        """Check that there is no row after `row` in its period (the rollup of
+        that period would contain data after it), a `format` of None means that
+        the period is the canvas"""
+        sql = """
+            SELECT datetime, canvas_code FROM {} WHERE {} AND datetime > ?
+            ORDER BY datetime LIMIT 1""".format(
+            table, where
+        )
+        rows = await self.db.sql_select(sql, param + (row["datetime"],))
+        if not rows:
+            return True
+        if format is None:
+            return rows[0]["canvas_code"] != row["canvas_code"]
+        return rows[0]["datetime"].strftime(format) != row["datetime"].strftime(format)
+
+    async def _get_user_stats_per_period(
+        self, user_list, record1, record2, granularity, canvas_code
+    ):
+        """Get the last counts of the users in each period between 2 records,
+        like `DbStatsManager._get_grouped_stats_history()`: a user that was in
+        the stats for at least one record of a period has the counts of the last
+        one.
+
+        The pxls user stats are delta-encoded so a period without a rollup row
+        for a user means that their counts didn't change, the counts are carried
+        forward from the previous period until the user leaves the stats.
+
+        Return a tuple (periods, users) with the list of periods rows (period,
+        first_datetime, last_datetime) and a dictionary {name: {period: row}}
+        or None if the rollups can't be used for these records."""
+        format = GRANULARITIES[granularity]
+        first_id, last_id = await self.get_state("pxls_user_stat")
+        if first_id is None or not (
+            first_id <= record1["record_id"] and record2["record_id"] <= last_id
+        ):
+            return None
+        if canvas_code:
+            where, param = "canvas_code = ?", (canvas_code,)
+        else:
+            where, param = "canvas_code IS NOT NULL", ()
+        if not await self._is_last_of_period("record", record2, format, where, param):
+            return None
+
+        periods = await self.db.sql_select(
+            """
+            SELECT
+                strftime(?, datetime) as period,
+                MIN(datetime) as first_datetime,
+                MAX(datetime) as last_datetime
+            FROM record
+            WHERE record_id BETWEEN ? AND ? AND {}
+            GROUP BY period
+            ORDER BY period""".format(
+                where
+            ),
+            (format, record1["record_id"], record2["record_id"]) + param,
+        )
+        if not periods:
+            return periods, {}
+
+        # the rows in the time frame and the last row of each user before it
+        sql = """
+            SELECT name, period, {2}
+            FROM pxls_user_stat_rollup
+            JOIN pxls_name ON pxls_name.pxls_name_id = pxls_user_stat_rollup.pxls_name_id
+            WHERE granularity = ?
+                AND name IN ({0})
+                AND period BETWEEN ? AND ?
+                AND {1}
+            UNION ALL
+            SELECT name, period, {2}
+            FROM pxls_name
+            JOIN pxls_user_stat_rollup r ON r.rowid = (
+                SELECT rowid FROM pxls_user_stat_rollup
+                WHERE granularity = ?
+                    AND pxls_name_id = pxls_name.pxls_name_id
+                    AND period < ?
+                    AND {1}
+                ORDER BY period DESC, last_datetime DESC
+                LIMIT 1
+            )
+            WHERE name IN ({0})
+            ORDER BY period, last_datetime""".format(
+            ", ".join("?" for u in user_list),
+            where,
+            "first_datetime, last_datetime, counts_datetime, alltime_count, "
+            "canvas_count, has_left",
+        )
+        first_period = periods[0]["period"]
+        rows = await self.db.sql_select(
+            sql,
+            (granularity,)
+            + tuple(user_list)
+            + (first_period, periods[-1]["period"])
+            + param
+            + (granularity, first_period)
+            + param
+            + tuple(user_list),
+        )
+
+        # merge the rows of each user in each period (there is a row per canvas)
+        user_periods = {}
+        for row in rows:
+            period_rows = user_periods.setdefault(row["name"], {})
+            merged = period_rows.get(row["period"])
+            if merged is None:
+                period_rows[row["period"]] = dict(row)
+                continue
+            # the rows are sorted by last_datetime
+            merged["first_datetime"] = min(
+                merged["first_datetime"], row["first_datetime"]
+            )
+            merged["last_datetime"] = row["last_datetime"]
+            merged["has_left"] = row["has_left"]
+            if row["counts_datetime"] is not None and (
+                merged["counts_datetime"] is None
+                or row["counts_datetime"] > merged["counts_datetime"]
+            ):
+                merged["counts_datetime"] = row["counts_datetime"]
+                merged["alltime_count"] = row["alltime_count"]
+                merged["canvas_count"] = row["canvas_count"]
+
+        users = {}
+        for name in sorted(user_periods.keys()):
+            user_rows = user_periods[name]
+            # the row with the user's counts if they're in the stats
+            last_row = None
+            for period in sorted(p for p in user_rows.keys() if p < first_period):
+                last_row = None if user_rows[period]["has_left"] else user_rows[period]
+            users[name] = {}
+            for period in periods:
+                row = user_rows.get(period["period"])
+                if row is None:
+                    value_row = last_row
+                elif row["counts_datetime"] is not None:
+                    value_row = row
+                else:
+                    # the user left in this period without new counts, they're
+                    # only in the stats if some records of the period are before
+                    first_dt = datetime.strptime(
+                        period["first_datetime"], "%Y-%m-%d %H:%M:%S"
+                    )
+                    value_row = last_row if first_dt < row["first_datetime"] else None
+                if row is not None:
+                    last_row = None if row["has_left"] else row
+                if value_row is not None:
+                    users[name][period["period"]] = value_row
+        return periods, users
+
+    async def get_grouped_user_stats(
+        self, user_list, record1, record2, groupby_opt, canvas_code=None
+    ):
+        """Get the stats of the users between 2 records grouped by period,
+        in the same format as `DbStatsManager.get_grouped_stats_history()`.
+
+        Return None if the rollups can't be used for these records."""
+        if groupby_opt not in GRANULARITIES:
+            return None
+        res = await self._get_user_stats_per_period(
+            user_list, record1, record2, groupby_opt, canvas_code
+        )
+        if res is None:
+            return None
+        periods, users = res
+
+        count = "canvas_count" if canvas_code else "alltime_count"
+        rows = []
+        for name, user_rows in users.items():
+            previous = None
+            for period in periods:
+                row = user_rows.get(period["period"])
+                if row is None:
+                    continue
+                pixels = row[count]
+                placed = None
+                if pixels is not None and previous is not None:
+                    placed = pixels - previous
+                previous = pixels
+                rows.append(
+                    {
+                        "name": name,
+                        "pixels": pixels,
+                        "placed": placed,
+                        "first_datetime": period["first_datetime"],
+                        "last_datetime": period["last_datetime"],
+                    }
+                )
+        return rows
+
+    async def get_user_stats_history(
+        self, user_list, record1, record2, max_points, canvas_code=None
+    ):
+        """Get the stats of the users between 2 records with at most `max_points`
+        values per user (one per period of the finest granularity possible),
+        in the same format as `DbStatsManager.get_stats_history()`.
+
+        Return None if the rollups can't be used for these records."""
+        duration = record2["datetime"] - record1["datetime"]
+        for granularity, length in GRANULARITY_LENGTHS.items():
+            if duration / length <= max_points:
+                break
+        else:
+            return None
+        res = await self._get_user_stats_per_period(
+            user_list, record1, record2, granularity, canvas_code
+        )
+        if res is None:
+            return None
+        periods, users = res
+
+        count = "canvas_count" if canvas_code else "alltime_count"
+        rows = []
+        for name, user_rows in users.items():
+            for period in periods:
+                row = user_rows.get(period["period"])
+                if row is None or row[count] is None:
+                    continue
+                dt = datetime.strptime(period["last_datetime"], "%Y-%m-%d %H:%M:%S")
+                rows.append({"name": name, "pixels": row[count], "datetime": dt})
+        rows.sort(key=lambda row: (row["pixels"], row["datetime"]))
+        return rows
+
+    async def get_grouped_general_stat(self, name, dt1, dt2, groupby_opt, canvas_code):
+        """Get the average of a general stat per period between the stats
+        closest to 2 dates.
+
+        Return a list of rows with the period, canvas_code, first_datetime,
+        last_datetime and average or None if the rollups can't be used."""
+        if groupby_opt == "canvas":
+            format = None
+        else:
+            format = GRANULARITIES.get(groupby_opt)
+            if format is None:
+                return None
+        if canvas_code is None:
+            where, param = "1", ()
+        else:
+            where, param = "canvas_code = ?", (canvas_code,)
+
+        first = await self.db.sql_select_nearest(
+            "pxls_general_stat", dt1, where, param, "rowid AS stat_id, *"
+        )
+        last = await self.db.sql_select_nearest(
+            "pxls_general_stat", dt2, where, param, "rowid AS stat_id, *"
+        )
+        if first is None or last is None:
+            return None
+        first_id, last_id = await self.get_state("pxls_general_stat")
+        if first_id is None or not (
+            first_id <= first["stat_id"] and last["stat_id"] <= last_id
+        ):
+            return None
+        if not await self._is_last_of_period(
+            "pxls_general_stat",
+            last,
+            format,
+            f"stat_name = ? AND {where}",
+            (name,) + param,
+        ):
+            return None
+
+        sql = """
+            SELECT
+                period,
+                canvas_code,
+                MIN(first_datetime) as first_datetime,
+                MAX(last_datetime) as last_datetime,
+                SUM(value_sum) / SUM(value_count) as average
+            FROM pxls_general_stat_rollup
+            WHERE stat_name = ?
+                AND granularity = ?
+                AND first_datetime <= ?
+                AND last_datetime >= ?
+                AND {}
+            GROUP BY period
+            HAVING SUM(value_count) > 0
+            ORDER BY MIN(first_datetime)""".format(
+            where
+        )
+        return await self.db.sql_select(
+            sql, (name, groupby_opt, last["datetime"], first["datetime"]) + param
+        )
@@ -1,4 +1,4 @@
-from sqlite3 import IntegrityError, OperationalError
+from sqlite3 import IntegrityError
 
 from database.db_connection import DbConnection
 
@@ -10,6 +10,10 @@ class DbServersManager:
         self.db = db_conn
         self.default_prefix = default_prefix
 
+        # the settings of all the servers (key: server ID, value: server row as
+        # a dictionary), loaded with `load_servers()` and updated by the setters
+        self.servers = None
+
     async def create_tables(self):
         """create database tables"""
         create_server_table = """
@@ -17,12 +21,10 @@ class DbServersManager:
                 server_id TEXT PRIMARY KEY,
                 prefix TEXT,
                 alert_channel_id INTEGER,
-                blacklist_role_id TEXT
+                blacklist_role_id TEXT,
+                snapshots_channel_id TEXT
             );
         """
-        add_server_snapshots_channel = (
-            "ALTER TABLE server ADD COLUMN snapshots_channel_id TEXT"
-        )
 
         create_command_usage_table = """
             CREATE TABLE IF NOT EXISTS command_usage(
@@ -38,25 +40,50 @@ class DbServersManager:
         """
 
         await self.db.sql_update(create_server_table)
-        try:
-            await self.db.sql_update(add_server_snapshots_channel)
-        except OperationalError:
-            pass
         await self.db.sql_update(create_command_usage_table)
 
+    # servers settings cache #
+    async def load_servers(self):
+        """Load the settings of all the servers in memory."""
+        rows = await self.db.sql_select("SELECT * FROM server")
+        self.servers = {row["server_id"]: dict(row) for row in rows}
+
+    async def _reload_server(self, server_id):
+        """Update the cached settings of a server after a change in the database."""
+        if self.servers is None:
+            return
+        rows = await self.db.sql_select(
+            "SELECT * FROM server WHERE server_id = ?", (server_id,)
+        )
+        if rows:
+            self.servers[rows[0]["server_id"]] = dict(rows[0])
+        else:
+            self.servers.pop(str(server_id), None)
+
+    async def _get_server_settings(self, server_id):
+        """Get the settings of a server as a dictionary or None if it isn't in
+        the database."""
+        if self.servers is None:
+            await self.load_servers()
+        return self.servers.get(str(server_id))
+
     async def create_server(self, server_id, prefix):
         """add a 'server' to the database"""
         sql = """ INSERT INTO server(server_id,prefix)
                 VALUES(?,?) """
         try:
-            return await self.db.sql_update(sql, (server_id, prefix))
+            res = await self.db.sql_update(sql, (server_id, prefix))
         except IntegrityError:
             return 0
+        await self._reload_server(server_id)
+        return res
 
     async def delete_server(self, server_id):
         """remove a server from the database"""
         sql = """ DELETE FROM server WHERE server_id = ? """
-        return await self.db.sql_update(sql, server_id)
+        res = await self.db.sql_update(sql, server_id)
+        await self._reload_server(server_id)
+        return res
 
     async def update_prefix(self, prefix, server_id):
         """change the prefix of a server"""
@@ -64,31 +91,29 @@ class DbServersManager:
                 SET prefix = ?
                 WHERE server_id = ?"""
         await self.db.sql_update(sql, (prefix, server_id))
+        await self._reload_server(server_id)
 
     async def get_prefix(self, bot, message):
         """get the prefix of the context of a discord message"""
         if message.guild is None:
             return ">"
-        sql = """SELECT prefix
-                    FROM server
-                    WHERE server_id = ?"""
-        rows = await self.db.sql_select(sql, (message.guild.id,))
-        if len(rows) == 0:
+        server = await self._get_server_settings(message.guild.id)
+        if server is None:
             return self.default_prefix
-        return rows[0][0]
+        return server["prefix"]
 
     async def update_blacklist_role(self, server_id, role_id):
         sql = """ UPDATE server
                 SET blacklist_role_id = ?
                 WHERE server_id = ?"""
         await self.db.sql_update(sql, (role_id, server_id))
+        await self._reload_server(server_id)
 
     async def get_blacklist_role(self, server_id):
-        sql = """ SELECT blacklist_role_id
-                FROM server
-                WHERE server_id = ?"""
-        res = await self.db.sql_select(sql, (server_id,))
-        return res[0][0]
+        server = await self._get_server_settings(server_id)
+        if server is None:
+            return None
+        return server["blacklist_role_id"]
 
     # functions useful for the milestones command #
     async def update_alert_channel(self, server_id, channel_id):
@@ -96,17 +121,15 @@ class DbServersManager:
                 SET alert_channel_id = ?
                 WHERE server_id = ?"""
         await self.db.sql_update(sql, (channel_id, server_id))
+        await self._reload_server(server_id)
 
     async def get_alert_channel(self, server_id):
         """get the ID of the alert channel in a server"""
-        sql = """SELECT alert_channel_id
-                    FROM server
-                    WHERE server_id = ?"""
-        res = await self.db.sql_select(sql, server_id)
-        if len(res) == 0:
+        server = await self._get_server_settings(server_id)
+        if server is None:
             return None
         else:
-            return res[0][0]
+            return server["alert_channel_id"]
 
     async def get_all_channels(self, name):
         '''return a list of channels_id for the servers tracking the user "name"'''
@@ -129,29 +152,24 @@ class DbServersManager:
             SET snapshots_channel_id = ?
             WHERE server_id = ?"""
         await self.db.sql_update(sql, (channel_id, server_id))
+        await self._reload_server(server_id)
 
     async def get_snapshots_channel(self, server_id):
         """get the ID of the snapshots channel in a server"""
-        sql = """
-            SELECT snapshots_channel_id
-            FROM server
-            WHERE server_id = ?"""
-        res = await self.db.sql_select(sql, server_id)
-        if len(res) == 0:
+        server = await self._get_server_settings(server_id)
+        if server is None:
             return None
         else:
-            return res[0][0]
+            return server["snapshots_channel_id"]
 
     async def get_all_snapshots_channels(self):
         """return a list of channels_id for the servers using snapshots"""
-        sql = """
-            SELECT snapshots_channel_id
-            FROM server
-            WHERE snapshots_channel_id IS NOT NULL"""
-        rows = await self.db.sql_select(sql)
+        if self.servers is None:
+            await self.load_servers()
         res = []
-        for row in rows:
-            res.append(row[0])
+        for server in self.servers.values():
+            if server["snapshots_channel_id"] is not None:
+                res.append(server["snapshots_channel_id"])
         return res
 
     async def get_all_servers(self):
@@ -164,12 +182,11 @@ class DbServersManager:
         return res
 
     async def get_server(self, server_id):
-        sql = "SELECT * FROM server WHERE server_id = ?"
-        rows = await self.db.sql_select(sql, server_id)
-        if len(rows) == 0:
+        server = await self._get_server_settings(server_id)
+        if server is None:
             return None
         else:
-            return rows[0][0]
+            return server["server_id"]
 
     async def create_command_usage(
         self,
@@ -208,3 +225,20 @@ class DbServersManager:
                 is_slash,
             ),
         )
+
+    async def create_command_usages(self, usages: list):
+        """Save many command usages in a single transaction, each usage is a tuple
+        with the values of a `command_usage` row."""
+        sql = """
+            INSERT INTO command_usage(
+                command_name,
+                is_dm,
+                server_name,
+                channel_id,
+                author_id,
+                datetime,
+                args,
+                is_slash
+            )
+            VALUES(?, ?, ?, ?, ?, ?, ?, ?) """
+        return await self.db.sql_update_many(sql, usages)
@@ -1,17 +1,82 @@
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
 from sqlite3 import IntegrityError
 
+# This import is only necessary for type hints
+from typing import TYPE_CHECKING
+
 from database.db_connection import DbConnection
-from utils.pxls.pxls_stats_manager import PxlsStatsManager
-from utils.utils import shorten_list
+from database.db_rollup_manager import DbRollupManager
+from database.pxls_name_index import PxlsNameIndex
+
+if TYPE_CHECKING:
+    from utils.pxls.pxls_stats_manager import PxlsStatsManager
+
+# The pxls user stats are delta-encoded: a user's row is only saved when their
+# counts changed since the previous record, except on keyframe records where
+# every user in the stats is saved (every KEYFRAME_INTERVAL records and on the
+# first record of a canvas). A user that left the stats gets a row with both
+# counts NULL, on keyframes too. Set KEYFRAME_INTERVAL to 1 to save every user
+# at every record.
+KEYFRAME_INTERVAL = 48
+
+
+def user_stat_at_sql(pxls_name_id, record_id) -> str:
+    """Get a subquery selecting the record_id of the `pxls_user_stat` row holding
+    the counts of a user at a record: the user's last row since the keyframe.
+
+    :param pxls_name_id: SQL expression of the user's pxls_name_id
+    :param record_id: SQL expression of the record_id"""
+    return """(
+        SELECT s.record_id FROM pxls_user_stat s
+        WHERE s.pxls_name_id = {0}
+            AND s.record_id <= {1}
+            AND s.record_id >= (
+                SELECT MAX(k.record_id) FROM pxls_user_stat_keyframe k
+                WHERE k.record_id <= {1}
+            )
+        ORDER BY s.record_id DESC
+        LIMIT 1
+    )""".format(
+        pxls_name_id, record_id
+    )
+
+
+def user_stats_at_record_sql(record_id) -> str:
+    """Get a subquery selecting the counts of all the users in the stats at
+    a record (pxls_name_id, alltime_count, canvas_count).
+
+    :param record_id: the record_id or an SQL expression of it"""
+    return """(
+        SELECT pxls_name_id, alltime_count, canvas_count FROM (
+            SELECT pxls_name_id, alltime_count, canvas_count, MAX(record_id)
+            FROM pxls_user_stat
+            WHERE record_id <= {0}
+                AND record_id >= (
+                    SELECT MAX(record_id) FROM pxls_user_stat_keyframe
+                    WHERE record_id <= {0}
+                )
+            GROUP BY pxls_name_id
+        )
+        WHERE alltime_count IS NOT NULL OR canvas_count IS NOT NULL
+    )""".format(
+        record_id
+    )
 
 
 class DbStatsManager:
     """A class to manage the pxls stats in the database"""
 
-    def __init__(self, db_conn: DbConnection, stats: PxlsStatsManager) -> None:
+    def __init__(
+        self,
+        db_conn: DbConnection,
+        stats: "PxlsStatsManager",
+        names: PxlsNameIndex = None,
+    ) -> None:
         self.db = db_conn
         self.stats_manager = stats
+        self.names = names or PxlsNameIndex(db_conn)
+        self.rollups = DbRollupManager(db_conn)
 
     async def create_tables(self):
         create_pxls_general_stats_table = """
@@ -58,6 +123,47 @@ class DbStatsManager:
                 PRIMARY KEY (record_id,color_id)
             );"""
 
+        create_keyframe_table = """
+            CREATE TABLE IF NOT EXISTS pxls_user_stat_keyframe(
+                record_id INTEGER PRIMARY KEY,
+                FOREIGN KEY(record_id) REFERENCES record(record_id)
+            );"""
+
+        # first and last record of each canvas
+        create_canvas_record_table = """
+            CREATE TABLE IF NOT EXISTS canvas_record(
+                canvas_code TEXT PRIMARY KEY,
+                first_record_id INTEGER,
+                last_record_id INTEGER,
+                first_datetime TIMESTAMP,
+                last_datetime TIMESTAMP
+            );"""
+
+        # the stats of the users at the last record, rebuilt after each record
+        create_latest_leaderboard_table = """
+            CREATE TABLE IF NOT EXISTS latest_leaderboard(
+                pxls_name_id INTEGER PRIMARY KEY,
+                pxls_user_id INTEGER,
+                name TEXT,
+                record_id INTEGER,
+                datetime TIMESTAMP,
+                alltime_rank INTEGER,
+                alltime_count INTEGER,
+                canvas_rank INTEGER,
+                canvas_count INTEGER,
+                previous_alltime_count INTEGER
+            );"""
+        create_latest_leaderboard_indexes = [
+            """CREATE INDEX IF NOT EXISTS idx_latest_leaderboard_name
+            ON latest_leaderboard(name)""",
+            """CREATE INDEX IF NOT EXISTS idx_latest_leaderboard_user
+            ON latest_leaderboard(pxls_user_id)""",
+            """CREATE INDEX IF NOT EXISTS idx_latest_leaderboard_alltime_rank
+            ON latest_leaderboard(alltime_rank)""",
+            """CREATE INDEX IF NOT EXISTS idx_latest_leaderboard_canvas_rank
+            ON latest_leaderboard(canvas_rank)""",
+        ]
+
         create_snapshot_table = """
             CREATE TABLE IF NOT EXISTS snapshot(
                 datetime TIMESTAMP PRIMARY KEY,
@@ -65,31 +171,111 @@ class DbStatsManager:
                 url TEXT
             );"""
 
+        # indexes used to find the closest row to a datetime
+        create_record_index = """
+            CREATE INDEX IF NOT EXISTS idx_record_canvas_datetime
+            ON record(canvas_code, datetime)"""
+        create_general_stat_index = """
+            CREATE INDEX IF NOT EXISTS idx_pxls_general_stat_datetime
+            ON pxls_general_stat(datetime)"""
+        create_general_stat_canvas_index = """
+            CREATE INDEX IF NOT EXISTS idx_pxls_general_stat_canvas_datetime
+            ON pxls_general_stat(canvas_code, datetime)"""
+        create_snapshot_index = """
+            CREATE INDEX IF NOT EXISTS idx_snapshot_canvas_datetime
+            ON snapshot(canvas_code, datetime)"""
+        # index used to find the last row of a user before a record
+        create_user_stat_index = """
+            CREATE INDEX IF NOT EXISTS idx_pxls_user_stat_name_record
+            ON pxls_user_stat(pxls_name_id, record_id)"""
+
         await self.db.sql_update(create_pxls_general_stats_table)
         await self.db.sql_update(create_record_table)
         await self.db.sql_update(create_pxls_user_stat_table)
+        keyframe_table = await self.db.sql_select(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name=?",
+            "pxls_user_stat_keyframe",
+        )
+        await self.db.sql_update(create_keyframe_table)
+        if not keyframe_table:
+            # the stats saved before the delta encoding are all complete
+            await self.db.sql_update(
+                "INSERT INTO pxls_user_stat_keyframe SELECT record_id FROM record"
+            )
+        canvas_record_table = await self.db.sql_select(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name=?",
+            "canvas_record",
+        )
+        await self.db.sql_update(create_canvas_record_table)
+        if not canvas_record_table:
+            await self.db.sql_update(
+                """
+                INSERT INTO canvas_record
+                SELECT canvas_code, MIN(record_id), MAX(record_id),
+                    MIN(datetime), MAX(datetime)
+                FROM record
+                GROUP BY canvas_code"""
+            )
+        latest_leaderboard_table = await self.db.sql_select(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name=?",
+            "latest_leaderboard",
+        )
+        await self.db.sql_update(create_latest_leaderboard_table)
+        for create_index in create_latest_leaderboard_indexes:
+            await self.db.sql_update(create_index)
+        if not latest_leaderboard_table:
+            await self.update_latest_leaderboard()
         await self.db.sql_update(create_palette_color_table)
         await self.db.sql_update(create_color_stat_table)
         await self.db.sql_update(create_snapshot_table)
+        await self.db.sql_update(create_record_index)
+        await self.db.sql_update(create_general_stat_index)
+        await self.db.sql_update(create_general_stat_canvas_index)
+        await self.db.sql_update(create_snapshot_index)
+        await self.db.sql_update(create_user_stat_index)
+        await self.rollups.create_tables()
 
     # pxls user stats functions #
     async def create_record(self, last_updated, canvas_code):
         """Create a record at the time and canvas given, return None if the
         record already exists"""
         sql = """ INSERT INTO record (datetime, canvas_code) VALUES (?,?)"""
-        try:
-            # create a time record
-            record_id = await self.db.sql_insert(sql, (last_updated, canvas_code))
+        # keep the last record of the canvas up to date
+        sql_canvas_record = """
+            INSERT INTO canvas_record
+            VALUES (:canvas_code, :record_id, :record_id, :datetime, :datetime)
+            ON CONFLICT(canvas_code) DO UPDATE SET
+                last_record_id = excluded.last_record_id,
+                last_datetime = excluded.last_datetime"""
+        async with self.db.writer() as conn, conn.cursor() as cur:
+            await cur.execute("BEGIN TRANSACTION;")
+            try:
+                # create a time record
+                await cur.execute(sql, (last_updated, canvas_code))
+            except IntegrityError:
+                # there is already a record for this time
+                await cur.execute("ROLLBACK;")
+                return None
+            try:
+                record_id = cur.get_cursor().lastrowid
+                await cur.execute(
+                    sql_canvas_record,
+                    {
+                        "canvas_code": canvas_code,
+                        "record_id": record_id,
+                        "datetime": last_updated,
+                    },
+                )
+            except Exception:
+                await cur.execute("ROLLBACK;")
+                raise
+            await cur.execute("COMMIT;")
             return record_id
-        except IntegrityError:
-            # there is already a record for this time
-            return None
 
     async def update_all_pxls_stats(self, alltime_stats, canvas_stats, record_id):
         """Insert all the pxls stats data in the database"""
 
-        await self.db.create_connection()
-        async with self.db.conn.cursor() as cur:
+        async with self.db.writer() as conn, conn.cursor() as cur:
             # make a dictionary of key: username, value: {alltime: ..., canvas: ...}
             users = {}
             for user in alltime_stats:
@@ -105,92 +291,206 @@ class DbStatsManager:
                 except KeyError:
                     users[username] = {"alltime": None, "canvas": canvas_count}
 
-            # get all the pxls_name_id in a dictionary (pxls_name:pxls_name_id)
-            pxls_names = await self.db.sql_select(
-                "SELECT pxls_name_id, name FROM pxls_name"
-            )
+            # get the pxls_name_id of the users from the names index
             names_dict = {}
-            for name in pxls_names:
-                names_dict[name["name"]] = name["pxls_name_id"]
-
-            # get the values to insert for each user
-            values_list = []
+            new_names = []
             for username in users.keys():
-                alltime_count = users[username]["alltime"]
-                canvas_count = users[username]["canvas"]
-                try:
-                    # get user id
-                    pxls_name_id = names_dict[username]
-                except KeyError:
-                    # if user does not exist, create it
-                    pxls_name_id = await self.create_pxls_user(username, cur)
+                pxls_name_id = await self.names.get_name_id(username)
+                if pxls_name_id is None:
+                    new_names.append(username)
+                else:
                     names_dict[username] = pxls_name_id
 
-                values = (record_id, pxls_name_id, alltime_count, canvas_count)
-                values_list.append(values)
-
-            sql = """
-                INSERT INTO pxls_user_stat (record_id, pxls_name_id, alltime_count, canvas_count)
-                VALUES (?,?,?,?)"""
             await cur.execute("BEGIN TRANSACTION;")
-            await cur.executemany(sql, values_list)
+            try:
+                # create the users that don't exist yet
+                created = await self.names.create_users(new_names, cur)
+                for username, (pxls_name_id, _) in created.items():
+                    names_dict[username] = pxls_name_id
+                await self._insert_pxls_stats(cur, users, names_dict, record_id)
+            except Exception:
+                await cur.execute("ROLLBACK;")
+                raise
             await cur.execute("COMMIT;")
+            self.names.add_all(created)
+
+    async def _insert_pxls_stats(self, cur, users, names_dict, record_id):
+        """Insert the counts of the users that changed since the last record
+        (or all of them on a keyframe) and the users who left the stats,
+        in the cursor's transaction."""
+        # get the values to insert for each user
+        values_list = []
+        for username in users.keys():
+            alltime_count = users[username]["alltime"]
+            canvas_count = users[username]["canvas"]
+            pxls_name_id = names_dict[username]
+            values = (record_id, pxls_name_id, alltime_count, canvas_count)
+            values_list.append(values)
 
-        await self.db.conn.commit()
-        await self.db.close_connection()
+        # only keep the counts that changed since the previous record
+        # if this record isn't a keyframe
+        await cur.execute(
+            """
+            SELECT k.record_id, canvas_code FROM pxls_user_stat_keyframe k
+            JOIN record ON record.record_id = k.record_id
+            ORDER BY k.record_id DESC
+            LIMIT 1"""
+        )
+        last_keyframe = await cur.fetchone()
+        await cur.execute("SELECT canvas_code FROM record WHERE record_id = ?", record_id)
+        canvas_code = (await cur.fetchone())["canvas_code"]
+        is_keyframe = (
+            last_keyframe is None
+            or record_id - last_keyframe["record_id"] >= KEYFRAME_INTERVAL
+            or last_keyframe["canvas_code"] != canvas_code
+        )
+        # get the counts at the previous record of the canvas (the record ids
+        # aren't contiguous within a canvas), a keyframe of a new canvas also
+        # ends the stats of the previous one
+        await cur.execute(
+            """
+            SELECT MAX(record_id) FROM record
+            WHERE record_id < ? {}""".format(
+                "" if is_keyframe else "AND canvas_code = ?"
+            ),
+            (record_id,) if is_keyframe else (record_id, canvas_code),
+        )
+        previous_record_id = (await cur.fetchone())[0]
+        previous_counts = {}
+        if previous_record_id is not None:
+            await cur.execute(
+                "SELECT * FROM {}".format(user_stats_at_record_sql(previous_record_id))
+            )
+            previous_counts = {
+                row["pxls_name_id"]: (row["alltime_count"], row["canvas_count"])
+                for row in await cur.fetchall()
+            }
+        new_name_ids = set(values[1] for values in values_list)
+        if not is_keyframe:
+            values_list = [
+                values
+                for values in values_list
+                if previous_counts.get(values[1]) != values[2:]
+            ]
+        # users who left the stats (even on a keyframe, so the rollups know
+        # that they left)
+        for pxls_name_id in previous_counts.keys() - new_name_ids:
+            values_list.append((record_id, pxls_name_id, None, None))
+
+        sql = """
+            INSERT INTO pxls_user_stat (record_id, pxls_name_id, alltime_count, canvas_count)
+            VALUES (?,?,?,?)"""
+        await cur.executemany(sql, values_list)
+        if is_keyframe:
+            await cur.execute(
+                "INSERT INTO pxls_user_stat_keyframe(record_id) VALUES (?)",
+                record_id,
+            )
 
     async def create_pxls_user(self, username, cur):
-        """create a 'pxls_user' and its associated 'pxls_name'"""
-        sql = """ INSERT INTO pxls_user (pxls_user_id) VALUES (NULL)"""
-        await cur.execute(sql)
-        pxls_user_id = cur.get_cursor().lastrowid
-
-        # create the pxls_name
-        sql = """INSERT INTO pxls_name(pxls_user_id,name) VALUES(?,?)"""
-        await cur.execute(sql, (pxls_user_id, username))
-        return cur.get_cursor().lastrowid
-
-    async def get_pxls_name_id(self, username, cursor):
-        sql = """SELECT pxls_name_id FROM pxls_name WHERE name = ?"""
-        await cursor.execute(sql, (username,))
-        res = await cursor.fetchall()
-        if len(res) == 0:
-            return None
-        else:
-            return res[0][0]
+        """create a 'pxls_user' and its associated 'pxls_name' with the writer's
+        cursor (not in a transaction) and return the pxls_name_id"""
+        created = await self.names.create_users([username], cur)
+        self.names.add_all(created)
+        return created[username][0]
+
+    async def get_pxls_name_id(self, username, cursor=None):
+        return await self.names.get_name_id(username)
 
     async def get_last_two_alltime_counts(self, pxls_user_id: int) -> tuple:
         """Get a tuple of the last 2 alltime pixel counts in the database for
-        a given user (used to check if the user hit a milestone)"""
+        a given user (used to check if the user hit a milestone), return None
+        if the user isn't in the last leaderboard"""
         sql = """
-        SELECT name, alltime_count FROM pxls_name
-        INNER JOIN(pxls_user_stat) ON pxls_user_stat.pxls_name_id = pxls_name.pxls_name_id
-        WHERE pxls_user_id = ?
-        ORDER BY record_id DESC
-        LIMIT 2"""
-
+        SELECT name, alltime_count, previous_alltime_count FROM latest_leaderboard
+        WHERE pxls_user_id = ? AND alltime_count IS NOT NULL
+        ORDER BY alltime_count DESC
+        LIMIT 1"""
         res = await self.db.sql_select(sql, pxls_user_id)
         if len(res) == 0:
-            raise ValueError(f"No use found with ID: '{pxls_user_id}'")
-        else:
-            return (res[0][0], res[0][1], res[1][1])
+            return None
+        name, alltime_count, previous_alltime_count = res[0]
+        if previous_alltime_count is None:
+            previous_alltime_count = alltime_count
+        return (name, alltime_count, previous_alltime_count)
+
+    async def update_latest_leaderboard(self):
+        """Rebuild the `latest_leaderboard` table with the stats of the last record.
+
+        The previous alltime count of a user is their count before the last
+        record if it changed at the last record, else it's their current count."""
+        last_record = await self.db.sql_select(
+            "SELECT record_id FROM record ORDER BY datetime DESC LIMIT 1"
+        )
+        sql = """
+        INSERT INTO latest_leaderboard
+        SELECT
+            p.pxls_name_id,
+            n.pxls_user_id,
+            n.name,
+            r.record_id,
+            r.datetime,
+            ROW_NUMBER() OVER(ORDER BY (p.alltime_count) DESC) AS alltime_rank,
+            p.alltime_count,
+            ROW_NUMBER() OVER(ORDER BY (p.canvas_count) DESC) AS canvas_rank,
+            p.canvas_count,
+            CASE WHEN EXISTS(
+                SELECT 1 FROM pxls_user_stat
+                WHERE pxls_name_id = p.pxls_name_id AND record_id = r.record_id
+            ) THEN (
+                SELECT s.alltime_count FROM pxls_user_stat s
+                WHERE s.pxls_name_id = p.pxls_name_id
+                    AND s.record_id < r.record_id
+                    AND (s.alltime_count IS NOT NULL OR s.canvas_count IS NOT NULL)
+                ORDER BY s.record_id DESC
+                LIMIT 1
+            ) ELSE p.alltime_count END
+        FROM {} p
+        JOIN record r ON r.record_id = ?
+        JOIN pxls_name n ON n.pxls_name_id = p.pxls_name_id"""
+
+        async with self.db.writer() as conn, conn.cursor() as cur:
+            await cur.execute("BEGIN TRANSACTION;")
+            try:
+                await cur.execute("DELETE FROM latest_leaderboard")
+                if last_record:
+                    record_id = last_record[0]["record_id"]
+                    await cur.execute(
+                        sql.format(user_stats_at_record_sql(record_id)), record_id
+                    )
+            except Exception:
+                await cur.execute("ROLLBACK;")
+                raise
+            await cur.execute("COMMIT;")
 
     async def get_last_leaderboard(self):
         sql = """
         SELECT
             name,
-            ROW_NUMBER() OVER(ORDER BY (alltime_count) DESC) AS alltime_rank,
+            alltime_rank,
             alltime_count,
-            ROW_NUMBER() OVER(ORDER BY (canvas_count) DESC) AS canvas_rank,
+            canvas_rank,
             canvas_count,
             datetime
-        FROM pxls_user_stat p
-        JOIN record r ON r.record_id = p.record_id
-        JOIN pxls_name n ON n.pxls_name_id = p.pxls_name_id
-        WHERE r.datetime = (SELECT MAX(datetime) FROM record)"""
+        FROM latest_leaderboard
+        ORDER BY alltime_rank"""
+        return await self.db.sql_select(sql)
 
-        rows = await self.db.sql_select(sql)
-        return rows
+    async def get_last_user_stats(self, name):
+        """Get the row of a user in the last leaderboard or None if the user
+        isn't in it (same columns as `get_last_leaderboard()`)."""
+        sql = """
+        SELECT
+            name,
+            alltime_rank,
+            alltime_count,
+            canvas_rank,
+            canvas_count,
+            datetime
+        FROM latest_leaderboard
+        WHERE name = ?"""
+        rows = await self.db.sql_select(sql, name)
+        return rows[0] if rows else None
 
     async def get_stats_history(self, user_list, date1, date2, canvas_opt):
         """get the stats between 2 dates"""
@@ -203,28 +503,24 @@ class DbStatsManager:
         # Find all the records between the 2 dates
         # if it's more than 1000, shorten the record list to only have 1000 values
         records = await self.db.sql_select(
-            "SELECT * FROM record WHERE datetime BETWEEN ? AND ? AND canvas_code IS {} ORDER BY datetime".format(f"'{canvas_to_select}'" if canvas_to_select else "NOT NULL"),
+            "SELECT * FROM record WHERE datetime BETWEEN ? AND ? AND canvas_code IS {} ORDER BY datetime".format(
+                f"'{canvas_to_select}'" if canvas_to_select else "NOT NULL"
+            ),
             (record1["datetime"], record2["datetime"]),
         )
         records = [r["record_id"] for r in records]
+        rows = None
         if len(records) > 1000:
-            records = shorten_list(records, 1000)
-        sql = """
-            SELECT name, {0} as pixels, datetime
-            FROM pxls_user_stat
-            JOIN record ON record.record_id = pxls_user_stat.record_id
-            JOIN pxls_name ON pxls_name.pxls_name_id = pxls_user_stat.pxls_name_id
-            WHERE name IN ({1})
-            AND pxls_user_stat.record_id IN ({2})
-            {3}
-            ORDER BY {0} """.format(
-            "canvas_count" if canvas_opt else "alltime_count",
-            ", ".join("?" for u in user_list),
-            ", ".join("?" for r in records),
-            "AND alltime_count is not NULL" if not canvas_opt else "",
-        )
+            # use the rollups if they have enough data points for the time frame
+            rows = await self.rollups.get_user_stats_history(
+                user_list, record1, record2, 1000, canvas_to_select
+            )
+            # imported here, the utils package imports the database managers
+            from utils.utils import shorten_list
 
-        rows = await self.db.sql_select(sql, tuple(user_list) + tuple(records))
+            records = shorten_list(records, 1000)
+        if rows is None:
+            rows = await self._get_stats_history(user_list, records, canvas_opt)
 
         # group by user
         users_dict = {}
@@ -242,6 +538,27 @@ class DbStatsManager:
         users_list = list(users_dict.items())
         return (past_time, recent_time, users_list)
 
+    async def _get_stats_history(self, user_list, records, canvas_opt):
+        """get the stats of the users at each record of the list"""
+        sql = """
+            SELECT name, {0} as pixels, datetime
+            FROM record
+            JOIN pxls_name ON name IN ({1})
+            JOIN pxls_user_stat ON pxls_user_stat.pxls_name_id = pxls_name.pxls_name_id
+                AND pxls_user_stat.record_id = {4}
+            WHERE record.record_id IN ({2})
+            AND (alltime_count IS NOT NULL OR canvas_count IS NOT NULL)
+            {3}
+            ORDER BY {0} """.format(
+            "canvas_count" if canvas_opt else "alltime_count",
+            ", ".join("?" for u in user_list),
+            ", ".join("?" for r in records),
+            "AND alltime_count is not NULL" if not canvas_opt else "",
+            user_stat_at_sql("pxls_name.pxls_name_id", "record.record_id"),
+        )
+
+        return await self.db.sql_select(sql, tuple(user_list) + tuple(records))
+
     async def get_grouped_stats_history(
         self, user_list, dt1, dt2, groupby_opt, canvas_opt
     ):
@@ -273,7 +590,9 @@ class DbStatsManager:
             SELECT * FROM record
             WHERE datetime BETWEEN ? AND ? AND canvas_code IS {}
             GROUP BY strftime(?, datetime)
-            """.format(f"'{canvas_to_select}'" if canvas_to_select else "NOT NULL"),
+            """.format(
+                f"'{canvas_to_select}'" if canvas_to_select else "NOT NULL"
+            ),
             (record1["datetime"], record2["datetime"], groupby),
         )
         nb_data_max = len(records) * len(user_list)
@@ -281,29 +600,15 @@ class DbStatsManager:
             raise ValueError(
                 f"That's too many bars too show (estimated **{nb_data_max}**). <:bruhkitty:943594789532737586>"
             )
-        sql = """
-            SELECT
-                name,
-                {0} as pixels,
-                {0}-(LAG({0}) OVER (ORDER BY name, datetime)) as placed,
-                MIN(record.datetime) as first_datetime,
-                MAX(record.datetime) as last_datetime
-            FROM pxls_user_stat
-            JOIN record ON record.record_id = pxls_user_stat.record_id
-            JOIN pxls_name ON pxls_name.pxls_name_id = pxls_user_stat.pxls_name_id
-            WHERE name IN ({1})
-                AND pxls_user_stat.record_id BETWEEN ? AND ?
-                AND canvas_code IS {2}
-            GROUP BY strftime(?,datetime), name""".format(
-            "canvas_count" if canvas_opt else "alltime_count",
-            ", ".join("?" for u in user_list),
-            f"'{canvas_to_select}'" if canvas_to_select else "NOT NULL",
-        )
 
-        rows = await self.db.sql_select(
-            sql,
-            tuple(user_list) + (record1["record_id"], record2["record_id"], groupby),
+        # read the pre-grouped stats from the rollups if they cover the records
+        rows = await self.rollups.get_grouped_user_stats(
+            user_list, record1, record2, groupby_opt, canvas_to_select
         )
+        if rows is None:
+            rows = await self._get_grouped_stats_history(
+                user_list, record1, record2, groupby, canvas_to_select
+            )
 
         # group by user
         users_dict = {}
@@ -336,6 +641,37 @@ class DbStatsManager:
             )
             return past_time, now_time, res_list
 
+    async def _get_grouped_stats_history(
+        self, user_list, record1, record2, groupby, canvas_to_select
+    ):
+        """get the stats of the users between 2 records grouped by the strftime
+        format `groupby`"""
+        sql = """
+            SELECT
+                name,
+                {0} as pixels,
+                {0}-(LAG({0}) OVER (ORDER BY name, datetime)) as placed,
+                MIN(record.datetime) as first_datetime,
+                MAX(record.datetime) as last_datetime
+            FROM record
+            JOIN pxls_name ON name IN ({1})
+            JOIN pxls_user_stat ON pxls_user_stat.pxls_name_id = pxls_name.pxls_name_id
+                AND pxls_user_stat.record_id = {3}
+            WHERE record.record_id BETWEEN ? AND ?
+                AND canvas_code IS {2}
+                AND (alltime_count IS NOT NULL OR canvas_count IS NOT NULL)
+            GROUP BY strftime(?,datetime), name""".format(
+            "canvas_count" if canvas_to_select else "alltime_count",
+            ", ".join("?" for u in user_list),
+            f"'{canvas_to_select}'" if canvas_to_select else "NOT NULL",
+            user_stat_at_sql("pxls_name.pxls_name_id", "record.record_id"),
+        )
+
+        return await self.db.sql_select(
+            sql,
+            tuple(user_list) + (record1["record_id"], record2["record_id"], groupby),
+        )
+
     async def get_leaderboard_between(self, dt1, dt2, canvas, orderby_opt):
         """ Get the leaderboard between 2 dates
         ### Parameters
@@ -371,6 +707,34 @@ class DbStatsManager:
         if orderby_opt == "speed" and record1["canvas_code"] == current_canvas_code:
             canvas = True
 
+        if (
+            orderby_opt != "speed"
+            and record1["record_id"] == last_record["record_id"]
+            and record2["record_id"] == last_record["record_id"]
+        ):
+            # the current leaderboard is already saved with the ranks
+            rank = "canvas_rank" if orderby_opt == "canvas" else "alltime_rank"
+            sql = """
+            SELECT
+                {0} AS rank,
+                name,
+                {1}_count,
+                {1}_count - {1}_count AS placed
+            FROM latest_leaderboard
+            WHERE record_id = ?
+            ORDER BY {0}""".format(
+                rank, "canvas" if canvas else "alltime"
+            )
+            rows = await self.db.sql_select(sql, last_record["record_id"])
+            if rows:
+                return (
+                    canvas,
+                    last_record["datetime"],
+                    record1["datetime"],
+                    record2["datetime"],
+                    rows,
+                )
+
         order_dict = {
             "speed": "b.{0}_count - a.{0}_count".format(
                 "canvas" if canvas else "alltime"
@@ -389,14 +753,15 @@ class DbStatsManager:
             pxls_name.name,
             last.{1}_count,
             b.{1}_count - a.{1}_count as placed
-        FROM pxls_user_stat a, pxls_user_stat b, pxls_user_stat last
+        FROM {2} a, {3} b, {4} last
         INNER JOIN(pxls_name) ON pxls_name.pxls_name_id = a.pxls_name_id
         WHERE a.pxls_name_id = b.pxls_name_id AND a.pxls_name_id = last.pxls_name_id
-            AND last.record_id = ?
-            AND a.record_id =  ?
-            AND b.record_id = ?
         ORDER BY {0} DESC""".format(
-            orderby, "canvas" if canvas else "alltime"
+            orderby,
+            "canvas" if canvas else "alltime",
+            user_stats_at_record_sql(record1["record_id"]),
+            user_stats_at_record_sql(record2["record_id"]),
+            user_stats_at_record_sql(last_record["record_id"]),
         )
 
         return (
@@ -404,10 +769,7 @@ class DbStatsManager:
             last_record["datetime"],
             record1["datetime"],
             record2["datetime"],
-            await self.db.sql_select(
-                sql,
-                (last_record["record_id"], record1["record_id"], record2["record_id"]),
-            ),
+            await self.db.sql_select(sql),
         )
 
     async def get_pixels_at(
@@ -424,12 +786,15 @@ class DbStatsManager:
         record = await self.find_record(datetime, canvas_to_select)
         record_id = record["record_id"]
         sql = """
-            SELECT canvas_count, alltime_count, record_id
+            SELECT canvas_count, alltime_count, ? AS record_id
             FROM pxls_user_stat
             JOIN pxls_name ON pxls_name.pxls_name_id = pxls_user_stat.pxls_name_id
             WHERE name = ?
-            AND record_id = ?"""
-        rows = await self.db.sql_select(sql, (user_name, record_id))
+            AND record_id = {}
+            AND (alltime_count IS NOT NULL OR canvas_count IS NOT NULL)""".format(
+            user_stat_at_sql("pxls_name.pxls_name_id", "?")
+        )
+        rows = await self.db.sql_select(sql, (record_id, user_name, record_id, record_id))
 
         if len(rows) == 0:
             return (None, None)
@@ -439,50 +804,45 @@ class DbStatsManager:
     async def find_record(self, dt, canvas_code=None):
         """find the record with  the closest date to the given date in the database
         :param dt: the datetime to find
-        :param canvas_code: the canvas to find the record in, if None, will search among all the canvases"""
+        :param canvas_code: the canvas to find the record in, if None, will search among all the canvases
+        :return: the record row, with all its values NULL if there is no record"""
         if canvas_code is None:
-            canvas_code = "NOT NULL"  # to get all the canvas codes
+            # to get all the canvas codes
+            record = await self.db.sql_select_nearest(
+                "record", dt, "canvas_code IS NOT NULL"
+            )
         else:
-            canvas_code = f"'{str(canvas_code)}'"
-
-        sql = """
-            SELECT
-                record_id,
-                datetime,
-                canvas_code,
-                min(abs(JulianDay(datetime) - JulianDay(?)))*24*3600 as diff_with_time
-            FROM record
-            WHERE canvas_code IS {}
-            """.format(
-            canvas_code
-        )
-        res = await self.db.sql_select(sql, (dt))
-        return res[0]
+            record = await self.db.sql_select_nearest(
+                "record", dt, "canvas_code = ?", (str(canvas_code),)
+            )
+        if record is None:
+            rows = await self.db.sql_select(
+                """
+                SELECT NULL AS record_id, NULL AS datetime, NULL AS canvas_code,
+                    NULL AS diff_with_time"""
+            )
+            record = rows[0]
+        return record
 
         # general stats functions #
 
-    async def get_general_stat(self, name, dt1, dt2, canvas_code=None):
-        """get all the values of a general stat after a datetime
-        (this is used to plot the stat)"""
+    async def _general_stat_query(self, name, dt1, dt2, canvas_code=None):
+        """Get the query and its parameters to select the values of a general stat
+        between the closest datetimes to dt1 and dt2"""
 
         if canvas_code is None:
-            sql = """
-                SELECT datetime, min(abs(JulianDay(datetime) - JulianDay(?)))*24*3600 as diff_with_time
-                FROM pxls_general_stat"""
+            where, param = "1", ()
         else:
-            sql = """
-                SELECT datetime, min(abs(JulianDay(datetime) - JulianDay(?)))*24*3600 as diff_with_time
-                FROM pxls_general_stat
-                WHERE canvas_code = ?"""
+            where, param = "canvas_code = ?", (canvas_code,)
 
-        closest_data1 = await self.db.sql_select(
-            sql, (dt1,) + ((canvas_code,) if canvas_code else ())
+        closest_data1 = await self.db.sql_select_nearest(
+            "pxls_general_stat", dt1, where, param, "datetime"
         )
-        closest_dt1 = closest_data1[0][0]
-        closest_data2 = await self.db.sql_select(
-            sql, (dt2,) + ((canvas_code,) if canvas_code else ())
+        closest_dt1 = closest_data1["datetime"] if closest_data1 else None
+        closest_data2 = await self.db.sql_select_nearest(
+            "pxls_general_stat", dt2, where, param, "datetime"
         )
-        closest_dt2 = closest_data2[0][0]
+        closest_dt2 = closest_data2["datetime"] if closest_data2 else None
 
         sql = """
             SELECT value, datetime, canvas_code
@@ -492,7 +852,21 @@ class DbStatsManager:
             AND datetime <= ?
             ORDER BY datetime"""
 
-        return await self.db.sql_select(sql, (name, closest_dt1, closest_dt2))
+        return sql, (name, closest_dt1, closest_dt2)
+
+    async def get_general_stat(self, name, dt1, dt2, canvas_code=None):
+        """get all the values of a general stat after a datetime
+        (this is used to plot the stat)"""
+        sql, param = await self._general_stat_query(name, dt1, dt2, canvas_code)
+        return await self.db.sql_select(sql, param)
+
+    @asynccontextmanager
+    async def iter_general_stat(self, name, dt1, dt2, canvas_code=None, **kwargs):
+        """Same as `get_general_stat()` but get the rows in batches
+        (see `DbConnection.sql_iter()` for the usage and keyword arguments)"""
+        sql, param = await self._general_stat_query(name, dt1, dt2, canvas_code)
+        async with self.db.sql_iter(sql, param, **kwargs) as batches:
+            yield batches
 
     async def add_general_stat(self, name, value, canvas, date):
         sql = """ INSERT INTO pxls_general_stat(stat_name, value ,canvas_code, datetime)
@@ -535,20 +909,12 @@ class DbStatsManager:
         sql = """
         INSERT INTO color_stat (record_id, color_id, amount, amount_placed)
         VALUES (?,?,?,?)"""
-        # create a db connection and insert all the values in the db
-        await self.db.create_connection()
-        async with self.db.conn.cursor() as cur:
-            await cur.execute("BEGIN TRANSACTION;")
-            await cur.executemany(sql, values_list)
-            await cur.execute("COMMIT;")
-        await self.db.conn.commit()
-        await self.db.close_connection()
+        # insert all the values in the db in a single transaction
+        await self.db.sql_update_many(sql, values_list)
 
-    async def get_canvas_color_stats(self, canvas_code, dt1=None, dt2=None):
-        """Get all the color stats as a list of sqlite3 rows
-
-        Get the data between dt1 and dt2 if they're not null or for the whole
-        canvas"""
+    async def _canvas_color_stats_query(self, canvas_code, dt1=None, dt2=None):
+        """Get the query and its parameters to select the color stats between dt1
+        and dt2 or for the whole canvas"""
 
         if dt1 and dt2:
             record1 = await self.find_record(dt1, canvas_code)
@@ -567,9 +933,23 @@ class DbStatsManager:
             AND datetime BETWEEN ? AND ?
             ORDER BY record.datetime
         """
+        return sql, (canvas_code, datetime1, datetime2)
+
+    async def get_canvas_color_stats(self, canvas_code, dt1=None, dt2=None):
+        """Get all the color stats as a list of sqlite3 rows
+
+        Get the data between dt1 and dt2 if they're not null or for the whole
+        canvas"""
+        sql, param = await self._canvas_color_stats_query(canvas_code, dt1, dt2)
+        return await self.db.sql_select(sql, param)
 
-        rows = await self.db.sql_select(sql, (canvas_code, datetime1, datetime2))
-        return rows
+    @asynccontextmanager
+    async def iter_canvas_color_stats(self, canvas_code, dt1=None, dt2=None, **kwargs):
+        """Same as `get_canvas_color_stats()` but get the rows in batches
+        (see `DbConnection.sql_iter()` for the usage and keyword arguments)"""
+        sql, param = await self._canvas_color_stats_query(canvas_code, dt1, dt2)
+        async with self.db.sql_iter(sql, param, **kwargs) as batches:
+            yield batches
 
     async def get_palette(self, canvas_code):
         sql = """ SELECT color_id,color_name,color_hex
@@ -589,16 +969,17 @@ class DbStatsManager:
                     canvas_code,
                     record.record_id,
                     {0}-(LAG({0}) OVER (ORDER BY datetime)) as placed
-                FROM pxls_user_stat
-                JOIN record on record.record_id = pxls_user_stat.record_id
-                JOIN pxls_name on pxls_name.pxls_name_id = pxls_user_stat.pxls_name_id
-                WHERE pxls_user_id = ?
-                AND datetime > ?
+                FROM record
+                JOIN pxls_name on pxls_user_id = ?
+                JOIN pxls_user_stat on pxls_user_stat.pxls_name_id = pxls_name.pxls_name_id
+                    AND pxls_user_stat.record_id = {1}
+                WHERE datetime > ?
                 ORDER BY datetime desc
             ) p
             WHERE p.placed = 0
             LIMIT 1""".format(
-            "canvas_count" if canvas else "alltime_count"
+            "canvas_count" if canvas else "alltime_count",
+            user_stat_at_sql("pxls_name.pxls_name_id", "record.record_id"),
         )
 
         # only search in the last 7 days to make the query faster
@@ -625,6 +1006,7 @@ class DbStatsManager:
                 FROM pxls_user_stat
                 JOIN record on record.record_id = pxls_user_stat.record_id
                 WHERE pxls_name_id = ?
+                    AND (alltime_count IS NOT NULL OR canvas_count IS NOT NULL)
                 ORDER BY record_id DESC
                 LIMIT 1
             """
@@ -675,60 +1057,67 @@ class DbStatsManager:
             if len(res) == 0:
                 return None
 
-        # get the record just after the one we found
+        # get the user's next row after the one we found
         # go get the last time where the count was the same as the given one
+        # (the rows are only saved when the count changes)
         record_id = res[0]["record_id"]
         last_pixel_record = await self.db.sql_select(
-            "SELECT * FROM record WHERE record_id = ?", record_id + 1
+            """
+            SELECT * FROM record WHERE record_id = (
+                SELECT MIN(record_id) FROM pxls_user_stat
+                WHERE pxls_name_id = ? AND record_id > ?
+            )""",
+            (name_id, record_id),
         )
         return last_pixel_record[0]
 
     async def get_stats_per_canvas(self, user_list):
-        sql_last_canvas_records = """
-            SELECT
-                record_id,
-                min(datetime) as canvas_start,
-                max(datetime) as canvas_end,
-                canvas_code
-            FROM record
-            GROUP BY canvas_code """
-        last_canvas_records = await self.db.sql_select(sql_last_canvas_records)
+        """Get the stats of the users at the end of each canvas.
 
-        res = []
+        Return (first canvas start, last canvas end, [[user, user_data], ...])
+        with `user_data` a list of dictionaries with the keys 'name', 'pixels',
+        'placed' and 'canvas_code' (one per canvas)."""
+        canvases = await self.db.sql_select(
+            "SELECT * FROM canvas_record ORDER BY canvas_code"
+        )
         # remove duplicates
         user_list = list(dict.fromkeys(user_list))
+        sql = """
+            SELECT
+                name,
+                c.canvas_code,
+                alltime_count as pixels,
+                canvas_count as placed
+            FROM canvas_record c
+                JOIN pxls_name ON name IN ({})
+                JOIN pxls_user_stat s ON s.pxls_name_id = pxls_name.pxls_name_id
+                    AND s.record_id = {}
+        """.format(
+            ", ".join("?" * len(user_list)),
+            user_stat_at_sql("pxls_name.pxls_name_id", "c.last_record_id"),
+        )
+        rows = await self.db.sql_select(sql, tuple(user_list))
+        counts = {(row["name"], row["canvas_code"]): row for row in rows}
+
+        res = []
         for user in user_list:
             user_data = []
-            for canvas in last_canvas_records:
-                record_id = canvas["record_id"]
+            for canvas in canvases:
                 canvas_code = canvas["canvas_code"]
-                sql = """
-                    SELECT name, alltime_count as pixels, canvas_count as placed, canvas_code
-                    FROM pxls_user_stat
-                        JOIN pxls_name on pxls_user_stat.pxls_name_id = pxls_name.pxls_name_id
-                        JOIN record r on r.record_id = pxls_user_stat.record_id
-                    WHERE r.record_id = ?
-                        AND name = ? """
-                rows = await self.db.sql_select(sql, (record_id, user))
-                if rows:
-                    user_data.append(rows[0])
-                else:
-                    user_data.append(
-                        {
-                            "name": user,
-                            "pixels": None,
-                            "placed": None,
-                            "canvas_code": canvas_code,
-                        }
-                    )
+                row = counts.get((user, canvas_code))
+                # the users who left the stats have both counts NULL
+                user_data.append(
+                    {
+                        "name": user,
+                        "pixels": row["pixels"] if row else None,
+                        "placed": row["placed"] if row else None,
+                        "canvas_code": canvas_code,
+                    }
+                )
             res.append([user, user_data])
 
-        past_time = datetime.strptime(
-            last_canvas_records[0]["canvas_start"], "%Y-%m-%d %H:%M:%S"
-        )
-        now_time = datetime.strptime(
-            last_canvas_records[-1]["canvas_end"], "%Y-%m-%d %H:%M:%S"
-        )
+        past_time = min(c["first_datetime"] for c in canvases)
+        now_time = max(c["last_datetime"] for c in canvases)
         return (past_time, now_time, res)
 
     async def get_all_pxls_names(self):
@@ -773,12 +1162,6 @@ class DbStatsManager:
 
     async def get_snapshot_at(self, dt, canvas_code):
         """Get the snapshot closest to the given datetime (dt)"""
-        sql = """
-            SELECT
-                *,
-                min(abs(JulianDay(datetime) - JulianDay(?)))*24*3600 as diff_with_time
-            FROM snapshot
-            WHERE canvas_code = ?
-            """
-        res = await self.db.sql_select(sql, (dt, canvas_code))
-        return res[0] if res else None
+        return await self.db.sql_select_nearest(
+            "snapshot", dt, "canvas_code = ?", (canvas_code,)
+        )
@@ -1,3 +1,4 @@
+import logging
 from datetime import datetime, timezone
 
 # This import is only necessary for type hints
@@ -8,9 +9,7 @@ from database.db_connection import DbConnection
 if TYPE_CHECKING:
     from utils.pxls.template_manager import Template, Combo
 
-from utils.log import get_logger
-
-logger = get_logger(__name__)
+logger = logging.getLogger(__name__)
 
 
 class DbTemplateManager:
@@ -120,43 +119,86 @@ class DbTemplateManager:
 
     async def get_template_progress(self, template: "Template", datetime):
         """Get the progress of a template at a given datetime"""
+        template_id = await self.get_template_id(template)
+        if not template_id:
+            return None
+        # uses the (template_id, datetime) primary key to find the closest stat
+        return await self.db.sql_select_nearest(
+            "template_stat", datetime, "template_id = ?", (template_id,)
+        )
+
+    async def get_templates_progress(self, templates: list, datetimes: list) -> list:
+        """Get the progress of several templates at several datetimes at once.
+
+        Return a list with, for each template, a list of the stats (datetime and
+        progress) closest to each datetime in `datetimes`. A stat is None if the
+        template doesn't have any stats."""
+        res = [[None] * len(datetimes) for _ in templates]
+        template_ids = []
+        for t in templates:
+            # the combo doesn't have an ID set
+            template_id = getattr(t, "id", None) or await self.get_template_id(t)
+            template_ids.append(template_id)
+        ids_to_select = list(set([id for id in template_ids if id]))
+        if not ids_to_select or not datetimes:
+            return res
+
+        # for each (template, datetime) pair, find the 2 stats around the datetime
+        # with index seeks and keep the closest one
         sql = """
-            SELECT *, min(abs(JulianDay(datetime) - JulianDay(?)))*24*3600 as diff_with_time
-            FROM template_stat
-            WHERE template_id = (
-                SELECT id
-                FROM template
-                WHERE name = ? AND canvas_code = ? and owner_id = ? and hidden = ?
+            WITH target(idx, dt) AS (VALUES {0}),
+            candidate AS (
+                SELECT
+                    template.id AS template_id,
+                    target.idx,
+                    target.dt,
+                    (
+                        SELECT rowid FROM template_stat
+                        WHERE template_id = template.id AND datetime <= target.dt
+                        ORDER BY datetime DESC LIMIT 1
+                    ) AS floor_id,
+                    (
+                        SELECT rowid FROM template_stat
+                        WHERE template_id = template.id AND datetime >= target.dt
+                        ORDER BY datetime LIMIT 1
+                    ) AS ceil_id
+                FROM template, target
+                WHERE template.id IN ({1})
             )
-        """
-        res = await self.db.sql_select(
-            sql,
-            (
-                datetime,
-                template.name,
-                template.canvas_code,
-                template.owner_id,
-                template.hidden,
-            ),
+            SELECT
+                candidate.template_id,
+                candidate.idx,
+                template_stat.datetime,
+                template_stat.progress,
+                abs(JulianDay(template_stat.datetime) - JulianDay(candidate.dt))*24*3600
+                    AS diff_with_time
+            FROM candidate
+            JOIN template_stat ON template_stat.rowid IN (candidate.floor_id, candidate.ceil_id)
+            ORDER BY candidate.template_id, candidate.idx, diff_with_time, template_stat.datetime
+        """.format(
+            ", ".join("(?, ?)" for _ in datetimes),
+            ", ".join("?" for _ in ids_to_select),
         )
-        if not res or all([r is None for r in list(res[0])]):
-            return None
-        else:
-            return res[0]
+        param = ()
+        for idx, dt in enumerate(datetimes):
+            param += (idx, dt)
+        rows = await self.db.sql_select(sql, param + tuple(ids_to_select))
+
+        closest_stats = {}
+        for row in rows:
+            # the rows are sorted so the first one for each pair is the closest
+            closest_stats.setdefault((row["template_id"], row["idx"]), row)
+        for i, template_id in enumerate(template_ids):
+            for idx in range(len(datetimes)):
+                res[i][idx] = closest_stats.get((template_id, idx))
+        return res
 
     async def get_template_oldest_progress(self, template: "Template"):
         """Get the progress of a template at a given datetime"""
         template_id = await self.get_template_id(template)
-        sql = """
-            SELECT *, min(abs(JulianDay(datetime) - JulianDay(?)))*24*3600 as diff_with_time
-            FROM template_stat
-            WHERE template_id = ?
-        """
-        res = await self.db.sql_select(sql, (datetime.min, template_id))
-        if not res:
-            return None
-        else:
-            return res[0]
+        return await self.db.sql_select_nearest(
+            "template_stat", datetime.min, "template_id = ?", (template_id,)
+        )
 
     async def get_last_update_time(self) -> datetime:
         """Get the last datetime inserted in the template_stat table"""
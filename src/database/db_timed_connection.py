@@ -0,0 +1,82 @@
+import time
+from contextlib import asynccontextmanager
+
+
+def _get_param(param: tuple):
+    # same parameter handling as asqlite
+    if len(param) == 1 and isinstance(param[0], (dict, tuple)):
+        return param[0]
+    return param
+
+
+class TimedCursor:
+    """A wrapper of an asqlite cursor passing the duration of each statement
+    executed to `on_executed(query, param, duration)`."""
+
+    def __init__(self, cursor, on_executed) -> None:
+        self._cursor = cursor
+        self._on_executed = on_executed
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self._cursor.close()
+
+    async def execute(self, query, *param):
+        start = time.perf_counter()
+        await self._cursor.execute(query, *param)
+        self._on_executed(query, _get_param(param), time.perf_counter() - start)
+        return self
+
+    async def executemany(self, query, params):
+        params = list(params)
+        start = time.perf_counter()
+        await self._cursor.executemany(query, params)
+        # the plan is the same for all the parameters
+        param = params[0] if params else None
+        self._on_executed(query, param, time.perf_counter() - start)
+        return self
+
+    async def executescript(self, script):
+        start = time.perf_counter()
+        await self._cursor.executescript(script)
+        self._on_executed(script, None, time.perf_counter() - start)
+        return self
+
+
+class TimedConnection:
+    """A wrapper of an asqlite connection where the statements executed with
+    `execute()`, `executemany()` or a cursor are timed (see `TimedCursor`).
+
+    Unlike asqlite, `execute()` and `executemany()` can only be awaited, not
+    used as context managers."""
+
+    def __init__(self, conn, on_executed) -> None:
+        self._conn = conn
+        self._on_executed = on_executed
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    @asynccontextmanager
+    async def cursor(self):
+        async with self._conn.cursor() as cursor:
+            yield TimedCursor(cursor, self._on_executed)
+
+    async def execute(self, query, *param):
+        start = time.perf_counter()
+        cursor = await self._conn.execute(query, *param)
+        self._on_executed(query, _get_param(param), time.perf_counter() - start)
+        return TimedCursor(cursor, self._on_executed)
+
+    async def executemany(self, query, params):
+        params = list(params)
+        start = time.perf_counter()
+        cursor = await self._conn.executemany(query, params)
+        param = params[0] if params else None
+        self._on_executed(query, param, time.perf_counter() - start)
+        return TimedCursor(cursor, self._on_executed)
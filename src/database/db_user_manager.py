@@ -1,13 +1,27 @@
-import sqlite3
+from collections import OrderedDict
 
 from database.db_connection import DbConnection
+from database.db_stats_manager import user_stat_at_sql
+from database.pxls_name_index import PxlsNameIndex
+
+# maximum number of discord_user rows kept in memory
+USERS_CACHE_SIZE = 10000
 
 
 class DbUserManager:
     """A class to manage a discord and pxls user in the database"""
 
-    def __init__(self, db_conn: DbConnection) -> None:
+    def __init__(self, db_conn: DbConnection, names: PxlsNameIndex = None) -> None:
         self.db = db_conn
+        self.names = names or PxlsNameIndex(db_conn)
+
+        # LRU cache of the discord_user rows (key: discord ID)
+        self.users_cache = OrderedDict()
+        self.users_cache_hits = 0
+        self.users_cache_misses = 0
+        # incremented on each invalidation so a row selected before an update
+        # isn't put in the cache after it
+        self._users_cache_version = 0
 
     async def create_tables(self):
 
@@ -30,10 +44,10 @@ class DbUserManager:
                 pxls_user_id INTEGER,
                 color TEXT,
                 is_blacklisted BOOLEAN DEFAULT 0,
+                timezone TEXT,
+                font TEXT,
                 FOREIGN KEY(pxls_user_id) REFERENCES pxls_user(pxls_user_id)
         );"""
-        add_discord_user_timezone = "ALTER TABLE discord_user ADD COLUMN timezone TEXT"
-        add_discord_user_font = "ALTER TABLE discord_user ADD COLUMN font TEXT"
 
         create_server_pxls_users_table = """
             CREATE TABLE IF NOT EXISTS server_pxls_user(
@@ -56,42 +70,28 @@ class DbUserManager:
         await self.db.sql_update(create_pxls_user_table)
         await self.db.sql_update(create_pxls_name_table)
         await self.db.sql_update(create_discord_user)
-        try:
-            await self.db.sql_update(add_discord_user_timezone)
-        except sqlite3.OperationalError:
-            pass
-        try:
-            await self.db.sql_update(add_discord_user_font)
-        except sqlite3.OperationalError:
-            pass
         await self.db.sql_update(create_server_pxls_users_table)
         await self.db.sql_update(create_user_keys_table)
 
     async def create_pxls_user(self, name):
         """create a 'pxls_user' and its associated 'pxls_name'"""
         # check if there is already a pxls_name with the given name
-        sql = """SELECT * FROM pxls_name WHERE name = ? """
-        db_pxls_name = await self.db.sql_select(sql, name)
-        if len(db_pxls_name) != 0:
+        if await self.names.get(name) is not None:
             raise ValueError("There is already a pxls_name with the name {}".format(name))
 
-        # create the pxls_user
-        sql = """INSERT INTO pxls_user (pxls_user_id) VALUES (NULL)"""
-        pxls_user_id = await self.db.sql_insert(sql)
-
-        # create the pxls_name
-        sql = """INSERT INTO pxls_name(pxls_user_id,name)
-                VALUES(?,?)"""
-        await self.db.sql_insert(sql, (pxls_user_id, name))
+        # create the pxls_user and pxls_name
+        async with self.db.writer() as conn, conn.cursor() as cur:
+            await cur.execute("BEGIN TRANSACTION;")
+            try:
+                created = await self.names.create_users([name], cur)
+            except Exception:
+                await cur.execute("ROLLBACK;")
+                raise
+            await cur.execute("COMMIT;")
+        self.names.add_all(created)
 
     async def get_pxls_user_id(self, name):
-        sql = """ SELECT pxls_user_id FROM pxls_name WHERE name = ?"""
-
-        res = await self.db.sql_select(sql, name)
-        if len(res) == 0:
-            return None
-        else:
-            return res[0][0]
+        return await self.names.get_user_id(name)
 
     async def get_pxls_user_name(self, pxls_id):
         sql = """ SELECT name FROM pxls_name WHERE pxls_user_id = ?"""
@@ -103,38 +103,66 @@ class DbUserManager:
 
     async def get_discord_user(self, discord_id):
         """Get the informations of a discord user and create it if it doesn't exist in the DB"""
+        key = str(discord_id)
+        discord_user = self.users_cache.get(key)
+        if discord_user is not None:
+            self.users_cache.move_to_end(key)
+            self.users_cache_hits += 1
+            return discord_user
+
+        self.users_cache_misses += 1
+        version = self._users_cache_version
         await self.db.sql_insert(
             "INSERT OR IGNORE INTO discord_user(discord_id) VALUES(?)", discord_id
         )
         discord_user = await self.db.sql_select(
             "SELECT * FROM discord_user WHERE discord_id = ?", discord_id
         )
-        return discord_user[0]
+        discord_user = discord_user[0]
+        if version == self._users_cache_version:
+            self.users_cache[key] = discord_user
+            if len(self.users_cache) > USERS_CACHE_SIZE:
+                self.users_cache.popitem(last=False)
+        return discord_user
+
+    def invalidate_discord_user(self, discord_id=None):
+        """Remove a discord user from the cache (or all of them if no ID is given),
+        must be called after updating the discord_user table"""
+        self._users_cache_version += 1
+        if discord_id is None:
+            self.users_cache.clear()
+        else:
+            self.users_cache.pop(str(discord_id), None)
 
     async def set_user_blacklist(self, discord_id, blacklist_status: bool):
         """Update the 'is_blacklisted' attribute of a discord_user"""
         sql = "UPDATE discord_user SET is_blacklisted = ? WHERE discord_id = ? "
         await self.db.sql_update(sql, (int(blacklist_status), discord_id))
+        self.invalidate_discord_user(discord_id)
 
     async def set_pxls_user(self, discord_id, pxls_user_id):
         """Update the pxls_user_id of a discord_user"""
         sql = "UPDATE discord_user SET pxls_user_id = ? WHERE discord_id = ? "
         await self.db.sql_update(sql, (pxls_user_id, discord_id))
+        self.invalidate_discord_user(discord_id)
 
     async def set_user_theme(self, discord_id, theme):
         """Update the theme of a discord_user"""
         sql = "UPDATE discord_user SET color = ? WHERE discord_id = ? "
         await self.db.sql_update(sql, (theme, discord_id))
+        self.invalidate_discord_user(discord_id)
 
     async def set_user_timezone(self, discord_id, timezone):
         """Update the theme of a discord_user"""
         sql = "UPDATE discord_user SET timezone = ? WHERE discord_id = ? "
         await self.db.sql_update(sql, (timezone, discord_id))
+        self.invalidate_discord_user(discord_id)
 
     async def set_user_font(self, discord_id, font):
         """Update the theme of a discord_user"""
         sql = "UPDATE discord_user SET font = ? WHERE discord_id = ? "
         await self.db.sql_update(sql, (font, discord_id))
+        self.invalidate_discord_user(discord_id)
 
     async def get_all_blacklisted_users(self):
         """Get all the discord users blacklisted. Returns a list of discord ID"""
@@ -204,8 +232,13 @@ class DbUserManager:
             INNER JOIN pxls_name ON pxls_name.pxls_user_id = server_pxls_user.pxls_user_id
             INNER JOIN pxls_user_stat ON pxls_user_stat.pxls_name_id = pxls_name.pxls_name_id
             WHERE server_id = ?
-            AND record_id = (SELECT MAX(record_id) FROM record)
-        """
+            AND record_id = {}
+            AND (alltime_count IS NOT NULL OR canvas_count IS NOT NULL)
+        """.format(
+            user_stat_at_sql(
+                "pxls_name.pxls_name_id", "(SELECT MAX(record_id) FROM record)"
+            )
+        )
         rows = await self.db.sql_select(sql, server_id)
         return rows
 
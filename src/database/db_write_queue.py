@@ -0,0 +1,222 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+# max number of queued statements committed in a single transaction
+MAX_BATCH_SIZE = 100
+# only these statements are grouped in a transaction with other ones, the rest
+# (DDL, PRAGMA, VACUUM, ...) run on their own
+BATCHABLE_STATEMENTS = ("INSERT", "UPDATE", "DELETE", "REPLACE")
+
+
+class _Write:
+    """A queued write: a statement to execute or a request for the connection."""
+
+    def __init__(self, kind, query=None, param=None) -> None:
+        self.kind = kind
+        self.query = query
+        self.param = param
+        self.future = asyncio.get_running_loop().create_future()
+        self.queued_at = time.perf_counter()
+        # set by the owner of an exclusive write once it's done with the connection
+        self.released = asyncio.Event() if kind == "exclusive" else None
+
+    @property
+    def batchable(self) -> bool:
+        if self.kind == "exclusive":
+            return False
+        if self.kind == "many":
+            # always in a transaction
+            return True
+        return self.query.lstrip().upper().startswith(BATCHABLE_STATEMENTS)
+
+
+class DbWriteQueue:
+    """The owner of the database writer connection: a task executes the queued
+    writes one after the other.
+
+    The statements queued together are committed in a single transaction (each
+    one in its own savepoint so an error only fails its own write) and their
+    results are returned through futures. `exclusive()` gives the connection to
+    the caller for multi-statement transactions."""
+
+    def __init__(self, max_batch_size: int = MAX_BATCH_SIZE) -> None:
+        self.max_batch_size = max_batch_size
+        self.conn = None
+        self._queue: asyncio.Queue = None
+        self._task: asyncio.Task = None
+        # function called with (query, param, duration) after each statement
+        self.on_executed = None
+
+        # metrics
+        self.nb_writes = 0
+        self.nb_transactions = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    @property
+    def depth(self) -> int:
+        """Number of writes waiting in the queue."""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def get_metrics(self) -> dict:
+        return {
+            "depth": self.depth,
+            "writes": self.nb_writes,
+            "transactions": self.nb_transactions,
+            "avg_wait_ms": (
+                self.total_wait_time / self.nb_writes * 1000 if self.nb_writes else 0
+            ),
+            "max_wait_ms": self.max_wait_time * 1000,
+        }
+
+    def start(self, conn):
+        """Start the task owning the connection."""
+        self.conn = conn
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Execute the writes left in the queue and stop the task."""
+        if not self.is_running:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    async def execute(self, kind: str, query: str, param=None):
+        """Queue a statement and wait for its result.
+
+        :param kind: "update" (returns the rowcount), "insert" (returns the
+            lastrowid) or "many" (executemany, returns the rowcount)"""
+        write = _Write(kind, query, param)
+        await self._queue.put(write)
+        return await write.future
+
+    @asynccontextmanager
+    async def exclusive(self):
+        """Wait for the queued writes to be done and get the connection,
+        no other write can happen until the context is exited.
+
+        A transaction left open by the holder (cancelled or failed outside of
+        its own rollback) is rolled back before the next writes."""
+        write = _Write("exclusive")
+        await self._queue.put(write)
+        conn = None
+        try:
+            conn = await write.future
+            yield conn
+        finally:
+            try:
+                if conn is not None and conn.get_connection().in_transaction:
+                    logger.warning("Rolling back a transaction left open on the writer.")
+                    await conn.rollback()
+            finally:
+                write.released.set()
+
+    def _record_wait(self, write: _Write):
+        wait_time = time.perf_counter() - write.queued_at
+        self.nb_writes += 1
+        self.total_wait_time += wait_time
+        self.max_wait_time = max(self.max_wait_time, wait_time)
+
+    async def _run(self):
+        pending = None
+        while True:
+            write = pending or await self._queue.get()
+            pending = None
+            if write is None:
+                return
+            try:
+                if write.batchable:
+                    batch = [write]
+                    while len(batch) < self.max_batch_size and not self._queue.empty():
+                        write = self._queue.get_nowait()
+                        if write is None or not write.batchable:
+                            pending = write
+                            break
+                        batch.append(write)
+                    await self._run_batch(batch)
+                elif write.kind == "exclusive":
+                    await self._run_exclusive(write)
+                else:
+                    await self._run_batch([write], in_transaction=False)
+            except Exception:
+                logger.exception("Unexpected error in the database write queue:")
+
+    async def _run_exclusive(self, write: _Write):
+        if write.future.done():
+            # the caller stopped waiting
+            return
+        self._record_wait(write)
+        self.nb_transactions += 1
+        write.future.set_result(self.conn)
+        await write.released.wait()
+
+    async def _execute(self, cur, write: _Write):
+        start = time.perf_counter()
+        if write.kind == "many":
+            await cur.executemany(write.query, write.param)
+        elif write.param:
+            await cur.execute(write.query, write.param)
+        else:
+            await cur.execute(write.query)
+        if self.on_executed:
+            param = write.param
+            if write.kind == "many":
+                param = write.param[0] if write.param else None
+            self.on_executed(write.query, param, time.perf_counter() - start)
+        if write.kind == "insert":
+            return cur.get_cursor().lastrowid
+        return cur.get_cursor().rowcount
+
+    async def _run_batch(self, batch: list, in_transaction: bool = True):
+        batch = [write for write in batch if not write.future.done()]
+        if not batch:
+            return
+        results = []
+        async with self.conn.cursor() as cur:
+            if in_transaction:
+                await cur.execute("BEGIN TRANSACTION;")
+            try:
+                for write in batch:
+                    self._record_wait(write)
+                    if in_transaction:
+                        await cur.execute("SAVEPOINT write;")
+                    try:
+                        res = await self._execute(cur, write)
+                    except Exception as e:
+                        if not in_transaction:
+                            raise
+                        await cur.execute("ROLLBACK TO write;")
+                        res = e
+                    if in_transaction:
+                        await cur.execute("RELEASE write;")
+                    results.append(res)
+                if in_transaction:
+                    await cur.execute("COMMIT;")
+            except Exception as e:
+                if in_transaction:
+                    try:
+                        await cur.execute("ROLLBACK;")
+                    except Exception:
+                        pass
+                for write in batch:
+                    if not write.future.done():
+                        write.future.set_exception(e)
+                return
+        self.nb_transactions += 1
+        for write, res in zip(batch, results):
+            if write.future.done():
+                continue
+            if isinstance(res, Exception):
+                write.future.set_exception(res)
+            else:
+                write.future.set_result(res)
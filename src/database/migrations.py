@@ -0,0 +1,489 @@
+import logging
+import os
+from abc import ABC, abstractmethod
+
+import asqlite
+
+from database.db_rollup_manager import DbRollupManager
+from database.db_stats_manager import KEYFRAME_INTERVAL, user_stats_at_record_sql
+
+logger = logging.getLogger(__name__)
+
+# database of the first version of the bot, imported by `ImportOldDatabase`
+OLD_DB_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), "database_old.db")
+# canvas of the data in the old database
+OLD_DB_CANVAS_CODE = "48"
+
+
+class Migration(ABC):
+    """A change of the database schema or data, applied once.
+
+    The migration is done in steps so the heavy ones can run in the background
+    (`background = True`) while the bot is running: `step()` is called with the
+    position returned by the previous step (None for the first one) until
+    `done >= total`. Each step must be short and resumable from its position
+    as the bot can be stopped between 2 steps."""
+
+    version: int = None
+    name: str = None
+    background: bool = False
+
+    @abstractmethod
+    async def step(self, runner, position) -> tuple:
+        """Do one step of the migration and return (position, done, total).
+
+        :param runner: the `DbMigrationManager` running the migration
+        :param position: the position returned by the previous step"""
+
+
+async def add_column_if_missing(db, table, column, column_type):
+    columns = await db.sql_select(f"PRAGMA table_info({table})")
+    if column not in [c["name"] for c in columns]:
+        await db.sql_update(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+
+
+class AddServerSnapshotsChannel(Migration):
+    version = 1
+    name = "add server.snapshots_channel_id"
+
+    async def step(self, runner, position):
+        await add_column_if_missing(runner.db, "server", "snapshots_channel_id", "TEXT")
+        return (None, 1, 1)
+
+
+class AddDiscordUserSettings(Migration):
+    version = 2
+    name = "add discord_user.timezone and discord_user.font"
+
+    async def step(self, runner, position):
+        await add_column_if_missing(runner.db, "discord_user", "timezone", "TEXT")
+        await add_column_if_missing(runner.db, "discord_user", "font", "TEXT")
+        return (None, 1, 1)
+
+
+class ImportOldDatabase(Migration):
+    """Import the stats of the old database (`OLD_DB_FILE`) if there is one.
+
+    It only runs on a database without any record since the imported records
+    must be older than the ones saved by the bot: an existing install already
+    has the old stats (or never had them) so the migration is marked as applied."""
+
+    version = 3
+    name = "import the old database"
+    # number of old datetimes imported per step
+    chunk_size = 200
+
+    async def step(self, runner, position):
+        position = position or 0
+        db = runner.db
+        if position == 0:
+            records = await db.sql_select("SELECT record_id FROM record LIMIT 1")
+            if records:
+                logger.debug("Old database not imported: existing install.")
+                return (position, 1, 1)
+        if not os.path.exists(OLD_DB_FILE):
+            return (position, 0, 0)
+
+        async with asqlite.connect(OLD_DB_FILE) as old_conn:
+            async with old_conn.cursor() as old_cur:
+                await old_cur.execute(
+                    "SELECT COUNT(DISTINCT datetime) FROM pxls_user_stats"
+                )
+                total = (await old_cur.fetchone())[0]
+                await old_cur.execute(
+                    """
+                    SELECT DISTINCT datetime FROM pxls_user_stats
+                    ORDER BY datetime LIMIT ? OFFSET ?""",
+                    (self.chunk_size, position),
+                )
+                datetimes = [row[0] for row in await old_cur.fetchall()]
+                if not datetimes:
+                    return (position, total, total)
+                await old_cur.execute(
+                    """
+                    SELECT name, alltime_count, canvas_count, datetime
+                    FROM pxls_user_stats
+                    WHERE datetime BETWEEN ? AND ?""",
+                    (datetimes[0], datetimes[-1]),
+                )
+                rows = await old_cur.fetchall()
+                general_stats = []
+                if position == 0:
+                    await old_cur.execute("SELECT * FROM pxls_general_stats")
+                    general_stats = [
+                        (row[0], row[1], OLD_DB_CANVAS_CODE, row[3])
+                        for row in await old_cur.fetchall()
+                    ]
+
+        # group by date
+        stats = {}
+        for name, alltime_count, canvas_count, datetime in rows:
+            stats.setdefault(datetime, []).append((name, alltime_count, canvas_count))
+        names = set(row[0] for row in rows)
+        new_names = [name for name in names if await runner.names.get(name) is None]
+
+        async with db.writer() as conn, conn.cursor() as cur:
+            await cur.execute("BEGIN TRANSACTION;")
+            try:
+                await cur.executemany(
+                    """
+                    INSERT INTO pxls_general_stat(stat_name, value, canvas_code, datetime)
+                    VALUES (?,?,?,?)""",
+                    general_stats,
+                )
+                created = await runner.names.create_users(new_names, cur)
+                name_ids = {
+                    name: pxls_name_id for name, (pxls_name_id, _) in created.items()
+                }
+                for name in names - created.keys():
+                    name_ids[name] = await runner.names.get_name_id(name)
+                for datetime in datetimes:
+                    await cur.execute(
+                        "INSERT INTO record (datetime, canvas_code) VALUES (?,?)",
+                        (datetime, OLD_DB_CANVAS_CODE),
+                    )
+                    record_id = cur.get_cursor().lastrowid
+                    await cur.executemany(
+                        """
+                        INSERT INTO pxls_user_stat
+                            (record_id, pxls_name_id, alltime_count, canvas_count)
+                        VALUES (?,?,?,?)""",
+                        [
+                            (record_id, name_ids[name], alltime_count, canvas_count)
+                            for name, alltime_count, canvas_count in stats[datetime]
+                        ],
+                    )
+                    # the old records are complete
+                    await cur.execute(
+                        "INSERT INTO pxls_user_stat_keyframe(record_id) VALUES (?)",
+                        record_id,
+                    )
+                await cur.execute("DELETE FROM canvas_record")
+                await cur.execute(
+                    """
+                    INSERT INTO canvas_record
+                    SELECT canvas_code, MIN(record_id), MAX(record_id),
+                        MIN(datetime), MAX(datetime)
+                    FROM record
+                    GROUP BY canvas_code"""
+                )
+            except Exception:
+                await cur.execute("ROLLBACK;")
+                raise
+            await cur.execute("COMMIT;")
+        runner.names.add_all(created)
+        position += len(datetimes)
+        return (position, position, total)
+
+
+class IndexUserStatsByName(Migration):
+    """The index is created with the tables (see `DbStatsManager.create_tables()`)
+    because the point-in-time queries scan the whole table without it, this
+    migration is kept for the version numbers and does nothing if it exists."""
+
+    version = 4
+    name = "index pxls_user_stat on (pxls_name_id, record_id)"
+
+    async def step(self, runner, position):
+        await runner.db.sql_update(
+            """
+            CREATE INDEX IF NOT EXISTS idx_pxls_user_stat_name_record
+            ON pxls_user_stat(pxls_name_id, record_id)"""
+        )
+        return (None, 1, 1)
+
+
+class BackfillRollups(Migration):
+    """Roll up the stats saved before the rollup tables were added."""
+
+    version = 5
+    name = "backfill the stats rollups"
+    background = True
+
+    async def step(self, runner, position):
+        rollups = DbRollupManager(runner.db)
+        done = total = 0
+        chunk_done = False
+        for source_table, chunk_size in (
+            ("pxls_user_stat", runner.chunk_size),
+            # the general stats rows are smaller, use bigger chunks
+            ("pxls_general_stat", runner.chunk_size * 100),
+        ):
+            if not chunk_done and await rollups.backfill(source_table, chunk_size):
+                chunk_done = True
+            first_id, last_id = await rollups.get_state(source_table)
+            if first_id is not None:
+                done += last_id - first_id + 1
+                total += last_id
+        return (None, done, total)
+
+
+class CompactUserStats(Migration):
+    """Delta-encode the complete records (saved before the delta encoding) that
+    aren't keyframes: the rows of the users whose counts didn't change since the
+    previous record are removed. The records where users left the stats get
+    their rows and are rolled up again."""
+
+    version = 6
+    name = "delta-encode the pxls user stats"
+    background = True
+
+    @staticmethod
+    def is_keyframe(record, last_keyframe):
+        return (
+            last_keyframe is None
+            or record["record_id"] - last_keyframe["record_id"] >= KEYFRAME_INTERVAL
+            or record["canvas_code"] != last_keyframe["canvas_code"]
+        )
+
+    async def step(self, runner, position):
+        position = position or 0
+        async with runner.db.writer() as conn, conn.cursor() as cur:
+            await cur.execute("SELECT COALESCE(MAX(record_id), 0) FROM record")
+            total = (await cur.fetchone())[0]
+            await cur.execute(
+                """
+                SELECT record.record_id, canvas_code, k.record_id IS NOT NULL AS complete
+                FROM record
+                LEFT JOIN pxls_user_stat_keyframe k ON k.record_id = record.record_id
+                WHERE record.record_id > ?
+                ORDER BY record.record_id
+                LIMIT ?""",
+                (position, runner.chunk_size),
+            )
+            records = await cur.fetchall()
+            if not records:
+                return (position, total, total)
+
+            # get the counts and the last keyframe where the previous step stopped
+            await cur.execute(
+                "SELECT * FROM {}".format(user_stats_at_record_sql(position))
+            )
+            counts = {
+                r["pxls_name_id"]: (r["alltime_count"], r["canvas_count"])
+                for r in await cur.fetchall()
+            }
+            await cur.execute(
+                """
+                SELECT k.record_id, canvas_code FROM pxls_user_stat_keyframe k
+                JOIN record ON record.record_id = k.record_id
+                WHERE k.record_id <= ?
+                ORDER BY k.record_id DESC
+                LIMIT 1""",
+                position,
+            )
+            last_keyframe = await cur.fetchone()
+
+            rollups = DbRollupManager(runner.db)
+            await cur.execute("BEGIN TRANSACTION;")
+            try:
+                for record in records:
+                    counts, last_keyframe = await self._compact_record(
+                        cur, record, counts, last_keyframe, rollups
+                    )
+            except Exception:
+                await cur.execute("ROLLBACK;")
+                raise
+            await cur.execute("COMMIT;")
+        position = records[-1]["record_id"]
+        return (position, position, total)
+
+    async def _compact_record(self, cur, record, counts, last_keyframe, rollups):
+        """Compact a record, return the counts and the last keyframe after it."""
+        record_id = record["record_id"]
+        await cur.execute(
+            """
+            SELECT pxls_name_id, alltime_count, canvas_count
+            FROM pxls_user_stat WHERE record_id = ?""",
+            record_id,
+        )
+        new_counts = {
+            r["pxls_name_id"]: (r["alltime_count"], r["canvas_count"])
+            for r in await cur.fetchall()
+        }
+        if not record["complete"]:
+            # already delta-encoded, apply the changes
+            counts = dict(counts)
+            for pxls_name_id, values in new_counts.items():
+                if values == (None, None):
+                    counts.pop(pxls_name_id, None)
+                else:
+                    counts[pxls_name_id] = values
+            return counts, last_keyframe
+        # the users who left the stats get a row with NULL counts
+        removed = [
+            (record_id, pxls_name_id)
+            for pxls_name_id in counts.keys() - new_counts.keys()
+        ]
+        await cur.executemany(
+            "INSERT INTO pxls_user_stat(record_id, pxls_name_id) VALUES (?, ?)",
+            removed,
+        )
+        if removed:
+            # the rollups of the record didn't have these rows
+            await rollups.roll_up_record_again(cur, record_id)
+        if self.is_keyframe(record, last_keyframe):
+            return new_counts, record
+
+        unchanged = [
+            (record_id, pxls_name_id)
+            for pxls_name_id, values in new_counts.items()
+            if counts.get(pxls_name_id) == values
+        ]
+        await cur.executemany(
+            "DELETE FROM pxls_user_stat WHERE record_id = ? AND pxls_name_id = ?",
+            unchanged,
+        )
+        await cur.execute(
+            "DELETE FROM pxls_user_stat_keyframe WHERE record_id = ?", record_id
+        )
+        return new_counts, last_keyframe
+
+
+class EnableIncrementalVacuum(Migration):
+    """Check that the database uses incremental auto-vacuum so the pages freed by
+    the retention policy can be released a few at a time (see
+    `DbRetentionManager.optimize()`).
+
+    The new databases are created with it (see `DbConnection`), an existing
+    database needs a full VACUUM that doubles its size on disk and blocks the
+    writes: it isn't done here but with `scripts/vacuum_database.py`."""
+
+    version = 7
+    name = "check the incremental auto-vacuum"
+
+    async def step(self, runner, position):
+        rows = await runner.db.sql_select("PRAGMA auto_vacuum")
+        # 2 = incremental
+        if rows[0][0] != 2:
+            logger.warning(
+                "The database doesn't use incremental auto-vacuum, the free pages "
+                "won't be released: run scripts/vacuum_database.py with the bot "
+                "stopped to enable it."
+            )
+        return (None, 1, 1)
+
+
+class AddUserStatRollupPresence(Migration):
+    """Add the columns saving when the counts of a period were saved and if the
+    user left the stats to the user stats rollups.
+
+    The existing rollups only kept the latest row of each period, even when it
+    was the one of a user leaving the stats: they are deleted here so they
+    aren't read anymore and rebuilt by `RebuildUserStatRollups`."""
+
+    version = 8
+    name = "add pxls_user_stat_rollup.counts_datetime and has_left"
+
+    async def step(self, runner, position):
+        db = runner.db
+        await add_column_if_missing(
+            db, "pxls_user_stat_rollup", "counts_datetime", "TIMESTAMP"
+        )
+        await add_column_if_missing(db, "pxls_user_stat_rollup", "has_left", "INTEGER")
+        async with db.writer() as conn, conn.cursor() as cur:
+            await cur.execute("BEGIN TRANSACTION;")
+            try:
+                await cur.execute("DELETE FROM pxls_user_stat_rollup")
+                await cur.execute(
+                    "DELETE FROM rollup_state WHERE source_table = 'pxls_user_stat'"
+                )
+            except Exception:
+                await cur.execute("ROLLBACK;")
+                raise
+            await cur.execute("COMMIT;")
+        return (None, 1, 1)
+
+
+class RebuildUserStatRollups(Migration):
+    """Roll up the pxls user stats deleted by `AddUserStatRollupPresence` again."""
+
+    version = 9
+    name = "rebuild the pxls user stats rollups"
+    background = True
+
+    async def step(self, runner, position):
+        rollups = DbRollupManager(runner.db)
+        await rollups.backfill("pxls_user_stat", runner.chunk_size)
+        first_id, last_id = await rollups.get_state("pxls_user_stat")
+        if first_id is None:
+            return (None, 0, 0)
+        return (None, last_id - first_id + 1, last_id)
+
+
+class AddKeyframeLeaveRows(Migration):
+    """Add the rows with NULL counts of the users who left the stats on the
+    keyframes saved without them (only the delta records had them): the rollups
+    carried the counts of these users forward. The rollups of the keyframes
+    changed are updated."""
+
+    version = 10
+    name = "save the users who left the stats on the keyframes"
+    background = True
+
+    async def step(self, runner, position):
+        position = position or 0
+        rollups = DbRollupManager(runner.db)
+        async with runner.db.writer() as conn, conn.cursor() as cur:
+            await cur.execute(
+                "SELECT COALESCE(MAX(record_id), 0) FROM pxls_user_stat_keyframe"
+            )
+            total = (await cur.fetchone())[0]
+            await cur.execute(
+                """
+                SELECT record_id FROM pxls_user_stat_keyframe
+                WHERE record_id > ?
+                ORDER BY record_id
+                LIMIT ?""",
+                (position, runner.chunk_size),
+            )
+            keyframes = [row["record_id"] for row in await cur.fetchall()]
+            if not keyframes:
+                return (position, total, total)
+            await cur.execute("BEGIN TRANSACTION;")
+            try:
+                for record_id in keyframes:
+                    await self._add_leave_rows(cur, record_id, rollups)
+            except Exception:
+                await cur.execute("ROLLBACK;")
+                raise
+            await cur.execute("COMMIT;")
+        position = keyframes[-1]
+        return (position, position, total)
+
+    @staticmethod
+    async def _add_leave_rows(cur, record_id, rollups):
+        await cur.execute(
+            "SELECT MAX(record_id) FROM record WHERE record_id < ?", record_id
+        )
+        previous_record_id = (await cur.fetchone())[0]
+        if previous_record_id is None:
+            return
+        await cur.execute(
+            """
+            INSERT INTO pxls_user_stat(record_id, pxls_name_id)
+            SELECT ?, pxls_name_id FROM {}
+            WHERE pxls_name_id NOT IN (
+                SELECT pxls_name_id FROM pxls_user_stat WHERE record_id = ?
+            )""".format(
+                user_stats_at_record_sql(previous_record_id)
+            ),
+            (record_id, record_id),
+        )
+        if cur.get_cursor().rowcount > 0:
+            await rollups.roll_up_record_again(cur, record_id)
+
+
+# all the migrations, in order
+MIGRATIONS = [
+    AddServerSnapshotsChannel(),
+    AddDiscordUserSettings(),
+    ImportOldDatabase(),
+    IndexUserStatsByName(),
+    BackfillRollups(),
+    CompactUserStats(),
+    EnableIncrementalVacuum(),
+    AddUserStatRollupPresence(),
+    RebuildUserStatRollups(),
+    AddKeyframeLeaveRows(),
+]
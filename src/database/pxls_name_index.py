@@ -0,0 +1,80 @@
+from database.db_connection import DbConnection
+
+
+class PxlsNameIndex:
+    """An in-memory index of the `pxls_name` table
+    (key: name, value: (pxls_name_id, pxls_user_id)).
+
+    It is loaded on the first lookup and kept up to date by the functions
+    creating the pxls users, so it must be cleared with `clear()` if the
+    `pxls_name` table is changed somewhere else."""
+
+    def __init__(self, db_conn: DbConnection) -> None:
+        self.db = db_conn
+        self.names: dict = None
+
+    async def load(self):
+        rows = await self.db.sql_select(
+            "SELECT pxls_name_id, pxls_user_id, name FROM pxls_name"
+        )
+        self.names = {
+            row["name"]: (row["pxls_name_id"], row["pxls_user_id"]) for row in rows
+        }
+
+    def clear(self):
+        """Forget the names, they will be loaded again on the next lookup."""
+        self.names = None
+
+    async def get(self, name):
+        """Get a tuple (pxls_name_id, pxls_user_id) for a name or None if there
+        is no pxls_name with this name."""
+        if self.names is None:
+            await self.load()
+        return self.names.get(name)
+
+    async def get_name_id(self, name):
+        res = await self.get(name)
+        return res[0] if res else None
+
+    async def get_user_id(self, name):
+        res = await self.get(name)
+        return res[1] if res else None
+
+    def add(self, name, pxls_name_id, pxls_user_id):
+        if self.names is not None:
+            self.names[name] = (pxls_name_id, pxls_user_id)
+
+    async def create_users(self, names: list, cur) -> dict:
+        """Create a 'pxls_user' and its 'pxls_name' for each name with
+        one `executemany` per table, using the given cursor.
+
+        The IDs are given explicitly (following the current max IDs) so the cursor
+        must be the writer's, in a transaction. The index isn't updated: call
+        `add_all()` with the returned dictionary (name: (pxls_name_id,
+        pxls_user_id)) once the transaction is committed."""
+        if not names:
+            return {}
+        await cur.execute("SELECT COALESCE(MAX(pxls_user_id), 0) FROM pxls_user")
+        first_user_id = (await cur.fetchone())[0] + 1
+        await cur.execute("SELECT COALESCE(MAX(pxls_name_id), 0) FROM pxls_name")
+        first_name_id = (await cur.fetchone())[0] + 1
+
+        created = {
+            name: (first_name_id + i, first_user_id + i) for i, name in enumerate(names)
+        }
+        await cur.executemany(
+            "INSERT INTO pxls_user (pxls_user_id) VALUES (?)",
+            [(pxls_user_id,) for _, pxls_user_id in created.values()],
+        )
+        await cur.executemany(
+            "INSERT INTO pxls_name(pxls_name_id, pxls_user_id, name) VALUES (?,?,?)",
+            [
+                (pxls_name_id, pxls_user_id, name)
+                for name, (pxls_name_id, pxls_user_id) in created.items()
+            ],
+        )
+        return created
+
+    def add_all(self, created: dict):
+        for name, (pxls_name_id, pxls_user_id) in created.items():
+            self.add(name, pxls_name_id, pxls_user_id)
@@ -6,6 +6,8 @@ import disnake
 from disnake.ext import commands
 from dotenv import load_dotenv
 
+from utils.command_usage_logger import CommandUsageLogger
+from utils.http_client import http_client
 from utils.log import close_loggers, get_logger, setup_loggers
 from utils.pxls.template_manager import TemplateManager
 from utils.setup import (
@@ -13,6 +15,9 @@ from utils.setup import (
     GUILD_IDS,
     GUILD_MEMBER_MIN,
     db_canvas,
+    db_conn,
+    db_migrations,
+    db_retention,
     db_servers,
     db_stats,
     db_templates,
@@ -31,7 +36,22 @@ allowed_mentions = disnake.AllowedMentions(
     roles=False,
     replied_user=False,
 )
-bot = commands.Bot(
+
+
+class Clueless(commands.Bot):
+    """The bot, closing the shared resources on shutdown."""
+
+    async def close(self):
+        # save the command usages still in the queue
+        await command_usage_logger.close()
+        await db_migrations.stop_background()
+        await super().close()
+        await http_client.close()
+        # close the database connections once nothing can use them anymore
+        await db_conn.close_connection()
+
+
+bot = Clueless(
     command_prefix=db_servers.get_prefix,
     help_command=None,
     intents=intents,
@@ -43,17 +63,30 @@ bot = commands.Bot(
 )
 
 tracked_templates = TemplateManager()
+command_usage_logger = CommandUsageLogger(
+    db_servers, os.environ.get("COMMAND_LOG_CHANNEL")
+)
 
 
 @bot.event
 async def on_connect():
+    # open the database connections pool and the HTTP session
+    await db_conn.create_connection()
+    http_client.start()
     # create db tables if they dont exist
     await db_servers.create_tables()
     await db_users.create_tables()
     await db_stats.create_tables()
     await db_templates.create_tables()
     await db_canvas.create_tables()
+    await db_retention.create_tables()
+    # apply the migrations, the heavy ones are applied in the background
+    await db_migrations.migrate()
+    db_migrations.start_background()
+    await db_servers.load_servers()
     await db_canvas.setup()
+    # start saving the command usages in the background
+    command_usage_logger.start(bot)
 
 
 @bot.event
@@ -122,28 +155,25 @@ async def on_command(ctx):
             args = "```[Command too long to show]```"
         message += args
 
-    # save commands used in the database
-    await db_servers.create_command_usage(
-        command_name,
-        is_dm,
-        server_name,
-        channel_id,
-        author_id,
-        message_time.replace(tzinfo=None),
-        args_clean,
-        slash_command,
-    )
-
-    # log commands used in a channel if a log channel is set
-    log_channel_id = os.environ.get("COMMAND_LOG_CHANNEL")
-    try:
-        log_channel = await bot.fetch_channel(log_channel_id)
-    except Exception:
-        return
     emb = disnake.Embed(color=0x00BB00, title="Command '{}' used.".format(command_name))
     emb.add_field(name="Context:", value=context, inline=False)
     emb.add_field(name="Message:", value=message, inline=False)
-    await log_channel.send(embed=emb)
+
+    # save commands used in the database and log them in a channel if a log
+    # channel is set (in the background)
+    command_usage_logger.log(
+        (
+            command_name,
+            is_dm,
+            server_name,
+            channel_id,
+            author_id,
+            message_time.replace(tzinfo=None),
+            args_clean,
+            slash_command,
+        ),
+        emb,
+    )
 
 
 # add a global check for blacklisted users
@@ -396,7 +426,10 @@ async def on_guild_join(guild: disnake.Guild):
         return
 
     if GUILD_MEMBER_MIN and guild.member_count < GUILD_MEMBER_MIN:
-        general_channel = next((channel for channel in guild.text_channels if channel.name == 'general'), None)
+        general_channel = next(
+            (channel for channel in guild.text_channels if channel.name == "general"),
+            None,
+        )
         target_channel = None
         if general_channel and general_channel.permissions_for(guild.me).send_messages:
             target_channel = general_channel
@@ -405,10 +438,14 @@ async def on_guild_join(guild: disnake.Guild):
                 if channel.permissions_for(guild.me).send_messages:
                     target_channel = channel
                     break
-        
+
         if target_channel:
-            await target_channel.send("Due to the 100 server limit, using Clueless is not supported in guilds below {0} members. Please refer to the DMs for personal use.".format(GUILD_MEMBER_MIN))
-        
+            await target_channel.send(
+                "Due to the 100 server limit, using Clueless is not supported in guilds below {0} members. Please refer to the DMs for personal use.".format(
+                    GUILD_MEMBER_MIN
+                )
+            )
+
         await guild.leave()
         return
 
@@ -11,6 +11,7 @@ import pandas
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 from utils.setup import DbConnection, DbStatsManager, stats  # noqa: E402
+from database.db_stats_manager import user_stats_at_record_sql  # noqa: E402 isort:skip
 
 """ Script to generate a bar chart race video for a given canvas """
 
@@ -40,19 +41,25 @@ async def get_stats_df(dt1, dt2, canvas: bool) -> pandas.DataFrame:
     record1 = await db_stats.find_record(dt1, canvas_code)
     record2 = await db_stats.find_record(dt2, canvas_code)
 
+    # the stats are delta-encoded, get the rows since the keyframe before dt1
+    # and carry the counts forward
     sql = """
     SELECT datetime, name, alltime_count, canvas_count
     FROM pxls_user_stat
     JOIN pxls_name ON pxls_name.pxls_name_id = pxls_user_stat.pxls_name_id
     JOIN record on record.record_id = pxls_user_stat.record_id
-    WHERE pxls_user_stat.record_id BETWEEN ? AND ?
+    WHERE pxls_user_stat.record_id BETWEEN (
+        SELECT MAX(record_id) FROM pxls_user_stat_keyframe WHERE record_id <= ?
+    ) AND ?
     AND record.canvas_code = ?
     AND pxls_user_stat.pxls_name_id in (
         SELECT pxls_name_id
-        FROM pxls_user_stat
-        WHERE record_id = ?
+        FROM {}
         ORDER BY canvas_count DESC
-        LIMIT 100 )"""
+        LIMIT 100 )
+    ORDER BY datetime""".format(
+        user_stats_at_record_sql(record2["record_id"])
+    )
 
     sql_colors = """
     SELECT datetime, color_name as name, amount_placed as canvas_count, color_hex
@@ -64,42 +71,40 @@ async def get_stats_df(dt1, dt2, canvas: bool) -> pandas.DataFrame:
 
     print("getting data...")
     if colors:
-        rows = await db_conn.sql_select(sql_colors, (canvas_code, canvas_code))
+        query, param = sql_colors, (canvas_code, canvas_code)
     else:
-        rows = await db_conn.sql_select(
-            sql,
-            (
-                record1["record_id"],
-                record2["record_id"],
-                canvas_code,
-                record2["record_id"],
-            ),
-        )
-    print("nb rows:", len(rows))
+        query, param = sql, (record1["record_id"], record2["record_id"], canvas_code)
 
-    # step 1 - group by date
-    users_dict = {}
+    # step 1 - group by date (while reading the rows)
+    nb_rows = 0
     dates_dict = {}
-    for row in rows:
-        name = row["name"]
-        dt = row["datetime"]
-        if canvas:
-            pixels = row["canvas_count"]
-        else:
-            pixels = row["alltime_count"]
-
-        try:
-            dates_dict[dt][name] = pixels
-        except KeyError:
-            dates_dict[dt] = {}
-            dates_dict[dt][name] = pixels
-
-        users_dict[name] = None
+    async with db_conn.sql_iter(query, param) as batches:
+        async for rows in batches:
+            nb_rows += len(rows)
+            for row in rows:
+                name = row["name"]
+                dt = row["datetime"]
+                if canvas:
+                    pixels = row["canvas_count"]
+                else:
+                    pixels = row["alltime_count"]
+
+                try:
+                    dates_dict[dt][name] = pixels
+                except KeyError:
+                    dates_dict[dt] = {}
+                    dates_dict[dt][name] = pixels
+    print("nb rows:", nb_rows)
 
     if not colors:
         # truncate the data to only keep the top 100 (at the time of dt2)
+        last_values = {}
+        for values in dates_dict.values():
+            last_values.update(values)
         last_values_sorted = sorted(
-            dates_dict[record2["datetime"]].items(), key=lambda x: x[1], reverse=True
+            [v for v in last_values.items() if v[1] is not None],
+            key=lambda x: x[1],
+            reverse=True,
         )
         users_list = [u[0] for u in last_values_sorted[0:100]]
     else:
@@ -108,7 +113,13 @@ async def get_stats_df(dt1, dt2, canvas: bool) -> pandas.DataFrame:
     # step 2 - make columns for each user
     columns = {}
     indexes = []
+    last_pixels = {}
     for i, dt in enumerate(dates_dict.keys()):
+        if not colors:
+            # carry forward the counts that didn't change
+            last_pixels.update(dates_dict[dt])
+            if dt < record1["datetime"]:
+                continue
         if i % dates_skipped != 0 and i != len(dates_dict.keys()) - 1:
             continue
         indexes.append(dt)
@@ -116,7 +127,7 @@ async def get_stats_df(dt1, dt2, canvas: bool) -> pandas.DataFrame:
             try:
                 pixels = dates_dict[dt][name]
             except KeyError:
-                pixels = None
+                pixels = last_pixels.get(name)
             try:
                 columns[name].append(pixels)
             except KeyError:
@@ -0,0 +1,69 @@
+import asyncio
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from utils.setup import stats  # noqa: E402
+
+""" Benchmark of the time and peak memory used to decode a board fetched from
+pxls: the previous decoding (through a list of ints), the read-only view of the
+bytes and the writable copy of the boards updated by the websocket.
+
+Usage: python benchmark_board_decoding.py [width] [height] """
+
+NB_RUNS = 5
+
+
+def decode_list(board_bytes):
+    return np.asarray(list(board_bytes), dtype=np.uint8).reshape(
+        stats.board_info["height"], stats.board_info["width"]
+    )
+
+
+def decode_view(board_bytes):
+    return stats.decode_board(board_bytes)
+
+
+def decode_copy(board_bytes):
+    return stats._swap_board("board_array", board_bytes)
+
+
+def measure(func, board_bytes):
+    # first call outside of the measure
+    reference = func(board_bytes).copy()
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(NB_RUNS):
+        res = func(board_bytes)
+    duration = (time.perf_counter() - start) / NB_RUNS
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return reference, res, duration, peak
+
+
+async def main():
+    width = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    height = int(sys.argv[2]) if len(sys.argv) > 2 else 3000
+    stats.board_info = {"width": width, "height": height}
+    rng = np.random.default_rng(0)
+    board_bytes = rng.integers(0, 32, width * height, dtype=np.uint8).tobytes()
+    print(f"{width}x{height} board ({len(board_bytes) / 1e6:.1f} MB)")
+
+    expected = np.frombuffer(board_bytes, dtype=np.uint8).reshape(height, width)
+    for name, func in [
+        ("list", decode_list),
+        ("view", decode_view),
+        ("copy", decode_copy),
+    ]:
+        reference, res, duration, peak = measure(func, board_bytes)
+        assert np.array_equal(res, expected)
+        assert np.array_equal(reference, expected)
+        print(f"{name:<12} time: {duration * 1000:9.2f} ms   peak: {peak / 1e6:8.1f} MB")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,110 @@
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import asqlite
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from utils.setup import DbConnection  # noqa: E402
+
+""" Micro-benchmark of the database queries per second, with a new connection per
+query (old behaviour) and with the connections pool """
+
+NB_MESSAGES = 2000
+NB_USERS = 500
+CONCURRENCY = 8
+
+
+class PerQueryConnection:
+    """The old `DbConnection`: a new connection for each query."""
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+
+    async def sql_select(self, query, param=None):
+        async with asqlite.connect(
+            self.db_file, detect_types=asqlite.PARSE_DECLTYPES
+        ) as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(query, param)
+                return await cursor.fetchall()
+
+    async def sql_insert(self, query, param=None):
+        async with asqlite.connect(
+            self.db_file, detect_types=asqlite.PARSE_DECLTYPES
+        ) as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(query, param)
+                await conn.commit()
+                return cursor.get_cursor().lastrowid
+
+
+async def setup_db(db_file):
+    db = DbConnection(db_file)
+    await db.sql_update(
+        """CREATE TABLE discord_user(
+            discord_id TEXT PRIMARY KEY,
+            pxls_user_id INTEGER,
+            color TEXT,
+            is_blacklisted BOOLEAN DEFAULT 0
+        )"""
+    )
+    await db.sql_update(
+        "CREATE TABLE server(server_id TEXT PRIMARY KEY, prefix TEXT, blacklist_role_id TEXT)"
+    )
+    await db.sql_update_many(
+        "INSERT INTO server(server_id, prefix) VALUES (?, ?)",
+        [(str(i), ">") for i in range(50)],
+    )
+    await db.close_connection()
+
+
+async def on_message_queries(db, i):
+    """The queries run by `on_message` for a single discord message."""
+    user_id = str(i % NB_USERS)
+    server_id = str(i % 50)
+    await db.sql_insert(
+        "INSERT OR IGNORE INTO discord_user(discord_id) VALUES(?)", user_id
+    )
+    await db.sql_select("SELECT * FROM discord_user WHERE discord_id = ?", user_id)
+    await db.sql_select("SELECT * FROM server WHERE server_id = ?", server_id)
+    await db.sql_select(
+        "SELECT blacklist_role_id FROM server WHERE server_id = ?", server_id
+    )
+
+
+async def run(db, name):
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def message(i):
+        async with semaphore:
+            await on_message_queries(db, i)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[message(i) for i in range(NB_MESSAGES)])
+    duration = time.perf_counter() - start
+    nb_queries = NB_MESSAGES * 4
+    print(
+        f"{name:<20} {nb_queries} queries in {duration:.2f}s "
+        f"-> {nb_queries / duration:,.0f} queries/s"
+    )
+    return nb_queries / duration
+
+
+async def main():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_file = os.path.join(tmp_dir, "benchmark.db")
+        await setup_db(db_file)
+
+        before = await run(PerQueryConnection(db_file), "connection per query")
+        pool = DbConnection(db_file)
+        await pool.create_connection()
+        after = await run(pool, "connections pool")
+        await pool.close_connection()
+    print(f"speedup: x{after / before:.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,94 @@
+import asyncio
+import os
+import sys
+import time
+
+import aiohttp
+from aiohttp import web
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from utils.http_client import HttpClient  # noqa: E402
+
+""" Load test of the HTTP requests against a local stub server: the previous
+`get_content()` (a new session for each request) and the shared `HttpClient`
+(a pool of keep-alive connections).
+
+Usage: python benchmark_http_client.py [nb requests] [concurrency] [size in KB] """
+
+HOST = "127.0.0.1"
+PORT = 8642
+
+
+async def start_stub_server(size: int) -> web.AppRunner:
+    body = os.urandom(size)
+
+    async def handler(request):
+        return web.Response(body=body, content_type="image/png")
+
+    app = web.Application()
+    app.router.add_get("/image", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, HOST, PORT).start()
+    return runner
+
+
+async def get_new_session(url):
+    timeout = aiohttp.ClientTimeout(sock_connect=10.0, sock_read=10.0)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        async with session.get(url) as r:
+            return await r.read()
+
+
+async def run(func, url, nb_requests, concurrency):
+    sem = asyncio.Semaphore(concurrency)
+
+    async def task():
+        async with sem:
+            start = time.perf_counter()
+            await func(url)
+            return time.perf_counter() - start
+
+    start = time.perf_counter()
+    latencies = sorted(await asyncio.gather(*[task() for _ in range(nb_requests)]))
+    duration = time.perf_counter() - start
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    return nb_requests / duration, p50, p99
+
+
+async def main():
+    nb_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    size = int(float(sys.argv[3]) * 1024) if len(sys.argv) > 3 else 64 * 1024
+    url = f"http://{HOST}:{PORT}/image"
+    runner = await start_stub_server(size)
+    http = HttpClient()
+    try:
+        print(
+            f"{nb_requests} requests of {size / 1024:.0f} KB, concurrency {concurrency}"
+        )
+        for name, func in [
+            ("session per request", get_new_session),
+            ("shared client", lambda url: http.get(url, "image")),
+        ]:
+            # warm up
+            await run(func, url, concurrency, concurrency)
+            throughput, p50, p99 = await run(func, url, nb_requests, concurrency)
+            print(
+                f"{name:<20} {throughput:8.0f} req/s   "
+                f"p50: {p50:6.2f} ms   p99: {p99:6.2f} ms"
+            )
+
+        # the response size cap
+        try:
+            await http.get(url, "image", max_size=size - 1)
+        except ValueError as e:
+            print(f"size cap: {e}")
+    finally:
+        await http.close()
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
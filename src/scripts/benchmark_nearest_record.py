@@ -0,0 +1,163 @@
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from utils.setup import DbConnection  # noqa: E402
+
+""" Benchmark of the nearest record lookup (full scan with JulianDay vs index seeks)
+on a synthetic database with a few years of data """
+
+NB_YEARS = 3
+RECORD_INTERVAL = timedelta(minutes=15)
+CANVAS_DURATION = timedelta(days=60)
+NB_TEMPLATES = 20
+TEMPLATE_DAYS = 180
+TEMPLATE_STAT_INTERVAL = timedelta(minutes=5)
+NB_LOOKUPS = 200
+
+OLD_FIND_RECORD = """
+    SELECT
+        record_id,
+        datetime,
+        canvas_code,
+        min(abs(JulianDay(datetime) - JulianDay(?)))*24*3600 as diff_with_time
+    FROM record
+    WHERE canvas_code {}"""
+
+OLD_TEMPLATE_PROGRESS = """
+    SELECT *, min(abs(JulianDay(datetime) - JulianDay(?)))*24*3600 as diff_with_time
+    FROM template_stat
+    WHERE template_id = ?"""
+
+
+async def populate(db: DbConnection, start: datetime, end: datetime):
+    await db.sql_update(
+        """CREATE TABLE record(
+            record_id INTEGER PRIMARY KEY,
+            datetime TIMESTAMP UNIQUE,
+            canvas_code TEXT
+        )"""
+    )
+    await db.sql_update(
+        """CREATE TABLE template_stat(
+            template_id INTEGER,
+            datetime TIMESTAMP,
+            progress INTEGER,
+            PRIMARY KEY(template_id, datetime)
+        )"""
+    )
+    await db.sql_update(
+        "CREATE INDEX idx_record_canvas_datetime ON record(canvas_code, datetime)"
+    )
+
+    records = []
+    dt = start
+    while dt < end:
+        canvas_code = str((dt - start) // CANVAS_DURATION)
+        records.append((dt, canvas_code))
+        dt += RECORD_INTERVAL
+    await db.sql_update_many(
+        "INSERT INTO record(datetime, canvas_code) VALUES (?, ?)", records
+    )
+
+    template_start = end - timedelta(days=TEMPLATE_DAYS)
+    for template_id in range(1, NB_TEMPLATES + 1):
+        stats = []
+        dt = template_start
+        progress = 0
+        while dt < end:
+            progress += random.randint(0, 10)
+            stats.append((template_id, dt, progress))
+            dt += TEMPLATE_STAT_INTERVAL
+        await db.sql_update_many(
+            "INSERT INTO template_stat(template_id, datetime, progress) VALUES (?, ?, ?)",
+            stats,
+        )
+    return len(records), NB_TEMPLATES * len(stats)
+
+
+async def bench(name, lookup):
+    start = time.perf_counter()
+    for _ in range(NB_LOOKUPS):
+        await lookup()
+    duration = time.perf_counter() - start
+    print(f"{name:<40} {duration / NB_LOOKUPS * 1000:8.3f} ms/lookup")
+    return duration
+
+
+async def main():
+    end = datetime(2022, 1, 1)
+    start = end - timedelta(days=365 * NB_YEARS)
+
+    def random_dt():
+        return start + (end - start) * random.random()
+
+    def last_canvas():
+        return str((end - start) // CANVAS_DURATION)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db = DbConnection(os.path.join(tmp_dir, "benchmark.db"))
+        nb_records, nb_template_stats = await populate(db, start, end)
+        print(f"{nb_records} records, {nb_template_stats} template stats\n")
+
+        # check that both methods find the same rows
+        for _ in range(50):
+            dt = random_dt()
+            old = await db.sql_select(OLD_FIND_RECORD.format("= ?"), (dt, last_canvas()))
+            new = await db.sql_select_nearest(
+                "record", dt, "canvas_code = ?", (last_canvas(),)
+            )
+            assert old[0]["record_id"] == new["record_id"]
+
+        old = await bench(
+            "find_record canvas (JulianDay scan)",
+            lambda: db.sql_select(
+                OLD_FIND_RECORD.format("= ?"), (random_dt(), last_canvas())
+            ),
+        )
+        new = await bench(
+            "find_record canvas (index seeks)",
+            lambda: db.sql_select_nearest(
+                "record", random_dt(), "canvas_code = ?", (last_canvas(),)
+            ),
+        )
+        print(f"speedup: x{old / new:.0f}\n")
+
+        old = await bench(
+            "find_record all (JulianDay scan)",
+            lambda: db.sql_select(OLD_FIND_RECORD.format("IS NOT NULL"), (random_dt(),)),
+        )
+        new = await bench(
+            "find_record all (index seeks)",
+            lambda: db.sql_select_nearest(
+                "record", random_dt(), "canvas_code IS NOT NULL"
+            ),
+        )
+        print(f"speedup: x{old / new:.0f}\n")
+
+        old = await bench(
+            "get_template_progress (JulianDay scan)",
+            lambda: db.sql_select(
+                OLD_TEMPLATE_PROGRESS, (random_dt(), random.randint(1, NB_TEMPLATES))
+            ),
+        )
+        new = await bench(
+            "get_template_progress (index seeks)",
+            lambda: db.sql_select_nearest(
+                "template_stat",
+                random_dt(),
+                "template_id = ?",
+                (random.randint(1, NB_TEMPLATES),),
+            ),
+        )
+        print(f"speedup: x{old / new:.0f}")
+        await db.close_connection()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,71 @@
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import ImageColor
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from utils.setup import stats  # noqa: E402
+from utils.plot_utils import matplotlib_to_plotly  # noqa: E402 isort:skip
+
+""" Benchmark of `PxlsStatsManager.palettize_array()`: the previous version (a
+Python call per pixel with `np.vectorize`) and the lookup table, with a 32 colors
+palette and the heatmap gradient.
+
+Usage: python benchmark_palettize.py [megapixels ...] """
+
+PALETTE = [f"#{i * 8:02x}{255 - i * 8:02x}{i * 4:02x}" for i in range(32)]
+HEATMAP_PALETTE = matplotlib_to_plotly("plasma_r", 255)
+
+
+def palettize_vectorize(array, palette):
+    colors_list = []
+    for color in palette:
+        rgb = ImageColor.getcolor(color, "RGBA")
+        colors_list.append(rgb)
+    colors_dict = dict(enumerate(colors_list))
+    colors_dict[255] = (0, 0, 0, 0)
+
+    img = np.stack(np.vectorize(colors_dict.get)(array), axis=-1)
+    return img.astype(np.uint8)
+
+
+def palettize_lut(array, palette):
+    return stats.palettize_array(array, palette)
+
+
+def measure(func, array, palette):
+    start = time.perf_counter()
+    res = func(array, palette)
+    return res, time.perf_counter() - start
+
+
+def main():
+    sizes = [float(s) for s in sys.argv[1:]] or [0.25, 1, 4]
+    rng = np.random.default_rng(0)
+    for palette_name, palette in [("32 colors", PALETTE), ("heatmap", HEATMAP_PALETTE)]:
+        print(f"palette: {palette_name}")
+        for megapixels in sizes:
+            side = int((megapixels * 1e6) ** 0.5)
+            array = rng.integers(0, len(palette), (side, side), dtype=np.uint8)
+            # transparent pixels
+            array[rng.random((side, side)) < 0.1] = 255
+            nb_megapixels = side * side / 1e6
+
+            expected, vectorize_time = measure(palettize_vectorize, array, palette)
+            # first call builds the lookup table
+            res, first_lut_time = measure(palettize_lut, array, palette)
+            res, lut_time = measure(palettize_lut, array, palette)
+            assert np.array_equal(res, expected)
+            print(
+                f"  {side}x{side}: "
+                f"vectorize {vectorize_time / nb_megapixels * 1000:8.1f} ms/MP | "
+                f"LUT {lut_time / nb_megapixels * 1000:6.2f} ms/MP "
+                f"(first call: {first_lut_time / nb_megapixels * 1000:6.2f} ms/MP) | "
+                f"x{vectorize_time / lut_time:.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
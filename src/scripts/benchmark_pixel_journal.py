@@ -0,0 +1,98 @@
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from utils.pxls.pixel_journal import RECORD_DTYPE, PixelJournal, to_ms  # noqa: E402
+
+""" Benchmark of the pixel journal: append the pixels in batches (like the
+websocket client), then read a time range, replay it on a board and aggregate
+it, on a temporary journal.
+
+Usage: python benchmark_pixel_journal.py [millions of pixels] [width] [height] """
+
+BATCH_SIZE = 500
+CANVAS_CODE = "bench"
+
+
+def measure(func, *args):
+    start = time.perf_counter()
+    res = func(*args)
+    return res, (time.perf_counter() - start) * 1000
+
+
+def main():
+    nb_pixels = int(float(sys.argv[1]) * 1e6) if len(sys.argv) > 1 else 10_000_000
+    width = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    height = int(sys.argv[3]) if len(sys.argv) > 3 else 2000
+
+    rng = np.random.default_rng(0)
+    x = rng.integers(0, width, nb_pixels, dtype=np.int32)
+    y = rng.integers(0, height, nb_pixels, dtype=np.int32)
+    color = rng.integers(-1, 32, nb_pixels, dtype=np.int16)
+    # a pixel every 10 ms on average
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    start_ms = int(start.timestamp() * 1000)
+    time_ms = start_ms + np.cumsum(rng.integers(0, 20, nb_pixels))
+
+    with tempfile.TemporaryDirectory() as folder:
+        journal = PixelJournal(folder)
+        t = time.perf_counter()
+        for i in range(0, nb_pixels, BATCH_SIZE):
+            s = slice(i, i + BATCH_SIZE)
+            journal.append(CANVAS_CODE, time_ms[s], x[s], y[s], color[s])
+        append_time = time.perf_counter() - t
+        journal.close()
+        size = journal.get_size(CANVAS_CODE)
+        print(
+            f"{nb_pixels / 1e6:.1f}M pixels, {size / 1e6:.0f} MB "
+            f"({RECORD_DTYPE.itemsize} bytes/pixel)"
+        )
+        print(f"append:        {nb_pixels / append_time / 1e6:6.2f} M pixels/s")
+
+        # the middle half of the journal
+        duration = timedelta(milliseconds=int(time_ms[-1] - start_ms))
+        range_start, range_end = start + duration / 4, start + duration * 3 / 4
+        records, read_time = measure(journal.read, CANVAS_CODE, range_start, range_end)
+        print(f"read range:    {read_time:8.2f} ms ({len(records)} records)")
+
+        board = np.zeros((height, width), dtype=np.uint8)
+        replayed, replay_time = measure(
+            journal.replay, CANVAS_CODE, board, range_start, range_end
+        )
+        print(f"replay range:  {replay_time:8.2f} ms")
+        counts, count_time = measure(
+            journal.count_pixels, CANVAS_CODE, (height, width), range_start, range_end
+        )
+        print(f"count pixels:  {count_time:8.2f} ms")
+        colors, colors_time = measure(
+            journal.count_colors, CANVAS_CODE, range_start, range_end
+        )
+        print(f"count colors:  {colors_time:8.2f} ms")
+        activity, activity_time = measure(
+            journal.get_activity,
+            CANVAS_CODE,
+            range_start,
+            range_end,
+            timedelta(minutes=1),
+        )
+        print(f"activity/min:  {activity_time:8.2f} ms ({len(activity)} intervals)")
+
+        # check the results with the pixels in memory
+        in_range = (time_ms >= to_ms(range_start)) & (time_ms < to_ms(range_end))
+        assert len(records) == np.count_nonzero(in_range)
+        expected = board.copy()
+        for xi, yi, ci in zip(x[in_range], y[in_range], color[in_range]):
+            expected[yi, xi] = ci % 256
+        assert np.array_equal(replayed, expected)
+        assert counts.sum() == len(records) == sum(c for _, c in activity)
+        assert colors[255] == np.count_nonzero(color[in_range] == -1)
+        del records
+
+
+if __name__ == "__main__":
+    main()
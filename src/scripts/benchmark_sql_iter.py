@@ -0,0 +1,128 @@
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from utils.setup import DbConnection, DbStatsManager, stats  # noqa: E402
+
+""" Benchmark of the peak memory used to group the color stats of a whole canvas
+when all the rows are fetched at once (`sql_select`) and when they are streamed in
+batches (`sql_iter`), as rows or as NumPy arrays.
+
+Usage: python benchmark_sql_iter.py [number of records] """
+
+CANVAS_CODE = "1"
+NB_COLORS = 32
+
+
+async def setup_db(db_file, nb_records):
+    db = DbConnection(db_file)
+    db_stats = DbStatsManager(db, stats)
+    await db.sql_update(
+        """CREATE TABLE record(
+            record_id INTEGER PRIMARY KEY,
+            datetime TIMESTAMP UNIQUE,
+            canvas_code TEXT
+        )"""
+    )
+    await db.sql_update(
+        """CREATE TABLE color_stat(
+            record_id INTEGER,
+            color_id INTEGER,
+            amount INTEGER,
+            amount_placed INTEGER,
+            PRIMARY KEY (record_id,color_id)
+        )"""
+    )
+    start = datetime(2022, 1, 1)
+    await db.sql_update_many(
+        "INSERT INTO record(record_id, datetime, canvas_code) VALUES (?, ?, ?)",
+        [
+            (i, start + timedelta(minutes=15 * i), CANVAS_CODE)
+            for i in range(1, nb_records + 1)
+        ],
+    )
+    await db.sql_update_many(
+        "INSERT INTO color_stat VALUES (?, ?, ?, ?)",
+        [
+            (i, c, i * c, i * c // 2)
+            for i in range(1, nb_records + 1)
+            for c in range(NB_COLORS)
+        ],
+    )
+    return db, db_stats
+
+
+def new_data_list():
+    return [dict(values=[], datetimes=[]) for _ in range(NB_COLORS)]
+
+
+async def group_select(db_stats):
+    data = await db_stats.get_canvas_color_stats(CANVAS_CODE)
+    data_list = new_data_list()
+    for value in data:
+        data_list[value["color_id"]]["values"].append(value["amount"])
+        data_list[value["color_id"]]["datetimes"].append(value["datetime"])
+    return data_list
+
+
+async def group_iter_rows(db_stats):
+    data_list = new_data_list()
+    async with db_stats.iter_canvas_color_stats(CANVAS_CODE) as batches:
+        async for batch in batches:
+            for value in batch:
+                data_list[value["color_id"]]["values"].append(value["amount"])
+                data_list[value["color_id"]]["datetimes"].append(value["datetime"])
+    return data_list
+
+
+async def group_iter_arrays(db_stats):
+    data_list = new_data_list()
+    async with db_stats.iter_canvas_color_stats(CANVAS_CODE, as_arrays=True) as batches:
+        async for batch in batches:
+            color_ids = batch["color_id"]
+            for color_id in np.unique(color_ids):
+                mask = color_ids == color_id
+                values = batch["amount"][mask].tolist()
+                data_list[color_id]["values"].extend(values)
+                data_list[color_id]["datetimes"].extend(batch["datetime"][mask].tolist())
+    return data_list
+
+
+async def measure(func, db_stats):
+    tracemalloc.start()
+    start = time.perf_counter()
+    res = await func(db_stats)
+    duration = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return res, duration, peak
+
+
+async def main():
+    nb_records = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db, db_stats = await setup_db(os.path.join(tmp_dir, "bench.db"), nb_records)
+        print(f"{nb_records * NB_COLORS} rows")
+        reference = None
+        for name, func in [
+            ("sql_select", group_select),
+            ("sql_iter (rows)", group_iter_rows),
+            ("sql_iter (arrays)", group_iter_arrays),
+        ]:
+            res, duration, peak = await measure(func, db_stats)
+            if reference is None:
+                reference = res
+            assert res == reference
+            print(f"{name:<20} peak: {peak / 1e6:8.1f} MB   time: {duration:6.2f}s")
+        await db.close_connection()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,96 @@
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from utils.setup import PXLS_URL_API, DbConnection, DbStatsManager  # noqa: E402
+from database.db_migration_manager import DbMigrationManager  # noqa: E402 isort:skip
+from database.migrations import CompactUserStats  # noqa: E402 isort:skip
+from utils.pxls.pxls_stats_manager import PxlsStatsManager  # noqa: E402
+
+""" Script to apply the migration delta-encoding the pxls user stats saved before
+the delta encoding (`CompactUserStats`) without waiting for the bot to apply it:
+the rows of the users whose counts didn't change since the previous record are
+removed, except on the keyframes.
+
+Usage: python compact_user_stats.py [database file]
+
+It prints the database size and the latency of the point-in-time queries
+before and after the compaction. """
+
+RECORDS_PER_STEP = 200
+NB_QUERIES = 20
+
+
+async def get_db_size(db: DbConnection):
+    rows = await db.sql_select(
+        "SELECT page_count * page_size FROM pragma_page_count, pragma_page_size"
+    )
+    return rows[0][0]
+
+
+async def time_queries(db_stats: DbStatsManager):
+    """Get the average time (in ms) of the point-in-time queries."""
+    records = await db_stats.db.sql_select(
+        "SELECT MIN(datetime), MAX(datetime) FROM record"
+    )
+    first_dt = datetime.strptime(records[0][0], "%Y-%m-%d %H:%M:%S")
+    last_dt = datetime.strptime(records[0][1], "%Y-%m-%d %H:%M:%S")
+    top_user = (await db_stats.get_last_leaderboard())[0]["name"]
+    dts = [
+        first_dt + (last_dt - first_dt) * (i + 1) / (NB_QUERIES + 1)
+        for i in range(NB_QUERIES)
+    ]
+    queries = {
+        "get_last_leaderboard": lambda dt: db_stats.get_last_leaderboard(),
+        "get_leaderboard_between": lambda dt: db_stats.get_leaderboard_between(
+            dt, last_dt, False, "speed"
+        ),
+        "get_pixels_at": lambda dt: db_stats.get_pixels_at(dt, top_user),
+    }
+    res = {}
+    for name, query in queries.items():
+        start = time.perf_counter()
+        for dt in dts:
+            await query(dt)
+        res[name] = (time.perf_counter() - start) / NB_QUERIES * 1000
+    return res
+
+
+def print_progress(migration, done, total):
+    print(f"\r{done}/{total} records", end="")
+
+
+async def main():
+    db_file = sys.argv[1] if len(sys.argv) > 1 else None
+    db = DbConnection(db_file) if db_file else DbConnection()
+    db_stats = DbStatsManager(db, PxlsStatsManager(db, PXLS_URL_API))
+    db_migrations = DbMigrationManager(db, chunk_size=RECORDS_PER_STEP)
+    # create the keyframes table and index
+    await db_stats.create_tables()
+    await db_migrations.migrate()
+
+    size_before = await get_db_size(db)
+    latency_before = await time_queries(db_stats)
+
+    start = time.perf_counter()
+    await db_migrations.apply(CompactUserStats(), on_progress=print_progress)
+    print(f"\ncompacted in {time.perf_counter() - start:.1f}s, running VACUUM...")
+    async with db.writer() as conn:
+        await conn.execute("VACUUM")
+
+    size_after = await get_db_size(db)
+    latency_after = await time_queries(db_stats)
+
+    print(f"\ndatabase size: {size_before / 1e6:.1f} MB -> {size_after / 1e6:.1f} MB")
+    for name in latency_before.keys():
+        print(
+            f"{name:<25} {latency_before[name]:8.2f} ms -> {latency_after[name]:8.2f} ms"
+        )
+    await db.close_connection()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -6,13 +6,13 @@ import sys
 import tarfile
 import time
 
-import aiohttp
 from bs4 import BeautifulSoup
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 
 from utils.setup import PXLS_URL, DbCanvasManager, DbConnection  # noqa: E402
+from utils.http_client import http_client  # noqa: E402
 from utils.utils import get_content  # noqa: E402
 
 basepath = os.path.dirname(__file__)
@@ -67,10 +67,8 @@ async def main():
         filename = log["filename"]
         if canvas_code not in canvases_with_logs:
             # get file size
-            session = aiohttp.ClientSession()
-            d = await session.head(logs_url)
-            await session.close()
-            size = d.content_length
+            async with http_client.session.head(logs_url) as d:
+                size = d.content_length
 
             # get disk free space
             total, used, free = shutil.disk_usage("/")
@@ -112,6 +110,7 @@ async def main():
                     print("done!")
             else:
                 print("Cancelled")
+    await http_client.close()
     print("Done in", round(time.time() - start, 2), "seconds")
     return None
 
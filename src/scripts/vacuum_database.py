@@ -0,0 +1,50 @@
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from utils.setup import DbConnection  # noqa: E402
+
+""" Script to switch an existing database to incremental auto-vacuum so the
+retention policy can release the free pages a few at a time.
+
+The mode is applied by a full VACUUM: it rewrites the whole database (the disk
+needs twice its size free) and blocks all the writes, so the bot should be
+stopped while it runs. The databases created by the bot already use it.
+
+Usage: python vacuum_database.py [database file] """
+
+
+async def get_db_size(db: DbConnection):
+    rows = await db.sql_select(
+        "SELECT page_count * page_size FROM pragma_page_count, pragma_page_size"
+    )
+    return rows[0][0]
+
+
+async def main():
+    db_file = sys.argv[1] if len(sys.argv) > 1 else None
+    db = DbConnection(db_file) if db_file else DbConnection()
+    await db.create_connection()
+    size_before = await get_db_size(db)
+
+    start = time.perf_counter()
+    async with db.writer() as conn, conn.cursor() as cur:
+        await cur.execute("PRAGMA auto_vacuum")
+        # 2 = incremental
+        if (await cur.fetchone())[0] == 2:
+            print("The database already uses incremental auto-vacuum.")
+        else:
+            print("running VACUUM...")
+            await cur.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            await cur.execute("VACUUM")
+            print(f"done in {time.perf_counter() - start:.1f}s")
+
+    size_after = await get_db_size(db)
+    print(f"database size: {size_before / 1e6:.1f} MB -> {size_after / 1e6:.1f} MB")
+    await db.close_connection()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,137 @@
+import asyncio
+import os
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from database.db_connection import DbConnection
+from database.db_rollup_manager import GRANULARITIES
+from database.db_stats_manager import DbStatsManager
+from database.db_user_manager import DbUserManager
+
+# the utils package creates the bot objects with the settings of the .env
+os.environ.setdefault("PXLS_URL_API", "https://pxls.space")
+
+# names of the users in the generated stats
+USERS = list("abcdefghij")
+
+
+@pytest.fixture
+def run():
+    """Run a coroutine in the event loop of the test (the database connections
+    must stay in the same loop)."""
+    loop = asyncio.new_event_loop()
+    yield loop.run_until_complete
+    loop.close()
+
+
+@pytest.fixture
+def make_db(run, tmp_path):
+    """Get a function creating a database in the test directory."""
+    connections = []
+
+    def make_db(name="database.db"):
+        db = DbConnection(str(tmp_path / name))
+        connections.append(db)
+        return db
+
+    yield make_db
+    for db in connections:
+        run(db.close_connection())
+
+
+@pytest.fixture
+def db(make_db):
+    return make_db()
+
+
+@pytest.fixture
+def make_stats(run, make_db):
+    """Get a function creating a database with the tables of the pxls stats and
+    its `DbStatsManager`."""
+
+    def make_stats(name="database.db"):
+        db = make_db(name)
+        stats = DbStatsManager(db, None)
+        run(DbUserManager(db).create_tables())
+        run(stats.create_tables())
+        return stats
+
+    return make_stats
+
+
+@pytest.fixture
+def stats(make_stats):
+    return make_stats()
+
+
+@pytest.fixture
+def add_records(stats):
+    """Get a function saving random pxls stats: the users join and leave the
+    stats and place pixels between the records."""
+
+    async def add_records(
+        nb_records,
+        canvases=("1",),
+        roll_up=True,
+        seed=0,
+        step=timedelta(minutes=25),
+        stats=stats,
+    ):
+        rnd = random.Random(seed)
+        alltime_counts = {name: rnd.randint(0, 5000) for name in USERS}
+        canvas_counts = dict.fromkeys(USERS, 0)
+        present = {name: rnd.random() < 0.7 for name in USERS}
+        dt = datetime(2024, 1, 1)
+        for i in range(nb_records):
+            canvas_code = canvases[i * len(canvases) // nb_records]
+            if i and canvas_code != canvases[(i - 1) * len(canvases) // nb_records]:
+                canvas_counts = dict.fromkeys(USERS, 0)
+            for name in USERS:
+                if rnd.random() < 0.08:
+                    present[name] = not present[name]
+                if present[name] and rnd.random() < 0.5:
+                    placed = rnd.randint(1, 50)
+                    alltime_counts[name] += placed
+                    canvas_counts[name] += placed
+            record_id = await stats.create_record(dt, canvas_code)
+            await stats.update_all_pxls_stats(
+                [dict(username=n, pixels=alltime_counts[n]) for n in USERS if present[n]],
+                [dict(username=n, pixels=canvas_counts[n]) for n in USERS if present[n]],
+                record_id,
+            )
+            if roll_up:
+                await stats.rollups.update_user_stats()
+            dt += step
+
+    return add_records
+
+
+async def get_grouped_stats(stats, granularity, canvas_code=None):
+    """Get the grouped stats of all the records from the rollups and from the
+    raw stats as sets of (name, period, pixels)."""
+    format = GRANULARITIES[granularity]
+    record1 = await stats.find_record(datetime(2000, 1, 1), canvas_code)
+    record2 = await stats.find_record(datetime(2100, 1, 1), canvas_code)
+    rollup_rows = await stats.rollups.get_grouped_user_stats(
+        USERS, record1, record2, granularity, canvas_code
+    )
+    assert rollup_rows is not None, "the rollups should cover all the records"
+    raw_rows = await stats._get_grouped_stats_history(
+        USERS, record1, record2, format, canvas_code
+    )
+
+    def to_set(rows):
+        return {
+            (
+                row["name"],
+                datetime.strptime(row["last_datetime"], "%Y-%m-%d %H:%M:%S").strftime(
+                    format
+                ),
+                row["pixels"],
+            )
+            for row in rows
+        }
+
+    return to_set(rollup_rows), to_set(raw_rows)
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from utils.pxls.pxls_stats_manager import PALETTE_LUT_CACHE_SIZE, PxlsStatsManager
+
+PALETTE = ["#000000", "#FF0000", "#00FF00", "#0000FF80"]
+
+
+@pytest.fixture
+def stats():
+    stats = PxlsStatsManager(None, "https://pxls.space")
+    stats.board_info = {"width": 4, "height": 3}
+    stats.palette = [{"value": color[1:]} for color in PALETTE]
+    return stats
+
+
+def test_decode_board(stats):
+    board_bytes = bytes([0, 1, 2, 3, 255, 1, 1, 0, 2, 255, 3, 3])
+    board = stats.decode_board(board_bytes)
+    assert board.shape == (3, 4)
+    assert board.dtype == np.uint8
+    assert board.tolist() == [[0, 1, 2, 3], [255, 1, 1, 0], [2, 255, 3, 3]]
+    assert not board.flags.writeable
+    with pytest.raises(ValueError):
+        stats.decode_board(board_bytes[:-1])
+
+
+def test_swap_board_gives_a_new_writable_array(stats):
+    board_bytes = bytes(range(12))
+    first = stats._swap_board("board_array", board_bytes)
+    version = stats.board_version
+    second = stats._swap_board("board_array", board_bytes)
+    assert stats.board_array is second
+    assert second is not first and not np.shares_memory(first, second)
+    assert second.flags.writeable
+    assert first.tolist() == np.arange(12).reshape(3, 4).tolist()
+    assert stats.board_version == version + 1
+
+
+def test_palette_lut(stats):
+    lut = stats.get_palette_lut()
+    assert lut.shape == (256, 4)
+    assert lut.dtype == np.uint8
+    assert not lut.flags.writeable
+    assert lut[:4].tolist() == [
+        [0, 0, 0, 255],
+        [255, 0, 0, 255],
+        [0, 255, 0, 255],
+        [0, 0, 255, 128],
+    ]
+    # the indexes outside of the palette (255 included) are transparent
+    assert not lut[4:].any()
+    # the tables are cached
+    assert stats.get_palette_lut() is lut
+    assert stats.get_palette_lut(PALETTE[:2]) is not lut
+
+
+def test_palette_lut_cache_size(stats):
+    for i in range(PALETTE_LUT_CACHE_SIZE + 1):
+        stats.get_palette_lut([f"#{i:06x}"])
+    assert len(stats._palette_luts) == PALETTE_LUT_CACHE_SIZE
+
+
+def test_palettize_array(stats):
+    board = stats.decode_board(bytes([0, 1, 2, 3, 255, 1, 1, 0, 2, 255, 3, 3]))
+    image = stats.palettize_array(board)
+    assert image.shape == (3, 4, 4)
+    assert image[0, 1].tolist() == [255, 0, 0, 255]
+    assert image[1, 0].tolist() == [0, 0, 0, 0]
+    assert image[2, 3].tolist() == [0, 0, 255, 128]
+    # same result as looking up each pixel
+    expected = [[stats.get_palette_lut()[i] for i in row] for row in board]
+    assert np.array_equal(image, expected)
+    # with another palette
+    image = stats.palettize_array(board, ["#FFFFFF"])
+    assert image[0, 0].tolist() == [255, 255, 255, 255]
+    assert image[0, 1].tolist() == [0, 0, 0, 0]
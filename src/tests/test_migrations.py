@@ -0,0 +1,105 @@
+from datetime import datetime
+
+import pytest
+
+import database.db_stats_manager
+from database.db_canvas_manager import DbCanvasManager
+from database.db_migration_manager import DbMigrationManager
+from database.db_retention_manager import DbRetentionManager
+from database.db_servers_manager import DbServersManager
+from database.db_stats_manager import KEYFRAME_INTERVAL, DbStatsManager
+from database.db_template_manager import DbTemplateManager
+from database.db_user_manager import DbUserManager
+from database.migrations import MIGRATIONS, Migration
+from tests.conftest import USERS, get_grouped_stats
+
+
+async def create_tables(db):
+    """Create the tables like the bot does when it starts."""
+    for manager in (
+        DbServersManager(db, ">"),
+        DbUserManager(db),
+        DbStatsManager(db, None),
+        DbTemplateManager(db),
+        DbCanvasManager(db),
+        DbRetentionManager(db),
+    ):
+        await manager.create_tables()
+
+
+async def apply_all(db):
+    migrations = DbMigrationManager(db, chunk_size=7, pause=0)
+    await migrations.migrate()
+    await migrations.run_background()
+    return migrations
+
+
+def test_migration_versions():
+    versions = [migration.version for migration in MIGRATIONS]
+    assert versions == sorted(set(versions))
+    with pytest.raises(TypeError):
+        Migration()
+
+
+def test_migrations_on_a_new_database(run, db):
+    run(create_tables(db))
+    migrations = run(apply_all(db))
+    assert run(migrations.get_version()) == MIGRATIONS[-1].version
+    assert all(progress["applied_at"] for progress in run(migrations.get_progress()))
+    # the migrations applied aren't run again
+    applied = run(db.sql_select("SELECT version, applied_at FROM schema_migration"))
+    run(apply_all(db))
+    assert run(db.sql_select("SELECT version, applied_at FROM schema_migration")) == (
+        applied
+    )
+
+
+def test_migrations_on_an_existing_database(run, make_db, add_records, monkeypatch):
+    db = make_db("existing.db")
+    # the rollups table of the previous version
+    run(
+        db.sql_update(
+            """
+            CREATE TABLE pxls_user_stat_rollup(
+                granularity TEXT,
+                pxls_name_id INTEGER,
+                period TEXT,
+                canvas_code TEXT,
+                first_datetime TIMESTAMP,
+                last_datetime TIMESTAMP,
+                alltime_count INTEGER,
+                canvas_count INTEGER,
+                PRIMARY KEY (granularity, pxls_name_id, period, canvas_code)
+            );"""
+        )
+    )
+    run(create_tables(db))
+    stats = DbStatsManager(db, None)
+    # the stats saved before the delta encoding: every user is saved at every
+    # record and the users who left have no row
+    monkeypatch.setattr(database.db_stats_manager, "KEYFRAME_INTERVAL", 1)
+    run(add_records(200, canvases=("1", "2"), roll_up=False, stats=stats))
+    run(
+        db.sql_update(
+            """
+            DELETE FROM pxls_user_stat
+            WHERE alltime_count IS NULL AND canvas_count IS NULL"""
+        )
+    )
+    monkeypatch.setattr(database.db_stats_manager, "KEYFRAME_INTERVAL", KEYFRAME_INTERVAL)
+    nb_rows = run(db.sql_select("SELECT COUNT(*) FROM pxls_user_stat"))[0][0]
+    dt1, dt2 = datetime(2024, 1, 1), datetime(2024, 1, 5)
+    history = run(stats.get_stats_history(USERS, dt1, dt2, False))
+
+    migrations = run(apply_all(db))
+    assert run(migrations.get_version()) == MIGRATIONS[-1].version
+    # the stats are delta-encoded, the values read are the same
+    assert run(db.sql_select("SELECT COUNT(*) FROM pxls_user_stat"))[0][0] < nb_rows
+    new_history = run(stats.get_stats_history(USERS, dt1, dt2, False))
+    assert [[tuple(row) for row in rows] for _, rows in new_history[2]] == [
+        [tuple(row) for row in rows] for _, rows in history[2]
+    ]
+    # the rollups are rebuilt
+    for granularity in ("hour", "day"):
+        rollup_stats, raw_stats = run(get_grouped_stats(stats, granularity))
+        assert rollup_stats == raw_stats
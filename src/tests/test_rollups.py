@@ -0,0 +1,80 @@
+import pytest
+
+import database.db_stats_manager
+from database.db_migration_manager import DbMigrationManager
+from database.db_stats_manager import KEYFRAME_INTERVAL
+from database.migrations import AddKeyframeLeaveRows
+from tests.conftest import get_grouped_stats
+
+
+@pytest.mark.parametrize("granularity", ["hour", "day", "week"])
+@pytest.mark.parametrize("canvas_code", [None, "2"])
+@pytest.mark.parametrize("roll_up", ["update", "backfill"])
+@pytest.mark.parametrize("keyframe_interval", [1, KEYFRAME_INTERVAL, 10**9])
+def test_rollups_match_raw_stats(
+    run,
+    stats,
+    add_records,
+    monkeypatch,
+    granularity,
+    canvas_code,
+    roll_up,
+    keyframe_interval,
+):
+    monkeypatch.setattr(database.db_stats_manager, "KEYFRAME_INTERVAL", keyframe_interval)
+    run(add_records(300, canvases=("1", "2"), roll_up=roll_up == "update"))
+    if roll_up == "backfill":
+        while run(stats.rollups.backfill("pxls_user_stat", chunk_size=7)):
+            pass
+
+    rollup_stats, raw_stats = run(get_grouped_stats(stats, granularity, canvas_code))
+    assert rollup_stats == raw_stats
+
+
+def test_rollups_keep_the_counts_of_a_user_who_left(run, stats, add_records):
+    run(add_records(300))
+    # a user with counts in an hour that left the stats before its end
+    rows = run(
+        stats.db.sql_select(
+            """
+            SELECT name, strftime('%Y-%m-%d %H', datetime) AS period
+            FROM pxls_user_stat
+            JOIN record ON record.record_id = pxls_user_stat.record_id
+            JOIN pxls_name ON pxls_name.pxls_name_id = pxls_user_stat.pxls_name_id
+            GROUP BY name, period
+            HAVING COUNT(alltime_count) > 0 AND MAX(datetime) = MAX(
+                CASE WHEN alltime_count IS NULL THEN datetime END
+            )"""
+        )
+    )
+    assert rows
+    rollup_stats, _ = run(get_grouped_stats(stats, "hour"))
+    rollup_periods = {(name, period) for name, period, _ in rollup_stats}
+    for row in rows:
+        assert (row["name"], row["period"]) in rollup_periods
+
+
+def test_keyframe_leave_rows_migration(run, stats, add_records):
+    run(add_records(300, canvases=("1", "2")))
+    # remove the rows of the users who left on the keyframes, as they were saved
+    # before, and roll up the stats again
+    run(
+        stats.db.sql_update(
+            """
+            DELETE FROM pxls_user_stat
+            WHERE record_id IN (SELECT record_id FROM pxls_user_stat_keyframe)
+                AND alltime_count IS NULL AND canvas_count IS NULL"""
+        )
+    )
+    run(stats.db.sql_update("DELETE FROM pxls_user_stat_rollup"))
+    run(stats.db.sql_update("DELETE FROM rollup_state"))
+    while run(stats.rollups.backfill("pxls_user_stat")):
+        pass
+    rollup_stats, raw_stats = run(get_grouped_stats(stats, "hour"))
+    assert rollup_stats != raw_stats
+
+    migrations = DbMigrationManager(stats.db, chunk_size=2)
+    run(migrations.create_tables())
+    assert run(migrations.apply(AddKeyframeLeaveRows()))
+    rollup_stats, raw_stats = run(get_grouped_stats(stats, "hour"))
+    assert rollup_stats == raw_stats
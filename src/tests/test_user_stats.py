@@ -0,0 +1,66 @@
+import sqlite3
+from datetime import datetime
+
+import database.db_stats_manager
+from database.db_stats_manager import KEYFRAME_INTERVAL, user_stats_at_record_sql
+from tests.conftest import USERS
+
+
+async def get_counts_per_record(stats):
+    """Get the counts of the users in the stats at each record:
+    {record_id: {pxls_name_id: (alltime_count, canvas_count)}}."""
+    records = await stats.db.sql_select("SELECT record_id FROM record")
+    res = {}
+    for record in records:
+        rows = await stats.db.sql_select(
+            "SELECT * FROM {}".format(user_stats_at_record_sql(record["record_id"]))
+        )
+        res[record["record_id"]] = {
+            row["pxls_name_id"]: (row["alltime_count"], row["canvas_count"])
+            for row in rows
+        }
+    return res
+
+
+def to_tuples(value):
+    """Convert the rows in a result to tuples to compare them."""
+    if isinstance(value, sqlite3.Row):
+        return tuple(value)
+    if isinstance(value, (list, tuple)):
+        return tuple(to_tuples(v) for v in value)
+    return value
+
+
+def test_delta_encoded_stats_match_full_stats(run, make_stats, add_records, monkeypatch):
+    full_stats = make_stats("full.db")
+    monkeypatch.setattr(database.db_stats_manager, "KEYFRAME_INTERVAL", 1)
+    run(add_records(200, canvases=("1", "2"), stats=full_stats))
+    delta_stats = make_stats("delta.db")
+    monkeypatch.setattr(database.db_stats_manager, "KEYFRAME_INTERVAL", KEYFRAME_INTERVAL)
+    run(add_records(200, canvases=("1", "2"), stats=delta_stats))
+
+    def count_rows(stats):
+        rows = run(
+            stats.db.sql_select(
+                """
+                SELECT COUNT(*) FROM pxls_user_stat
+                WHERE alltime_count IS NOT NULL OR canvas_count IS NOT NULL"""
+            )
+        )
+        return rows[0][0]
+
+    assert count_rows(delta_stats) < count_rows(full_stats)
+    assert run(get_counts_per_record(delta_stats)) == run(
+        get_counts_per_record(full_stats)
+    )
+
+    # the stats read by the commands
+    dt1, dt2 = datetime(2024, 1, 1), datetime(2024, 1, 5)
+    for args in (
+        ("get_stats_history", USERS, dt1, dt2, False),
+        ("get_grouped_stats_history", USERS, dt1, dt2, "hour", False),
+        ("get_grouped_stats_history", USERS, dt1, dt2, "day", False),
+    ):
+        full = run(getattr(full_stats, args[0])(*args[1:]))
+        delta = run(getattr(delta_stats, args[0])(*args[1:]))
+        assert full[-1] and to_tuples(full) == to_tuples(delta)
@@ -0,0 +1,102 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+
+@pytest.fixture
+def table(run, db):
+    run(db.sql_update("CREATE TABLE item(id INTEGER PRIMARY KEY, name TEXT UNIQUE)"))
+    return "item"
+
+
+def test_queued_writes_are_batched(run, db, table):
+    async def insert_all():
+        return await asyncio.gather(
+            *[
+                db.sql_insert("INSERT INTO item(name) VALUES (?)", f"item{i}")
+                for i in range(50)
+            ]
+        )
+
+    transactions = db.write_queue.nb_transactions
+    row_ids = run(insert_all())
+    assert row_ids == list(range(1, 51))
+    # the writes queued together are committed in fewer transactions
+    assert db.write_queue.nb_transactions - transactions < 50
+    assert run(db.sql_select("SELECT COUNT(*) FROM item"))[0][0] == 50
+
+
+def test_failed_write_only_rolls_back_itself(run, db, table):
+    async def insert_all():
+        return await asyncio.gather(
+            db.sql_insert("INSERT INTO item(name) VALUES ('a')"),
+            db.sql_insert("INSERT INTO item(name) VALUES ('a')"),
+            db.sql_insert("INSERT INTO item(name) VALUES ('b')"),
+            return_exceptions=True,
+        )
+
+    first, duplicate, last = run(insert_all())
+    assert isinstance(duplicate, sqlite3.IntegrityError)
+    assert not isinstance(first, Exception) and not isinstance(last, Exception)
+    names = run(db.sql_select("SELECT name FROM item ORDER BY name"))
+    assert [row["name"] for row in names] == ["a", "b"]
+
+
+def test_update_many_is_atomic(run, db, table):
+    with pytest.raises(sqlite3.IntegrityError):
+        run(
+            db.sql_update_many(
+                "INSERT INTO item(name) VALUES (?)", [("a",), ("b",), ("a",)]
+            )
+        )
+    assert run(db.sql_select("SELECT COUNT(*) FROM item"))[0][0] == 0
+
+
+def test_writer_transaction_left_open_is_rolled_back(run, db, table):
+    async def fail_in_transaction():
+        async with db.writer() as conn, conn.cursor() as cur:
+            await cur.execute("BEGIN TRANSACTION;")
+            await cur.execute("INSERT INTO item(name) VALUES ('a')")
+            raise RuntimeError
+
+    with pytest.raises(RuntimeError):
+        run(fail_in_transaction())
+    # the next writes aren't part of the transaction
+    run(db.sql_insert("INSERT INTO item(name) VALUES ('b')"))
+    names = run(db.sql_select("SELECT name FROM item"))
+    assert [row["name"] for row in names] == ["b"]
+
+
+def test_writer_waits_for_the_queued_writes(run, db, table):
+    async def write_then_read_in_writer():
+        inserts = [
+            asyncio.ensure_future(
+                db.sql_insert("INSERT INTO item(name) VALUES (?)", f"item{i}")
+            )
+            for i in range(10)
+        ]
+        await asyncio.sleep(0)
+        async with db.writer() as conn, conn.cursor() as cur:
+            await cur.execute("SELECT COUNT(*) FROM item")
+            count = (await cur.fetchone())[0]
+        await asyncio.gather(*inserts)
+        return count
+
+    assert run(write_then_read_in_writer()) == 10
+
+
+def test_sql_iter_releases_the_reader(run, db, table):
+    run(
+        db.sql_update_many(
+            "INSERT INTO item(name) VALUES (?)", [(f"item{i}",) for i in range(100)]
+        )
+    )
+
+    async def read_first_batch():
+        async with db.sql_iter("SELECT * FROM item", batch_size=10) as batches:
+            async for batch in batches:
+                return batch
+
+    assert len(run(read_first_batch())) == 10
+    assert db._readers_queue.qsize() == db.nb_readers
@@ -0,0 +1,158 @@
+import asyncio
+import time
+
+import disnake
+
+from utils.log import get_logger
+
+logger = get_logger(__name__)
+
+# max number of command usages waiting to be saved, the new ones are dropped
+# when the queue is full
+MAX_QUEUE_SIZE = 1000
+# number of command usages saved in a single transaction
+BATCH_SIZE = 50
+# max time (in seconds) a command usage waits before being saved
+FLUSH_INTERVAL = 5
+# discord limits for the embeds of a single message
+MAX_EMBEDS_PER_MESSAGE = 10
+MAX_EMBEDS_LENGTH = 6000
+
+
+class CommandUsageLogger:
+    """Save the command usages in the database and send them in the log channel
+    in the background, so the commands don't wait for it.
+
+    The usages are queued with `log()` and written in batches by a task started
+    with `start()` when `batch_size` usages are queued or after `flush_interval`
+    seconds. `close()` stops the task and flushes what's left in the queue."""
+
+    def __init__(
+        self,
+        db_servers,
+        log_channel_id=None,
+        batch_size: int = BATCH_SIZE,
+        flush_interval: float = FLUSH_INTERVAL,
+        max_queue_size: int = MAX_QUEUE_SIZE,
+    ) -> None:
+        self.db_servers = db_servers
+        self.log_channel_id = int(log_channel_id) if log_channel_id else None
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue_size = max_queue_size
+
+        self.bot = None
+        self.log_channel = None
+        self.nb_dropped = 0
+        self._queue: asyncio.Queue = None
+        # the usages taken from the queue and not saved yet
+        self._batch = []
+        self._flush_lock: asyncio.Lock = None
+        self._task: asyncio.Task = None
+
+    def start(self, bot):
+        """Start the background task writing the usages (if it isn't running)."""
+        self.bot = bot
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def log(self, usage: tuple, embed: disnake.Embed = None):
+        """Queue a command usage.
+
+        Parameters
+        ----------
+        usage: The values of a row of the `command_usage` table.
+        embed: The embed to send in the log channel."""
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        try:
+            self._queue.put_nowait((usage, embed))
+        except asyncio.QueueFull:
+            self.nb_dropped += 1
+            logger.warning(
+                f"Command usage queue full, usage dropped ({self.nb_dropped} total)."
+            )
+
+    async def _run(self):
+        while True:
+            self._batch.append(await self._queue.get())
+            deadline = time.monotonic() + self.flush_interval
+            while len(self._batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    self._batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # the task can't be cancelled by close() while flushing
+            async with self._flush_lock:
+                batch, self._batch = self._batch, []
+                try:
+                    await self._flush(batch)
+                except Exception:
+                    logger.exception("Failed to save the command usages:")
+
+    async def _flush(self, batch):
+        await self.db_servers.create_command_usages([usage for usage, _ in batch])
+
+        embeds = [embed for _, embed in batch if embed is not None]
+        if not embeds:
+            return
+        log_channel = await self._get_log_channel()
+        if log_channel is None:
+            return
+        # group the embeds in as few messages as possible
+        message_embeds = []
+        message_length = 0
+        for embed in embeds:
+            if message_embeds and (
+                len(message_embeds) >= MAX_EMBEDS_PER_MESSAGE
+                or message_length + len(embed) > MAX_EMBEDS_LENGTH
+            ):
+                await log_channel.send(embeds=message_embeds)
+                message_embeds = []
+                message_length = 0
+            message_embeds.append(embed)
+            message_length += len(embed)
+        await log_channel.send(embeds=message_embeds)
+
+    async def _get_log_channel(self):
+        """Get the log channel, it is only fetched once."""
+        if self.log_channel is None and self.log_channel_id and self.bot:
+            self.log_channel = self.bot.get_channel(self.log_channel_id)
+            if self.log_channel is None:
+                try:
+                    self.log_channel = await self.bot.fetch_channel(self.log_channel_id)
+                except Exception:
+                    # don't try again on every batch
+                    logger.warning(
+                        f"Could not fetch the command log channel {self.log_channel_id}."
+                    )
+                    self.log_channel_id = None
+        return self.log_channel
+
+    async def close(self):
+        """Stop the background task and save the usages left in the queue."""
+        if self._task is not None:
+            async with self._flush_lock:
+                self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._queue is None:
+            return
+        batch, self._batch = self._batch, []
+        while not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        for i in range(0, len(batch), self.batch_size):
+            try:
+                await self._flush(batch[i : i + self.batch_size])
+            except Exception:
+                logger.exception("Failed to save the command usages:")
@@ -308,6 +308,15 @@ def image_to_file(
         return image
 
 
+def png_to_file(png: bytes, filename: str, embed: disnake.Embed = None) -> disnake.File:
+    """Convert the bytes of a PNG image to a discord File
+    attach the file to a discord embed if one is given"""
+    file = disnake.File(BytesIO(png), filename=filename)
+    if embed:
+        embed.set_image(url=f"attachment://{filename}")
+    return file
+
+
 async def number_emoji(ctx):
     emojis = await ctx.guild.fetch_emojis()
     nb_static = 0
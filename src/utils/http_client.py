@@ -0,0 +1,119 @@
+import asyncio
+
+import aiohttp
+from aiohttp.client_exceptions import ClientConnectionError, InvalidURL
+
+HEADERS = {
+    "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36"
+}
+# max number of connections open at the same time (all hosts)
+MAX_CONNECTIONS = 64
+# max number of connections open at the same time with the same host
+MAX_CONNECTIONS_PER_HOST = 8
+# time (in seconds) the resolved DNS and the idle connections are kept
+DNS_CACHE_TTL = 300
+KEEPALIVE_TIMEOUT = 30
+# max size (in bytes) of the images downloaded
+IMAGE_SIZE_LIMIT = 25 * 2**20  # 25 MB
+
+
+class BadResponseError(Exception):
+    """Raised when response code isn't 200."""
+
+
+class HttpClient:
+    """The HTTP client shared by all the outbound requests of the bot.
+
+    It keeps a single session with a pool of connections reused between the
+    requests (keep-alive), a cache of the resolved DNS and a limit of
+    connections per host. The session is opened with `start()` and must be
+    closed with `close()`."""
+
+    def __init__(self) -> None:
+        self._session: aiohttp.ClientSession = None
+
+    def start(self) -> aiohttp.ClientSession:
+        """Open the session if it isn't already open."""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=MAX_CONNECTIONS,
+                limit_per_host=MAX_CONNECTIONS_PER_HOST,
+                ttl_dns_cache=DNS_CACHE_TTL,
+                keepalive_timeout=KEEPALIVE_TIMEOUT,
+            )
+            # set a timeout of 10 seconds
+            timeout = aiohttp.ClientTimeout(sock_connect=10.0, sock_read=10.0)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=timeout,
+                headers=HEADERS,
+                # don't share the cookies of a response with the next requests
+                cookie_jar=aiohttp.DummyCookieJar(),
+            )
+        return self._session
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        return self.start()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def get(
+        self,
+        url: str,
+        content_type: str,
+        headers: dict = None,
+        cookies: dict = None,
+        max_size: int = None,
+    ):
+        """Send a GET request to the url and return the response as json, bytes
+        or image bytes (`content_type` "json", "bytes" or "image").
+
+        The images bigger than `IMAGE_SIZE_LIMIT` (or `max_size` for the bytes)
+        aren't downloaded. Raise BadResponseError or ValueError."""
+        if max_size is None and content_type == "image":
+            max_size = IMAGE_SIZE_LIMIT
+        try:
+            async with self.session.get(url, headers=headers, cookies=cookies) as r:
+                if r.status != 200:
+                    raise BadResponseError(f"The URL leads to an error {r.status}")
+                if content_type == "image" and "image" not in r.headers.get(
+                    "content-type", ""
+                ):
+                    raise ValueError("The URL doesn't contain any image.")
+                if content_type == "json":
+                    return await r.json()
+                if max_size is not None:
+                    return await self._read_limited(r, max_size)
+                return await r.read()
+        except InvalidURL:
+            raise ValueError("The URL provided is invalid.")
+        except asyncio.TimeoutError:
+            raise ValueError("Couldn't connect to URL. (Timeout)")
+        except ClientConnectionError:
+            raise ValueError("Couldn't connect to URL.")
+
+    @staticmethod
+    async def _read_limited(response: aiohttp.ClientResponse, max_size: int) -> bytes:
+        """Read the response body, stop as soon as it's bigger than `max_size`."""
+        too_big = ValueError(
+            f"The file is too big (max size: {max_size / 2**20:.0f} MB)."
+        )
+        if response.content_length is not None and response.content_length > max_size:
+            raise too_big
+        chunks = []
+        size = 0
+        async for data in response.content.iter_chunked(2**16):
+            size += len(data)
+            if size > max_size:
+                raise too_big
+            chunks.append(data)
+        return b"".join(chunks)
+
+
+# the client used by the whole bot
+http_client = HttpClient()
@@ -2,10 +2,10 @@ import json
 import os
 from io import BytesIO
 
-import aiohttp
 from dotenv import find_dotenv, load_dotenv, set_key
 from PIL import Image
 
+from utils.http_client import http_client
 from utils.log import get_logger
 from utils.utils import BadResponseError, in_executor
 
@@ -49,7 +49,9 @@ class Imgur:
             headers = {"Authorization": f"Client-ID {self.client_id}"}
         else:
             headers = headers = {"Authorization": f"Bearer {self.access_token}"}
-        async with aiohttp.request(method.lower(), url, headers=headers, data=data) as r:
+        async with http_client.session.request(
+            method, url, headers=headers, data=data
+        ) as r:
 
             if r.status == 403 and check_token:
                 # refresh the access token
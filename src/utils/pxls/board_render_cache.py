@@ -0,0 +1,151 @@
+from collections import OrderedDict
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from utils.pxls.pxls_stats_manager import PxlsStatsManager
+from utils.utils import in_executor
+
+# max size (in bytes) of the arrays and images kept in the cache
+RENDER_CACHE_SIZE = 200 * 1024 * 1024
+
+
+@in_executor()
+def _encode_png(array: np.ndarray) -> bytes:
+    with BytesIO() as image_binary:
+        Image.fromarray(array).save(image_binary, "PNG")
+        return image_binary.getvalue()
+
+
+def crop_array(array: np.ndarray, crop: tuple) -> np.ndarray:
+    """Crop an array of palette indexes to the (x, y, width, height) area,
+    the pixels outside of the array are transparent (255)."""
+    x, y, width, height = crop
+    y0 = min(max(0, y), array.shape[0])
+    y1 = max(0, min(array.shape[0], y + height))
+    x0 = min(max(0, x), array.shape[1])
+    x1 = max(0, min(array.shape[1], x + width))
+    cropped_array = np.full((height, width), 255, dtype=np.uint8)
+    cropped_array[y0 - y : y1 - y, x0 - x : x1 - x] = array[y0:y1, x0:x1]
+    return cropped_array
+
+
+class _Render:
+    def __init__(self, array: np.ndarray) -> None:
+        self.array = array
+        self.png: bytes = None
+
+    @property
+    def size(self) -> int:
+        return self.array.nbytes + (len(self.png) if self.png else 0)
+
+
+class BoardRenderCache:
+    """A cache of the RGBA renders of the current boards and their PNG images.
+
+    The renders are keyed by (view, board version, crop) so they are reused
+    until the boards change (see `PxlsStatsManager.board_version`), the renders
+    of an area without changed tiles are kept for the new version
+    (see `PxlsStatsManager.dirty_tiles`). The least recently used renders are
+    removed when the cache is bigger than `max_size` bytes.
+
+    The views are:
+    - "current": the current board
+    - "placeable": the current board with only the placeable pixels
+    - "nonvirgin": the placeable board without the virgin pixels
+    - "virginmap": the virgin pixels in green and the others in black"""
+
+    VIEWS = ("current", "placeable", "nonvirgin", "virginmap")
+
+    def __init__(self, stats: PxlsStatsManager, max_size: int = RENDER_CACHE_SIZE):
+        self.stats = stats
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._renders = OrderedDict()
+
+    async def _render(self, view: str, crop: tuple = None) -> np.ndarray:
+        """Make the RGBA array of a view."""
+        palette = None
+        if view == "current":
+            array = self.stats.board_array
+        elif view == "placeable":
+            array = await self.stats.get_placable_board()
+        elif view == "nonvirgin":
+            array = await self.stats.get_placable_board()
+            array[self.stats.virginmap_array != 0] = 255
+        elif view == "virginmap":
+            array = self.stats.virginmap_array.copy()
+            array[array == 255] = 1
+            array[self.stats.placemap_array != 0] = 255
+            palette = ["#000000", "#00DD00"]
+        else:
+            raise ValueError(f"Unknown board view '{view}'.")
+        if crop is not None:
+            array = crop_array(array, crop)
+        return self.stats.palettize_array(array, palette)
+
+    def _update_versions(self, version: int):
+        """Move the renders of the previous versions to the current version if
+        their area didn't change since, remove the others."""
+        renders = OrderedDict()
+        for key, render in self._renders.items():
+            view, render_version, crop = key
+            new_key = (view, version, crop)
+            if render_version != version and (
+                new_key in self._renders
+                or self.stats.dirty_tiles.has_changed(render_version, crop)
+            ):
+                self.size -= render.size
+                continue
+            renders[new_key] = render
+        self._renders = renders
+
+    async def _get(self, view: str, crop: tuple) -> _Render:
+        version = self.stats.board_version
+        key = (view, version, crop)
+        if key not in self._renders:
+            self._update_versions(version)
+        render = self._renders.get(key)
+        if render is not None:
+            self.hits += 1
+            self._renders.move_to_end(key)
+            return render
+        self.misses += 1
+        render = _Render(await self._render(view, crop))
+        render.array.flags.writeable = False
+        self._renders[key] = render
+        self.size += render.size
+        self._evict()
+        return render
+
+    def _remove(self, key):
+        render = self._renders.pop(key)
+        self.size -= render.size
+
+    def _evict(self):
+        while self.size > self.max_size and len(self._renders) > 1:
+            self._remove(next(iter(self._renders)))
+
+    async def get_array(self, view: str, crop: tuple = None) -> np.ndarray:
+        """Get the RGBA array of a view of the boards (read-only).
+
+        :param crop: (x, y, width, height) of the area to render, the pixels
+            outside of the board are transparent"""
+        return (await self._get(view, crop)).array
+
+    async def get_png(self, view: str, crop: tuple = None) -> bytes:
+        """Same as `get_array()` but get the render as a PNG image."""
+        render = await self._get(view, crop)
+        if render.png is None:
+            render.png = await _encode_png(render.array)
+            if render in self._renders.values():
+                self.size += len(render.png)
+                self._evict()
+        return render.png
+
+    def clear(self):
+        self._renders.clear()
+        self.size = 0
@@ -0,0 +1,136 @@
+import numpy as np
+
+# size (in pixels) of the side of a tile
+TILE_SIZE = 64
+
+
+class DirtyTiles:
+    """The board version at which each tile of the boards last changed.
+
+    The boards are split in tiles of `TILE_SIZE`x`TILE_SIZE` pixels, each
+    change of the board, virginmap or placemap marks the tiles it touched with
+    the new board version (see `PxlsStatsManager.board_version`). A consumer
+    saves the version it computed its result with and only has to compute the
+    tiles changed since this version again."""
+
+    def __init__(self, tile_size: int = TILE_SIZE) -> None:
+        self.tile_size = tile_size
+        self.shape = None
+        # version of the last change of each tile
+        self.versions: np.ndarray = None
+        # number of pixels changed in each tile
+        self.changes: np.ndarray = None
+        # board name: number of tiles different between the previous board and
+        # the board fetched at the last refresh
+        self.refresh_tiles = {}
+
+    def reset(self, shape: tuple, version: int):
+        """Mark all the tiles of a board of the given shape as changed."""
+        nb_rows = -(-shape[0] // self.tile_size)
+        nb_cols = -(-shape[1] // self.tile_size)
+        self.shape = shape
+        self.versions = np.full((nb_rows, nb_cols), version, dtype=np.int64)
+        self.changes = np.zeros((nb_rows, nb_cols), dtype=np.int64)
+
+    def mark_pixels(self, x: np.ndarray, y: np.ndarray, version: int):
+        """Mark the tiles of the pixels (inside the board) as changed."""
+        if self.versions is None:
+            return
+        tile_y = y // self.tile_size
+        tile_x = x // self.tile_size
+        self.versions[tile_y, tile_x] = version
+        np.add.at(self.changes, (tile_y, tile_x), 1)
+
+    def mark_diff(
+        self, name: str, old_array: np.ndarray, new_array: np.ndarray, version: int
+    ):
+        """Mark the tiles where 2 versions of the board `name` are different, all
+        the tiles are changed if the board size changed."""
+        if (
+            old_array is None
+            or self.versions is None
+            or old_array.shape != new_array.shape
+            or new_array.shape != self.shape
+        ):
+            self.reset(new_array.shape, version)
+            self.refresh_tiles[name] = self.versions.size
+            return
+        diff = old_array != new_array
+        rows = np.arange(0, diff.shape[0], self.tile_size)
+        cols = np.arange(0, diff.shape[1], self.tile_size)
+        # number of different pixels in each tile
+        counts = np.add.reduceat(diff, rows, axis=0, dtype=np.int64)
+        counts = np.add.reduceat(counts, cols, axis=1)
+        changed = counts > 0
+        self.versions[changed] = version
+        self.changes += counts
+        self.refresh_tiles[name] = int(np.count_nonzero(changed))
+
+    def _get_tile_slices(self, area: tuple = None):
+        """Get the slices of the tiles in an area (x, y, width, height)."""
+        if area is None:
+            return slice(None), slice(None)
+        x, y, width, height = area
+        ts = self.tile_size
+        return (
+            slice(max(0, y // ts), max(0, -(-(y + height) // ts))),
+            slice(max(0, x // ts), max(0, -(-(x + width) // ts))),
+        )
+
+    def has_changed(self, since: int, area: tuple = None) -> bool:
+        """Check if a tile of an area (x, y, width, height) changed after the
+        version `since`."""
+        if self.versions is None:
+            return True
+        rows, cols = self._get_tile_slices(area)
+        return bool((self.versions[rows, cols] > since).any())
+
+    def get_changed_areas(self, since: int, area: tuple = None) -> list:
+        """Get the tiles changed after the version `since`, as a list of
+        (x0, y0, x1, y1) boxes in the board limits and in the area
+        (x, y, width, height) if given."""
+        if self.versions is None:
+            return []
+        rows, cols = self._get_tile_slices(area)
+        height, width = self.shape
+        x_min, y_min, x_max, y_max = 0, 0, width, height
+        if area is not None:
+            x, y, w, h = area
+            x_min, y_min = max(x, 0), max(y, 0)
+            x_max, y_max = min(x + w, width), min(y + h, height)
+        ts = self.tile_size
+        boxes = []
+        for tile_y, tile_x in np.argwhere(self.versions[rows, cols] > since):
+            tile_y += rows.start or 0
+            tile_x += cols.start or 0
+            x0, y0 = max(tile_x * ts, x_min), max(tile_y * ts, y_min)
+            x1, y1 = min((tile_x + 1) * ts, x_max), min((tile_y + 1) * ts, y_max)
+            if x0 < x1 and y0 < y1:
+                boxes.append((int(x0), int(y0), int(x1), int(y1)))
+        return boxes
+
+    def count_changed(self, since: int) -> int:
+        """Get the number of tiles changed after the version `since`."""
+        if self.versions is None:
+            return 0
+        return int(np.count_nonzero(self.versions > since))
+
+    def get_most_changed(self, limit: int = 5) -> list:
+        """Get the tiles with the most pixels changed, as a list of
+        ((x, y) of the tile top-left corner, number of pixels changed)."""
+        if self.changes is None:
+            return []
+        flat = self.changes.reshape(-1)
+        top = np.argsort(flat)[::-1][:limit]
+        res = []
+        for idx in top:
+            if flat[idx] == 0:
+                break
+            tile_y, tile_x = np.unravel_index(idx, self.changes.shape)
+            res.append(
+                (
+                    (int(tile_x) * self.tile_size, int(tile_y) * self.tile_size),
+                    int(flat[idx]),
+                )
+            )
+        return res
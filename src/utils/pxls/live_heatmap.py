@@ -0,0 +1,132 @@
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from utils.pxls.pixel_journal import PixelJournal
+from utils.pxls.pxls_stats_manager import PxlsStatsManager
+from utils.utils import in_executor
+
+# name: time constant (in seconds) of the activity decay
+HEATMAP_WINDOWS = {"15m": 15 * 60, "1h": 60 * 60, "1d": 24 * 60 * 60}
+DEFAULT_HEATMAP_WINDOW = "1h"
+# time (in seconds) between 2 decays of the activity
+DECAY_INTERVAL = 10
+# activity under which a pixel is shown as inactive
+MIN_ACTIVITY = 0.01
+
+
+class LiveHeatmap:
+    """The activity of each pixel of the board, computed from the pixels
+    received by the websocket.
+
+    Each pixel placed adds 1 to the activity of its position, and the activity
+    decays exponentially with the time constant of the window (a pixel placed
+    one window ago counts for 1/e). There is one activity grid per window of
+    `HEATMAP_WINDOWS`.
+
+    The grids are updated by the websocket thread (`add_pixels()` and
+    `decay()`) and can be read from any thread."""
+
+    def __init__(self, stats: PxlsStatsManager, windows: dict = HEATMAP_WINDOWS):
+        self.stats = stats
+        self.windows = windows
+        self.canvas_code = None
+        self.shape = None
+        self._grids = {}
+        self._last_decay = None
+
+    @property
+    def ready(self) -> bool:
+        return bool(self._grids)
+
+    def reset(self, canvas_code: str, shape: tuple):
+        """Start the activity grids of a canvas from 0."""
+        self._grids = {
+            window: np.zeros(shape[0] * shape[1], dtype=np.float32)
+            for window in self.windows
+        }
+        self.canvas_code = canvas_code
+        self.shape = shape
+        self._last_decay = time.time()
+
+    def load_journal(self, journal: PixelJournal, canvas_code: str, shape: tuple):
+        """Compute the activity grids from the pixels saved in the journal
+        (the pixels older than 5 times the window don't count anymore)."""
+        self.reset(canvas_code, shape)
+        now = self._last_decay
+        height, width = shape
+        for window, tau in self.windows.items():
+            start = datetime.fromtimestamp(now - 5 * tau, timezone.utc)
+            records = journal.read(canvas_code, start)
+            x = records["x"].astype(np.intp)
+            y = records["y"].astype(np.intp)
+            inside = (x < width) & (y < height)
+            age = now - records["time"][inside] / 1000
+            weights = np.exp(-np.maximum(age, 0) / tau)
+            self._grids[window][:] = np.bincount(
+                y[inside] * width + x[inside], weights, minlength=height * width
+            )
+
+    def add_pixels(self, x: np.ndarray, y: np.ndarray, age: np.ndarray = None):
+        """Add the activity of a batch of pixels placed `age` seconds ago, the
+        grids are reset if the canvas or its size changed."""
+        board = self.stats.board_array
+        canvas_code = (self.stats.board_info or {}).get("canvasCode")
+        if board is None or canvas_code is None:
+            return
+        if canvas_code != self.canvas_code or board.shape != self.shape:
+            self.reset(canvas_code, board.shape)
+        height, width = self.shape
+        inside = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+        flat_idx = (y[inside] * width + x[inside]).astype(np.intp)
+        for window, tau in self.windows.items():
+            if age is None:
+                weights = np.float32(1)
+            else:
+                weights = np.exp(-age[inside] / tau).astype(np.float32)
+            # add.at to count the pixels placed more than once
+            np.add.at(self._grids[window], flat_idx, weights)
+
+    def decay(self, force: bool = False):
+        """Decay the activity by the time elapsed since the last decay, at most
+        once every `DECAY_INTERVAL` seconds."""
+        if self._last_decay is None:
+            return
+        now = time.time()
+        elapsed = now - self._last_decay
+        if elapsed < DECAY_INTERVAL and not force:
+            return
+        for window, tau in self.windows.items():
+            self._grids[window] *= np.float32(np.exp(-elapsed / tau))
+        self._last_decay = now
+
+    def get_activity(self, window: str = DEFAULT_HEATMAP_WINDOW) -> np.ndarray:
+        """Get a copy of the activity grid of a window as a 2D array."""
+        return self._grids[window].reshape(self.shape).copy()
+
+    @in_executor()
+    def _get_heatmap(self, window: str) -> np.ndarray:
+        activity = self.get_activity(window)
+        # log scale so the less active areas are still visible
+        max_activity = max(float(activity.max()), 1.0)
+        intensity = np.log1p(activity) / np.log1p(max_activity)
+        heatmap = np.round(254 * (1 - intensity)).astype(np.uint8)
+        heatmap[activity < MIN_ACTIVITY] = 255
+        return heatmap
+
+    async def get_heatmap(self, window: str = DEFAULT_HEATMAP_WINDOW) -> np.ndarray:
+        """Get the heatmap of a window as an array of indexes of a 255 colors
+        palette: 0 for the most active pixels and 255 (transparent) for the
+        inactive ones.
+
+        Use the heatmap of the pxls API if no pixel was received yet."""
+        if window not in self.windows:
+            raise ValueError(
+                "The heatmap window must be one of: {}".format(
+                    ", ".join(f"`{w}`" for w in self.windows)
+                )
+            )
+        if not self.ready:
+            return 255 - await self.stats.fetch_heatmap()
+        return await self._get_heatmap(window)
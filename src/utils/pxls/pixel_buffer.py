@@ -0,0 +1,52 @@
+import time
+
+import numpy as np
+
+# max number of pixels waiting to be applied, the oldest ones are dropped after
+PIXEL_BUFFER_SIZE = 2**18
+
+
+class PixelBuffer:
+    """A ring buffer of the pixels received by the websocket, as (x, y, color)
+    records with the time they were received.
+
+    It isn't thread-safe: the pixels must be added and taken from the same
+    thread. When the buffer is full, the oldest pixels are overwritten (counted
+    in `dropped`)."""
+
+    def __init__(self, capacity: int = PIXEL_BUFFER_SIZE) -> None:
+        self.capacity = capacity
+        self._x = np.empty(capacity, dtype=np.int32)
+        self._y = np.empty(capacity, dtype=np.int32)
+        self._color = np.empty(capacity, dtype=np.int16)
+        self._time = np.empty(capacity, dtype=np.float64)
+        # index of the oldest pixel and number of pixels in the buffer
+        self._start = 0
+        self._len = 0
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        return self._len
+
+    def push(self, x: int, y: int, color: int, received: float = None):
+        if self._len == self.capacity:
+            # overwrite the oldest pixel
+            self._start = (self._start + 1) % self.capacity
+            self._len -= 1
+            self.dropped += 1
+        idx = (self._start + self._len) % self.capacity
+        self._x[idx] = x
+        self._y[idx] = y
+        self._color[idx] = color
+        self._time[idx] = time.perf_counter() if received is None else received
+        self._len += 1
+
+    def pop_all(self):
+        """Take all the pixels of the buffer, in the order they were received.
+
+        :return: the arrays (x, y, color, received)"""
+        idx = (self._start + np.arange(self._len)) % self.capacity
+        res = (self._x[idx], self._y[idx], self._color[idx], self._time[idx])
+        self._start = (self._start + self._len) % self.capacity
+        self._len = 0
+        return res
@@ -0,0 +1,175 @@
+import os
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+basepath = os.path.dirname(__file__)
+JOURNAL_FOLDER = os.path.abspath(
+    os.path.join(basepath, "..", "..", "..", "resources", "pixel_journal")
+)
+# a pixel placed: time (in ms since epoch), coordinates and color index
+RECORD_DTYPE = np.dtype([("time", "<i8"), ("x", "<u2"), ("y", "<u2"), ("color", "u1")])
+
+
+def to_ms(dt: datetime) -> int:
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp() * 1000)
+
+
+class PixelJournal:
+    """An append-only file of the pixels received by the websocket, with one
+    file per canvas.
+
+    The records are fixed-width (`RECORD_DTYPE`) and in the order they were
+    received, so a file can be memory-mapped and a time range found with a
+    binary search. The times appended are clamped to the last time written so
+    they stay sorted if the wall clock goes back.
+
+    The pixels must be appended from a single thread, the files can be read
+    from any thread."""
+
+    def __init__(self, folder: str = JOURNAL_FOLDER) -> None:
+        self.folder = folder
+        self.canvas_code = None
+        self.records_written = 0
+        self._file = None
+        # time of the last record of the current file
+        self._last_time = 0
+
+    def get_path(self, canvas_code: str) -> str:
+        return os.path.join(self.folder, f"c{canvas_code}.bin")
+
+    def _rotate(self, canvas_code: str):
+        """Close the file of the previous canvas and open the one of `canvas_code`."""
+        self.close()
+        os.makedirs(self.folder, exist_ok=True)
+        path = self.get_path(canvas_code)
+        self._file = open(path, "ab")
+        # ignore the end of a record left by an interrupted write
+        partial = self._file.tell() % RECORD_DTYPE.itemsize
+        if partial:
+            self._file.truncate(self._file.tell() - partial)
+            self._file.seek(0, os.SEEK_END)
+        size = self._file.tell()
+        self._last_time = 0
+        if size:
+            last = np.fromfile(
+                path, dtype=RECORD_DTYPE, count=1, offset=size - RECORD_DTYPE.itemsize
+            )
+            self._last_time = int(last["time"][0])
+        self.canvas_code = canvas_code
+
+    def append(self, canvas_code: str, time_ms, x, y, color):
+        """Append a batch of pixels to the journal of the canvas, the pixels
+        outside of the board limits are ignored and the negative colors are
+        saved as transparent (255)."""
+        if canvas_code != self.canvas_code or self._file is None:
+            self._rotate(canvas_code)
+        inside = (x >= 0) & (x <= 0xFFFF) & (y >= 0) & (y <= 0xFFFF)
+        records = np.empty(np.count_nonzero(inside), dtype=RECORD_DTYPE)
+        times = np.asarray(time_ms, dtype=np.int64)[inside]
+        if len(times):
+            times = np.maximum.accumulate(np.maximum(times, self._last_time))
+            self._last_time = int(times[-1])
+        records["time"] = times
+        records["x"] = x[inside]
+        records["y"] = y[inside]
+        records["color"] = color[inside].astype(np.uint8)
+        self._file.write(records.tobytes())
+        # make the records visible to the readers
+        self._file.flush()
+        self.records_written += len(records)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self.canvas_code = None
+
+    def get_size(self, canvas_code: str) -> int:
+        """Get the size of the journal of a canvas (in bytes)."""
+        try:
+            return os.path.getsize(self.get_path(canvas_code))
+        except FileNotFoundError:
+            return 0
+
+    def read(
+        self, canvas_code: str, start: datetime = None, end: datetime = None
+    ) -> np.ndarray:
+        """Get the records of a canvas placed between `start` (included) and
+        `end` (excluded), as a read-only memory-mapped array."""
+        path = self.get_path(canvas_code)
+        nb_records = self.get_size(canvas_code) // RECORD_DTYPE.itemsize
+        if nb_records == 0:
+            return np.empty(0, dtype=RECORD_DTYPE)
+        records = np.memmap(path, dtype=RECORD_DTYPE, mode="r", shape=(nb_records,))
+        times = records["time"]
+        i0 = 0 if start is None else np.searchsorted(times, to_ms(start), "left")
+        i1 = nb_records if end is None else np.searchsorted(times, to_ms(end), "left")
+        return records[i0:i1]
+
+    def replay(
+        self,
+        canvas_code: str,
+        board: np.ndarray,
+        start: datetime = None,
+        end: datetime = None,
+    ) -> np.ndarray:
+        """Place the pixels of a time range on a copy of `board` (array of palette
+        indexes) in the order they were placed."""
+        records = self.read(canvas_code, start, end)
+        board = board.copy()
+        height, width = board.shape
+        x = records["x"].astype(np.intp)
+        y = records["y"].astype(np.intp)
+        inside = (x < width) & (y < height)
+        flat_idx = y[inside] * width + x[inside]
+        # keep the last color placed on each pixel
+        flat_idx, last_idx = np.unique(flat_idx[::-1], return_index=True)
+        board.reshape(-1)[flat_idx] = records["color"][inside][::-1][last_idx]
+        return board
+
+    def count_pixels(
+        self,
+        canvas_code: str,
+        shape: tuple,
+        start: datetime = None,
+        end: datetime = None,
+    ) -> np.ndarray:
+        """Get the number of pixels placed on each pixel of a board of the given
+        shape (height, width) during a time range."""
+        records = self.read(canvas_code, start, end)
+        height, width = shape
+        x = records["x"].astype(np.intp)
+        y = records["y"].astype(np.intp)
+        inside = (x < width) & (y < height)
+        counts = np.bincount(y[inside] * width + x[inside], minlength=height * width)
+        return counts.reshape(shape)
+
+    def count_colors(
+        self, canvas_code: str, start: datetime = None, end: datetime = None
+    ) -> np.ndarray:
+        """Get the number of pixels placed with each color index during a time
+        range (the transparent pixels are at the index 255)."""
+        records = self.read(canvas_code, start, end)
+        return np.bincount(records["color"], minlength=256)
+
+    def get_activity(
+        self,
+        canvas_code: str,
+        start: datetime,
+        end: datetime,
+        interval: timedelta = timedelta(minutes=1),
+    ) -> list:
+        """Get the number of pixels placed in each interval of a time range.
+
+        :return: a list of (datetime, count) for the start of each interval"""
+        records = self.read(canvas_code, start, end)
+        start_ms = to_ms(start)
+        interval_ms = int(interval.total_seconds() * 1000)
+        nb_bins = -(-(to_ms(end) - start_ms) // interval_ms)
+        counts = np.bincount(
+            (records["time"] - start_ms) // interval_ms, minlength=nb_bins
+        )
+        return [(start + i * interval, int(count)) for i, count in enumerate(counts)]
@@ -0,0 +1,97 @@
+import asyncio
+import time
+
+from aiohttp.client_exceptions import ClientConnectionError, InvalidURL
+
+from utils.http_client import BadResponseError, HttpClient, http_client
+
+
+class _EndpointMetrics:
+    def __init__(self) -> None:
+        self.requests = 0
+        self.not_modified = 0
+        self.errors = 0
+        self.bytes = 0
+        self.total_time = 0.0
+        self.last_time = 0.0
+
+
+class PxlsApiClient:
+    """A client for the pxls API, using the connections of the shared HTTP client.
+
+    The requests of the endpoints fetched with `conditional=True` send the
+    `ETag`/`Last-Modified` of the previous response so the content isn't
+    downloaded again if it didn't change. The latency and the size of the
+    responses are saved per endpoint (see `get_metrics()`)."""
+
+    def __init__(self, base_url: str, http: HttpClient = http_client) -> None:
+        self.base_url = base_url
+        self.http = http
+        # endpoint: (ETag, Last-Modified) of the last response
+        self._validators = {}
+        self._metrics = {}
+
+    async def get(self, endpoint: str, content_type: str, conditional: bool = False):
+        """Send a GET request to the endpoint and return the response as json
+        or bytes (`content_type` "json" or "bytes").
+
+        With `conditional`, return None if the content didn't change since the
+        previous request. Raise BadResponseError or ValueError."""
+        metrics = self._metrics.setdefault(endpoint, _EndpointMetrics())
+        headers = {}
+        if conditional and endpoint in self._validators:
+            etag, last_modified = self._validators[endpoint]
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+
+        start = time.perf_counter()
+        metrics.requests += 1
+        failed = True
+        try:
+            async with self.http.session.get(
+                self.base_url + endpoint, headers=headers
+            ) as r:
+                if r.status == 304 and headers:
+                    metrics.not_modified += 1
+                    failed = False
+                    return None
+                if r.status != 200:
+                    raise BadResponseError(f"The URL leads to an error {r.status}")
+                content = await r.read()
+                self._validators[endpoint] = (
+                    r.headers.get("ETag"),
+                    r.headers.get("Last-Modified"),
+                )
+                metrics.bytes += len(content)
+                if content_type == "json":
+                    content = await r.json()
+                failed = False
+                return content
+        except InvalidURL:
+            raise ValueError("The URL provided is invalid.")
+        except asyncio.TimeoutError:
+            raise ValueError("Couldn't connect to URL. (Timeout)")
+        except ClientConnectionError:
+            raise ValueError("Couldn't connect to URL.")
+        finally:
+            if failed:
+                metrics.errors += 1
+            metrics.last_time = time.perf_counter() - start
+            metrics.total_time += metrics.last_time
+
+    def get_metrics(self) -> dict:
+        """Get the metrics of each endpoint requested
+        (format: {endpoint: {requests, not_modified, errors, bytes, avg_ms, last_ms}})"""
+        return {
+            endpoint: {
+                "requests": m.requests,
+                "not_modified": m.not_modified,
+                "errors": m.errors,
+                "bytes": m.bytes,
+                "avg_ms": m.total_time / m.requests * 1000 if m.requests else 0,
+                "last_ms": m.last_time * 1000,
+            }
+            for endpoint, m in self._metrics.items()
+        }
@@ -7,10 +7,14 @@ import pytz
 from PIL import ImageColor
 
 from utils.log import get_logger
-from utils.utils import get_content
+from utils.pxls.dirty_tiles import DirtyTiles
+from utils.pxls.pxls_api_client import PxlsApiClient
 
 logger = get_logger(__name__)
 
+# max number of palette lookup tables cached
+PALETTE_LUT_CACHE_SIZE = 32
+
 
 class PxlsStatsManager:
     """A helper to get data from pxls.space/stats"""
@@ -22,11 +26,19 @@ class PxlsStatsManager:
         self.current_canvas_code = None
         self.online_count = None
         self.db_conn = db_conn
+        self.api = PxlsApiClient(self.base_url)
 
         self.board_array = None
         self.virginmap_array = None
         self.placemap_array = None
+        self.initial_canvas_array = None
+        # incremented each time one of the boards changes
+        self.board_version = 0
+        # version of the last change of each area of the boards
+        self.dirty_tiles = DirtyTiles()
         self.palette = None
+        # lookup tables of the palettes used with `palettize_array()`
+        self._palette_luts = {}
 
     async def refresh(self):
 
@@ -119,6 +131,7 @@ class PxlsStatsManager:
 
     async def update_palette(self):
         self.palette = None
+        self._palette_luts = {}
         try:
             self.palette = self.board_info["palette"]
         except Exception:
@@ -180,64 +193,97 @@ class PxlsStatsManager:
                 VALUES(?,?,?,?)"""
         await self.db_conn.sql_update(sql, ("online_count", count, canvas_code, dt))
 
+    def get_palette_lut(self, palette=None) -> np.ndarray:
+        """Get the lookup table of a palette: a read-only 256x4 array with the
+        RGBA color of each index (255 and the indexes not in the palette are
+        transparent). If no palette is given, the current pxls palette is used.
+
+        The tables are cached until the palette is updated."""
+        key = tuple(palette) if palette else None
+        lut = self._palette_luts.get(key)
+        if lut is not None:
+            return lut
+        if not palette:
+            palette = [f"#{c['value']}" for c in self.get_palette(restricted=True)]
+        lut = np.zeros((256, 4), dtype=np.uint8)
+        for i, color in enumerate(palette[:255]):
+            lut[i] = ImageColor.getcolor(color, "RGBA")
+        lut.flags.writeable = False
+        if len(self._palette_luts) >= PALETTE_LUT_CACHE_SIZE:
+            # remove the oldest table
+            del self._palette_luts[next(iter(self._palette_luts))]
+        self._palette_luts[key] = lut
+        return lut
+
     def palettize_array(self, array, palette=None):
         """Convert a numpy array of palette indexes to a color numpy array
         (RGBA). If a palette is given, it will be used to map the array, if not
         the current pxls palette will be used"""
-        colors_list = []
-        if not palette:
-            palette = [f"#{c['value']}" for c in self.get_palette(restricted=True)]
-        for color in palette:
-            rgb = ImageColor.getcolor(color, "RGBA")
-            colors_list.append(rgb)
-        colors_dict = dict(enumerate(colors_list))
-        colors_dict[255] = (0, 0, 0, 0)
-
-        img = np.stack(np.vectorize(colors_dict.get)(array), axis=-1)
-        return img.astype(np.uint8)
+        return np.take(self.get_palette_lut(palette), array, axis=0)
+
+    def decode_board(self, board_bytes) -> np.ndarray:
+        """Get a read-only 2D array of the board bytes without copying them."""
+        height, width = self.board_info["height"], self.board_info["width"]
+        if len(board_bytes) != height * width:
+            raise ValueError(
+                f"The board has {len(board_bytes)} bytes, expected {height * width} "
+                f"({width}x{height})."
+            )
+        return np.frombuffer(board_bytes, dtype=np.uint8).reshape(height, width)
+
+    def _swap_board(self, name, board_bytes) -> np.ndarray:
+        """Copy the board bytes in a new array and replace the board attribute
+        `name` with it.
+
+        The boards updated by the websocket need a writable array. The previous
+        array isn't reused: the renders and the commands running in an executor
+        can still be reading it."""
+        board = self.decode_board(board_bytes).copy()
+        previous = getattr(self, name)
+        setattr(self, name, board)
+        self.board_version += 1
+        self.dirty_tiles.mark_diff(name, previous, board, self.board_version)
+        return board
 
     async def fetch_board(self):
         "fetch the board with a get request"
         board_bytes = await self.query("boarddata", "bytes")
-        board_array = np.asarray(list(board_bytes), dtype=np.uint8).reshape(
-            self.board_info["height"], self.board_info["width"]
-        )
-        self.board_array = board_array
-        return board_array
+        return self._swap_board("board_array", board_bytes)
 
     async def fetch_virginmap(self):
         "fetch the virgin map with a get request"
         board_bytes = await self.query("virginmap", "bytes")
-        board_array = np.asarray(list(board_bytes), dtype=np.uint8).reshape(
-            self.board_info["height"], self.board_info["width"]
-        )
-        self.virginmap_array = board_array
-        return board_array
+        return self._swap_board("virginmap_array", board_bytes)
 
     async def fetch_heatmap(self):
-        "fetch the heatmap with a get request"
+        "fetch the heatmap with a get request (as a read-only array)"
         board_bytes = await self.query("heatmap", "bytes")
-        board_array = np.asarray(list(board_bytes), dtype=np.uint8).reshape(
-            self.board_info["height"], self.board_info["width"]
-        )
-        return board_array
+        return self.decode_board(board_bytes)
 
     async def fetch_initial_canvas(self):
-        "fetch the initial canvas with a get request"
-        board_bytes = await self.query("initialboarddata", "bytes")
-        board_array = np.asarray(list(board_bytes), dtype=np.uint8).reshape(
-            self.board_info["height"], self.board_info["width"]
+        "fetch the initial canvas with a get request (as a read-only array)"
+        # only downloaded again if it changed
+        board_bytes = await self.query(
+            "initialboarddata", "bytes", conditional=self.initial_canvas_array is not None
         )
-        return board_array
+        if board_bytes is not None:
+            self.initial_canvas_array = self.decode_board(board_bytes)
+        return self.initial_canvas_array
 
     async def fetch_placemap(self):
-        "fetch the placemap with a get request"
-        board_bytes = await self.query("placemap", "bytes")
-        board_array = np.asarray(list(board_bytes), dtype=np.uint8).reshape(
-            self.board_info["height"], self.board_info["width"]
+        "fetch the placemap with a get request (as a read-only array)"
+        # only downloaded again if it changed
+        board_bytes = await self.query(
+            "placemap", "bytes", conditional=self.placemap_array is not None
         )
-        self.placemap_array = board_array
-        return board_array
+        if board_bytes is not None:
+            previous = self.placemap_array
+            self.placemap_array = self.decode_board(board_bytes)
+            self.board_version += 1
+            self.dirty_tiles.mark_diff(
+                "placemap_array", previous, self.placemap_array, self.board_version
+            )
+        return self.placemap_array
 
     async def get_placable_board(self):
         """fetch the board as an index array and use the placemap as a mask"""
@@ -249,17 +295,36 @@ class PxlsStatsManager:
 
         return placeable_board
 
-    def update_board_pixel(self, x, y, color):
-        self.board_array[y, x] = color
-
-    def update_virginmap_pixel(self, x, y, color):
-        self.virginmap_array[y, x] = 0
-
-    async def query(self, endpoint, content_type):
-        url = self.base_url + endpoint
+    def update_pixels(self, x: np.ndarray, y: np.ndarray, color: np.ndarray):
+        """Place a batch of pixels on the board and the virgin map, in order
+        (if a pixel is placed more than once, the last color is kept).
+
+        The pixels outside of the boards are ignored and the negative colors
+        are transparent (255)."""
+        arrays = [a for a in (self.board_array, self.virginmap_array) if a is not None]
+        if not arrays or len(x) == 0:
+            return
+        height, width = arrays[0].shape
+        inside = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+        flat_idx = (y[inside] * width + x[inside]).astype(np.intp)
+        color = color[inside]
+        # keep the last occurrence of each pixel (the assignment of repeated
+        # indexes has no guaranteed order)
+        flat_idx, last_idx = np.unique(flat_idx[::-1], return_index=True)
+        color = color[::-1][last_idx].astype(np.uint8)
+        if self.board_array is not None:
+            self.board_array.reshape(-1)[flat_idx] = color
+        if self.virginmap_array is not None:
+            self.virginmap_array.reshape(-1)[flat_idx] = 0
+        self.board_version += 1
+        self.dirty_tiles.mark_pixels(
+            flat_idx % width, flat_idx // width, self.board_version
+        )
 
-        cookies = {}
-        return await get_content(url, content_type, cookies=cookies)
+    async def query(self, endpoint, content_type, conditional=False):
+        """Get the content of a pxls API endpoint, with `conditional` the result
+        is None if it didn't change since the last query."""
+        return await self.api.get(endpoint, content_type, conditional)
 
     def get_cd(self, online_count: int, multiplier: float = None):
         """Get the cooldown for a given amount of online users"""
@@ -23,7 +23,7 @@ from utils.image.gif_saver import save_transparent_gif
 from utils.image.image_utils import highlight_image
 from utils.log import get_logger
 from utils.pxls.template import get_rgba_palette, reduce
-from utils.setup import PXLS_URL, db_templates, stats
+from utils.setup import PXLS_URL, board_renders, db_templates, stats
 from utils.time_converter import round_minutes_down, td_format
 from utils.utils import get_content, in_executor
 
@@ -70,6 +70,8 @@ class Template:
         # progress (init with self.update_progress())
         self.placed_mask = None
         self.current_progress = None
+        # board version of the last progress update
+        self.progress_version = None
 
     def get_array(self) -> np.ndarray:
         """Return the template image as an array of RGB colors"""
@@ -98,9 +100,44 @@ class Template:
         return placed_mask
 
     def update_progress(self, board_array=None) -> int:
-        """Update the mask with the correct pixels and the number of correct pixels."""
-        self.placed_mask = self.make_placed_mask(board_array)
-        self.current_progress = int(np.sum(self.placed_mask))
+        """Update the mask with the correct pixels and the number of correct pixels.
+
+        With the current board, only the tiles of the board changed since the
+        last update are checked again (see `PxlsStatsManager.dirty_tiles`)."""
+        version = stats.board_version
+        changed_areas = None
+        if (
+            board_array is None
+            and self.placed_mask is not None
+            and self.progress_version is not None
+        ):
+            area = (self.ox, self.oy, self.width, self.height)
+            changed_areas = stats.dirty_tiles.get_changed_areas(
+                self.progress_version, area
+            )
+            # faster to update everything at once if a large part of the
+            # template changed (a tile costs more than its pixels in a full update)
+            changed_size = sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in changed_areas)
+            if changed_size > self.width * self.height / 8:
+                changed_areas = None
+        if changed_areas is not None:
+            for x0, y0, x1, y1 in changed_areas:
+                # coordinates in the template
+                tx0, tx1 = x0 - self.ox, x1 - self.ox
+                ty0, ty1 = y0 - self.oy, y1 - self.oy
+                placed = self.palettized_array[ty0:ty1, tx0:tx1] == (
+                    stats.board_array[y0:y1, x0:x1]
+                )
+                placed &= self.placeable_mask[ty0:ty1, tx0:tx1]
+                self.current_progress += int(
+                    np.sum(placed) - np.sum(self.placed_mask[ty0:ty1, tx0:tx1])
+                )
+                self.placed_mask[ty0:ty1, tx0:tx1] = placed
+        else:
+            self.placed_mask = self.make_placed_mask(board_array)
+            self.current_progress = int(np.sum(self.placed_mask))
+        # the progress of another board can't be updated with the changed tiles
+        self.progress_version = version if board_array is None else None
         return self.current_progress
 
     def crop_array_to_template(self, array: np.ndarray) -> np.ndarray:
@@ -173,11 +210,12 @@ class Template:
         opacity: the opacity of the canvas."""
         if array is None:
             array = self.get_array()
-        board = await stats.get_placable_board()
-        cropped_board = self.crop_array_to_template(board)
+        crop = (self.ox, self.oy, self.width, self.height)
+        # the cached render is read-only and highlight_image() changes it
+        cropped_board_array = (await board_renders.get_array("placeable", crop)).copy()
         if crop_to_template:
-            cropped_board[~self.placeable_mask] = 255
-        cropped_board_array = stats.palettize_array(cropped_board)
+            # transparent
+            cropped_board_array[~self.placeable_mask] = 0
         return highlight_image(array, cropped_board_array, opacity, (0, 0, 0, 255))
 
     def get_wrong_pixels_mask(self):
@@ -199,11 +237,17 @@ class Template:
         abuse_mask = np.logical_and(template_virginmap, self.placed_mask)
         return int(np.sum(abuse_mask))
 
+    async def get_progresses_at(self, dts: list[datetime]) -> list[tuple]:
+        """Get the template progress at each datetime of a list with a single query
+        (the values are (None, None) where the template doesnt have data)"""
+        progresses = (await db_templates.get_templates_progress([self], dts))[0]
+        return [(p["datetime"], p["progress"]) if p else (None, None) for p in progresses]
+
     async def get_eta(self, as_string=True):
         now = round_minutes_down(datetime.utcnow())
         td = timedelta(days=7)
-        old_datetime, old_progress = await self.get_progress_at(now - td)
-        now_datetime, now_progress = await self.get_progress_at(now)
+        progresses = await self.get_progresses_at([now - td, now])
+        (old_datetime, old_progress), (now_datetime, now_progress) = progresses
         if old_progress is None or now_progress is None:
             return None, None
 
@@ -403,6 +447,8 @@ class Combo(Template):
         # progress (init with self.update_progress())
         self.placed_mask = None
         self.current_progress = None
+        # board version of the last progress update
+        self.progress_version = None
 
 
 class TemplateManager:
@@ -770,6 +816,8 @@ class TemplateManager:
         self.combo.palettized_array[stats.placemap_array == 255] = 255
         # update the placeable mask
         self.combo.placeable_mask = self.combo.make_placeable_mask()
+        # the progress must be computed again with the new image
+        self.combo.progress_version = None
         self.combo.total_placeable = int(np.sum(self.combo.placeable_mask))
         return self.combo
 
@@ -1,42 +1,187 @@
 import asyncio
 import json
 import threading
+import time
 import uuid
+from collections import deque
 
 import websockets
 
 from utils.log import get_logger
+from utils.pxls.live_heatmap import LiveHeatmap
+from utils.pxls.pixel_buffer import PixelBuffer
+from utils.pxls.pixel_journal import PixelJournal
 
 logger = get_logger("pxls_websocket")
 
+# time (in seconds) between 2 updates of the boards with the pixels received
+APPLY_INTERVAL = 0.1
+# time window (in seconds) of the events/sec rate
+RATE_WINDOW = 60
+
 
 class WebsocketClient:
     """A threaded websocket client to update the canvas board and online count
-    in real-time."""
+    in real-time.
+
+    The pixels received are buffered and placed on the boards in batches every
+    `APPLY_INTERVAL` seconds. While paused, the pixels stay in the buffer and
+    are placed when the client is resumed."""
 
-    def __init__(self, uri: str, stats_manager):
+    def __init__(
+        self,
+        uri: str,
+        stats_manager,
+        journal: PixelJournal = None,
+        heatmap: LiveHeatmap = None,
+    ):
         self.uri = uri
         self.stats = stats_manager
+        # where the pixels placed are saved (optional)
+        self.journal = journal
+        # activity of the pixels placed (optional)
+        self.heatmap = heatmap
         self.loop = asyncio.new_event_loop()
         self.thread = threading.Thread(target=self._start, daemon=True)
         self._paused = False
         self.status = False
 
+        self.buffer = PixelBuffer()
+        # held while a batch is placed on the boards
+        self._apply_lock = threading.Lock()
+        # metrics
+        self.events_received = 0
+        self.events_applied = 0
+        self.batches = 0
+        self.last_batch_size = 0
+        self.total_apply_time = 0.0
+        self.max_apply_time = 0.0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        # (time, events received) sampled at each tick
+        self._rate_samples = deque()
+
     def start(self):
         """Start the websocket in a separate thread."""
         self.thread.start()
 
     def _start(self):
-        self.loop.run_until_complete(self._listen())
+        self.loop.run_until_complete(self._run())
+
+    async def _run(self):
+        self._load_heatmap()
+        await asyncio.gather(self._listen(), self._apply_loop())
+
+    def _load_heatmap(self):
+        """Compute the activity of the current canvas from the journal."""
+        canvas_code = (self.stats.board_info or {}).get("canvasCode")
+        board = self.stats.board_array
+        if self.heatmap is None or self.journal is None:
+            return
+        if canvas_code is None or board is None:
+            return
+        try:
+            self.heatmap.load_journal(self.journal, canvas_code, board.shape)
+        except Exception:
+            logger.exception("Couldn't load the heatmap from the journal")
 
     def pause(self):
-        """Pause the websocket."""
+        """Stop placing the pixels received on the boards until `resume()`,
+        wait for the batch being placed if there is one."""
         self._paused = True
+        with self._apply_lock:
+            pass
 
     def resume(self):
-        """Resume the websocket."""
+        """Place the pixels received while paused and the next ones."""
         self._paused = False
 
+    async def _apply_loop(self):
+        while True:
+            await asyncio.sleep(APPLY_INTERVAL)
+            try:
+                self._sample_rate()
+                if not self._paused:
+                    self._apply()
+                if self.heatmap is not None:
+                    self.heatmap.decay()
+            except Exception:
+                logger.exception("Websocket client raised")
+
+    def _apply(self):
+        """Place the buffered pixels on the boards."""
+        with self._apply_lock:
+            # checked again in case the client was paused while waiting for the lock
+            if self._paused or len(self.buffer) == 0:
+                return
+            start = time.perf_counter()
+            x, y, color, received = self.buffer.pop_all()
+            self.stats.update_pixels(x, y, color)
+        now = time.perf_counter()
+        latency = now - received
+        apply_time = now - start
+
+        self.batches += 1
+        self.last_batch_size = len(x)
+        self.events_applied += len(x)
+        self.total_apply_time += apply_time
+        self.max_apply_time = max(self.max_apply_time, apply_time)
+        self.total_latency += float(latency.sum())
+        self.max_latency = max(self.max_latency, float(latency.max()))
+
+        if self.heatmap is not None:
+            self.heatmap.add_pixels(x, y, now - received)
+        if self.journal is not None:
+            self._write_journal(x, y, color, received, now)
+
+    def _write_journal(self, x, y, color, received, now):
+        """Save a batch of pixels in the journal of the current canvas."""
+        canvas_code = (self.stats.board_info or {}).get("canvasCode")
+        if canvas_code is None:
+            return
+        # convert the reception times to ms since epoch
+        time_ms = ((received + (time.time() - now)) * 1000).astype("int64")
+        self.journal.append(canvas_code, time_ms, x, y, color)
+
+    def _sample_rate(self):
+        now = time.perf_counter()
+        self._rate_samples.append((now, self.events_received))
+        while now - self._rate_samples[0][0] > RATE_WINDOW:
+            self._rate_samples.popleft()
+
+    def get_metrics(self) -> dict:
+        """Get the counters of the pixels received and placed on the boards.
+
+        The latency is the time between the reception of a pixel and the moment
+        it's placed on the boards, the apply time is the time to place a batch."""
+        if len(self._rate_samples) > 1:
+            (t0, n0), (t1, n1) = self._rate_samples[0], self._rate_samples[-1]
+            events_per_sec = (n1 - n0) / (t1 - t0)
+        else:
+            events_per_sec = 0
+        return {
+            "connected": self.status,
+            "paused": self._paused,
+            "events_received": self.events_received,
+            "events_applied": self.events_applied,
+            "events_dropped": self.buffer.dropped,
+            "buffered": len(self.buffer),
+            "events_per_sec": events_per_sec,
+            "batches": self.batches,
+            "last_batch_size": self.last_batch_size,
+            "avg_latency_ms": (
+                self.total_latency / self.events_applied * 1000
+                if self.events_applied
+                else 0
+            ),
+            "max_latency_ms": self.max_latency * 1000,
+            "avg_apply_ms": (
+                self.total_apply_time / self.batches * 1000 if self.batches else 0
+            ),
+            "max_apply_ms": self.max_apply_time * 1000,
+            "journal_records": self.journal.records_written if self.journal else 0,
+        }
+
     async def _listen(self):
 
         while True:
@@ -49,18 +194,17 @@ class WebsocketClient:
                     self.status = True
                     logger.info("Websocket connected")
                     async for message in websocket:
-                        while self._paused:
-                            pass
                         try:
                             message_json = json.loads(message)
 
                             if message_json["type"] == "pixel":
+                                received = time.perf_counter()
                                 pixels = message_json["pixels"]
                                 for pixel in pixels:
-                                    if self.stats.board_array is not None:
-                                        self.stats.update_board_pixel(**pixel)
-                                    if self.stats.virginmap_array is not None:
-                                        self.stats.update_virginmap_pixel(**pixel)
+                                    self.buffer.push(
+                                        pixel["x"], pixel["y"], pixel["color"], received
+                                    )
+                                self.events_received += len(pixels)
                             if message_json["type"] == "users":
                                 count = message_json["count"]
                                 self.stats.online_count = count
@@ -5,12 +5,19 @@ from dotenv import load_dotenv
 
 from database.db_canvas_manager import DbCanvasManager
 from database.db_connection import DbConnection
+from database.db_migration_manager import DbMigrationManager
+from database.db_retention_manager import DbRetentionManager
 from database.db_servers_manager import DbServersManager
 from database.db_stats_manager import DbStatsManager
 from database.db_template_manager import DbTemplateManager
 from database.db_user_manager import DbUserManager
+from database.pxls_name_index import PxlsNameIndex
 from utils.image.imgur import Imgur
 from utils.image.s3compat import S3Compat
+from utils.log import get_logger
+from utils.pxls.board_render_cache import BoardRenderCache
+from utils.pxls.live_heatmap import LiveHeatmap
+from utils.pxls.pixel_journal import PixelJournal
 from utils.pxls.pxls_stats_manager import PxlsStatsManager
 from utils.pxls.websocket_client import WebsocketClient
 
@@ -25,25 +32,37 @@ SERVER_INVITE = os.getenv("SERVER_INVITE")
 PXLS_URL = os.getenv("PXLS_URL")
 PXLS_URL_API = os.getenv("PXLS_URL_API")
 
+# handlers of the loggers of the database package
+get_logger("database")
+
 # database connection
 db_conn = DbConnection()
 
 # connection with the pxls API
 stats = PxlsStatsManager(db_conn, PXLS_URL_API)
+# renders of the current boards
+board_renders = BoardRenderCache(stats)
 
 # default prefix
 DEFAULT_PREFIX = ">"
 
 # database managers
-db_stats = DbStatsManager(db_conn, stats)
+pxls_names = PxlsNameIndex(db_conn)
+db_stats = DbStatsManager(db_conn, stats, pxls_names)
 db_servers = DbServersManager(db_conn, DEFAULT_PREFIX)
-db_users = DbUserManager(db_conn)
+db_users = DbUserManager(db_conn, pxls_names)
+db_migrations = DbMigrationManager(db_conn, pxls_names)
 db_templates = DbTemplateManager(db_conn)
 db_canvas = DbCanvasManager(db_conn)
+db_retention = DbRetentionManager(db_conn)
 
 # websocket
 ws_uri = os.getenv("PXLS_WEBSOCKET")
-ws_client = WebsocketClient(ws_uri, stats)
+# journal of the pixels received by the websocket
+pixel_journal = PixelJournal()
+# activity of the pixels received by the websocket
+live_heatmap = LiveHeatmap(stats)
+ws_client = WebsocketClient(ws_uri, stats, pixel_journal, live_heatmap)
 
 # guild IDs
 test_server_id = os.getenv("TEST_SERVER_ID")
@@ -82,5 +101,5 @@ s3compat_app = S3Compat(
     S3_COMPAT_SECRET_KEY,
     S3_COMPAT_ENDPOINT,
     S3_COMPAT_BUCKET_NAME,
-    S3_COMPAT_ACCESS_URL
+    S3_COMPAT_ACCESS_URL,
 )
@@ -7,61 +7,32 @@ import re
 import timeit
 from typing import Awaitable, Callable, Optional, TypeVar
 
-import aiohttp
 import numpy as np
-from aiohttp.client_exceptions import ClientConnectionError, InvalidURL
 from typing_extensions import ParamSpec
 
+from utils.http_client import BadResponseError, http_client  # noqa: F401
+
 T = TypeVar("T")
 P = ParamSpec("P")
 _MaybeEventLoop = Optional[asyncio.AbstractEventLoop]
 
 
-class BadResponseError(Exception):
-    """Raised when response code isn't 200."""
-
-
 async def get_content(url: str, content_type, **kwargs):
     """Send a GET request to the url and return the response as json or bytes.
-    Raise BadResponseError or ValueError."""
+    Raise BadResponseError or ValueError.
+
+    The request uses the shared HTTP client, the `kwargs` are passed to
+    `HttpClient.get()` (headers, cookies, max_size)."""
     # check if the URL is a data URL
     data = check_data_url(url)
-    # set headers for user-agent
-    headers = {
-            'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36'
-        }
     if content_type == "image":
-        if url.startswith('https://imgur.com/'):
-            reurl = re.search(r'https://imgur\.com/([^?#]*)', url)
+        if url.startswith("https://imgur.com/"):
+            reurl = re.search(r"https://imgur\.com/([^?#]*)", url)
             image_hash = reurl.group(1)
             url = f"https://i.imgur.com/{image_hash}.png"
     if data:
         return data
-    timeout = aiohttp.ClientTimeout(
-        sock_connect=10.0, sock_read=10.0
-    )  # set a timeout of 10 seconds
-    async with aiohttp.ClientSession(timeout=timeout, **kwargs) as session:
-        try:
-            async with session.get(url, headers=headers) as r:
-                if r.status == 200:
-                    if content_type == "json":
-                        return await r.json()
-                    if content_type == "bytes":
-                        return await r.read()
-                    if content_type == "image":
-                        content_type = r.headers["content-type"]
-                        if "image" not in content_type:
-                            raise ValueError("The URL doesn't contain any image.")
-                        else:
-                            return await r.read()
-                else:
-                    raise BadResponseError(f"The URL leads to an error {r.status}")
-        except InvalidURL:
-            raise ValueError("The URL provided is invalid.")
-        except asyncio.TimeoutError:
-            raise ValueError("Couldn't connect to URL. (Timeout)")
-        except ClientConnectionError:
-            raise ValueError("Couldn't connect to URL.")
+    return await http_client.get(url, content_type, **kwargs)
 
 
 def check_data_url(url):